@@ -13,4 +13,7 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bloodlink.settings")
 
+# the json endpoints that have async versions use them under ASGI (settings.ASYNC_VIEWS)
+os.environ.setdefault("ASYNC_VIEWS", "1")
+
 application = get_asgi_application()
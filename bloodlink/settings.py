@@ -19,6 +19,11 @@ import os
 load_dotenv()
 HERE_API_KEY = os.getenv('HERE_API_KEY')
 
+# geocoding endpoint (overridable so tests and local dev can point it at a stub server) and how long a geocode result is reused, see
+# compatibility/geocoding.py
+HERE_GEOCODE_URL = os.getenv('HERE_GEOCODE_URL', "https://geocode.search.hereapi.com/v1/geocode")
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30
+
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -138,6 +143,31 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# local memory by default, every process then keeps its own entries of the map region cache (compatibility/region_cache.py, keyed on the
+# table versions in the database so edits from any process invalidate it) and its own hit/miss counters. CACHE_BACKEND/CACHE_LOCATION
+# switch to a shared cache, for example django.core.cache.backends.redis.RedisCache and redis://127.0.0.1:6379
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# donor_list_api page size, and the most donors a client can ask for in one page
+DONOR_LIST_PAGE_SIZE = 15
+DONOR_LIST_MAX_PAGE_SIZE = 100
+
+# serve donor_list_api and active_requests_api through the fast serialization path in serializers.py (same JSON, less CPU per row)
+FAST_JSON_SERIALIZATION = False
+
+# serve the read only json endpoints and the geocode proxy with their async versions (compatibility/async_views.py), bloodlink/asgi.py turns
+# this on so an ASGI server gets them and the WSGI server keeps the sync ones
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "") == "1"
+
+# where the live request events go, the default only reaches streams served by the same process, so the notify_worker fan-out sends no live
+# events with it (see compatibility/events.py)
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "compatibility.events.InProcessBroker")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
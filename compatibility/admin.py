@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import User, Donor, DonationRequest, BloodMatchHistory
+from .models import (
+    User, Donor, DonationRequest, BloodMatchHistory, Location, GeocodeCacheEntry, GeocodeJob, Notification,
+    NotificationFanout,
+)
 
 
 # UserAdmin
@@ -85,9 +88,51 @@ class BloodMatchHistoryAdmin(admin.ModelAdmin):
     )
 
 
+# cached HERE geocode responses, deleting a row forces the next lookup of that query to go to HERE again (after the in-process cache expires)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    """ browsing the geocode cache """
+
+    list_display = ('query', 'fetched_at', 'expires_at')
+    search_fields = ('query',)
+    readonly_fields = ('key', 'fetched_at')
+
+
+# background geocoding queue, a Failed job can be retried by setting it back to Pending
+class GeocodeJobAdmin(admin.ModelAdmin):
+    """ watching the geocode queue """
+
+    list_display = ('donor', 'query', 'status', 'attempts', 'run_after', 'last_error')
+    list_filter = ('status',)
+    search_fields = ('query', 'donor__user__username')
+    readonly_fields = ('claim', 'claimed_at', 'updated_at')
+
+
+# in-app notifications written by the request fan-out
+class NotificationAdmin(admin.ModelAdmin):
+    """ notifications sent to users """
+
+    list_display = ('user', 'message', 'created_at', 'read_at')
+    search_fields = ('user__username', 'message')
+    raw_id_fields = ('user', 'donation_request')
+
+
+# request fan-out queue, a Failed fan-out can be retried by setting it back to Pending (it carries on from its cursor)
+class NotificationFanoutAdmin(admin.ModelAdmin):
+    """ watching the fan-out queue """
+
+    list_display = ('donation_request', 'status', 'notified', 'emailed', 'attempts', 'run_after', 'last_error')
+    list_filter = ('status',)
+    readonly_fields = ('last_blood_type', 'last_donor_id', 'claim', 'claimed_at', 'updated_at')
+
+
 # Register the actual models
 admin.site.register(User, UserAdmin)
 admin.site.register(Donor, DonorAdmin)
 admin.site.register(DonationRequest, DonationRequestAdmin)
 admin.site.register(BloodMatchHistory)
 
+admin.site.register(Location)
+admin.site.register(GeocodeCacheEntry, GeocodeCacheEntryAdmin)
+admin.site.register(GeocodeJob, GeocodeJobAdmin)
+admin.site.register(Notification, NotificationAdmin)
+admin.site.register(NotificationFanout, NotificationFanoutAdmin)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DonationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "compatibility"
+
+    def ready(self):
+        # registers the startup system checks and the model signal receivers
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,99 @@
+# async versions of the read only json endpoints and the geocode proxy, used instead of the ones in views.py when the app is served over ASGI
+# (settings.ASYNC_VIEWS, which asgi.py turns on). They build the same queries as the sync views and run them with the async ORM, and the
+# geocode proxy calls HERE with httpx (geocoding.ageocode), so a request that is waiting on the database or on HERE doesnt hold a thread and
+# one process can serve many map and list requests at once.
+# They always answer with compact json, the same bytes as DRF's JSONRenderer (serializers.py fast path). The browsable api only exists on the
+# sync views. Like those (api_view(["GET"]), require_GET) they answer anything but GET/HEAD with a 405.
+# The notifications event stream (server-sent events) only exists here, views.notifications is what the WSGI server answers instead.
+
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from .events import event_stream
+from .geocoding import GeocodingError, ageocode
+from .models import Donor
+from .region_cache import aget_region_counts, aset_region_counts
+from .serializers import afast_donation_request_data, afast_donor_data, render_json
+from .versions import DONATION_REQUEST, DONOR, USER, conditional_on
+from .views import (
+    active_requests_query, donor_list_page_query, donor_region_groups, encode_cursor, merge_region_groups, received_request_data,
+    received_requests,
+)
+
+
+@require_GET
+async def geocode_proxy(request):
+    """ api interactins in the backend only """
+
+    query = request.GET.get("q")
+    if not query:
+        return JsonResponse({"error": "Missing query"}, status=400)
+
+    try:
+        return JsonResponse(await ageocode(query))
+    except GeocodingError:
+        return JsonResponse({"error": "Geocoding service unavailable"}, status=502)
+
+
+@require_GET
+@conditional_on(DONOR, USER)
+async def donor_locations_api(request):
+    """ donor counts per region for the map, see views.donor_locations_api """
+
+    blood_type = request.GET.get("blood_type", "").strip()
+    location = request.GET.get("location", "").strip()
+
+    key, response_data = await aget_region_counts(request, blood_type, location)
+    if response_data is None:
+        response_data = merge_region_groups([group async for group in donor_region_groups(blood_type, location)])
+        await aset_region_counts(key, response_data)
+
+    return JsonResponse(response_data, safe=False)
+
+
+@require_GET
+@conditional_on(DONOR, USER)
+async def donor_list_api(request):
+    """ a page of available donors plus the cursor of the next page, see views.donor_list_api """
+
+    try:
+        page, page_size = donor_list_page_query(request.GET)
+    except ValueError:
+        return JsonResponse({"error": "Invalid page_size, start/end or cursor."}, status=400)
+
+    donor_data = await afast_donor_data(page)
+    next_cursor = encode_cursor(donor_data[page_size - 1]["id"]) if len(donor_data) > page_size else None
+    return HttpResponse(render_json({"donors": donor_data[:page_size], "next_cursor": next_cursor}), content_type="application/json")
+
+
+@require_GET
+@conditional_on(DONATION_REQUEST, DONOR, USER)
+async def active_requests_api(request):
+    """ pending and accepted donation requests, see views.active_requests_api """
+
+    active_requests = await afast_donation_request_data(active_requests_query(request.GET))
+    return HttpResponse(render_json({"active_requests": active_requests}), content_type="application/json")
+
+
+@login_required
+async def get_requests(request):
+    """ pending requests sent to the logged in donor, see views.get_requests """
+
+    current_user = await request.auser()
+    if not await Donor.objects.filter(user=current_user).aexists():
+        return JsonResponse({"error": "You must be a registered donor to view requests."}, status=400)
+
+    return JsonResponse({"requests": received_request_data([req async for req in received_requests(current_user)])})
+
+
+@login_required
+async def notifications(request):
+    """ server-sent events stream of the logged in users request events (events.py), open for as long as their profile page is """
+
+    current_user = await request.auser()
+    response = StreamingHttpResponse(event_stream(current_user.pk), content_type="text/event-stream")
+    # never cached, and not held back by a buffering proxy in front of the server
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
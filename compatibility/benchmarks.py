@@ -0,0 +1,436 @@
+# micro-benchmarks for the hot paths in the compatibility app, run them with "python manage.py benchmark <name>"
+# each benchmark is a plain function that returns a list of (label, value) rows so the management command can just print them.
+# benchmarks marked with @needs_database get a throwaway test database (never the real one) that they can fill with fake donors
+
+import asyncio
+import json
+import random
+import threading
+import time
+import timeit
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from .spatial import DonorGrid, brute_force_nearest
+from .utils import COMPATIBILITY_CHART, BLOOD_TYPE_ORDER, CAN_RECEIVE_FROM, is_compatible, are_compatible
+
+
+def _list_chart_is_compatible(donor_blood, recipient_blood):
+    """ the original list based check, kept here only as the baseline to compare against """
+
+    return recipient_blood in COMPATIBILITY_CHART.get(donor_blood, [])
+
+
+def bench_compatibility(size=100_000, repeat=5):
+    """ compares the list based chart with the bitmask engine, for single checks and for a whole batch of pairs """
+
+    rng = random.Random(42)
+    donors = [rng.choice(BLOOD_TYPE_ORDER) for _ in range(size)]
+    recipients = [rng.choice(BLOOD_TYPE_ORDER) for _ in range(size)]
+
+    # sanity check before timing anything, both engines have to agree on every pair
+    expected = [_list_chart_is_compatible(d, r) for d, r in zip(donors, recipients)]
+    if expected != are_compatible(donors, recipients):
+        raise AssertionError("bitmask engine disagrees with the list based chart")
+
+    timings = {
+        "list chart (scalar loop)": lambda: [_list_chart_is_compatible(d, r) for d, r in zip(donors, recipients)],
+        "bitmask (scalar loop)": lambda: [is_compatible(d, r) for d, r in zip(donors, recipients)],
+        "bitmask (batch api)": lambda: are_compatible(donors, recipients),
+    }
+
+    rows = []
+    for label, func in timings.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        rows.append((label, f"{best * 1000:.2f} ms for {size} pairs ({size / best:,.0f} checks/s)"))
+    return rows
+
+
+def needs_database(func):
+    """ marks a benchmark that needs a (test) database, see the benchmark management command """
+
+    func.needs_database = True
+    return func
+
+
+# a few hundred fake regions for the database benchmarks, so grouping by region actually has something to group
+FAKE_REGIONS = [
+    (f"City {city}", f"State {city % 40}" if city % 3 else None, f"Country {city % 25}")
+    for city in range(300)
+]
+
+
+def create_fake_donors(size, seed=42, batch_size=5000):
+    """ bulk creates size users with donor profiles spread over FAKE_REGIONS """
+
+    from .models import Donor, User
+
+    rng = random.Random(seed)
+    start = User.objects.count()
+
+    for offset in range(0, size, batch_size):
+        count = min(batch_size, size - offset)
+        users = User.objects.bulk_create([
+            User(username=f"bench{start + offset + i}", email=f"bench{start + offset + i}@example.com", password="!")
+            for i in range(count)
+        ])
+
+        donors = []
+        for user in users:
+            city, state, country = rng.choice(FAKE_REGIONS)
+            donors.append(Donor(
+                user=user, blood_type=rng.choice(BLOOD_TYPE_ORDER), city=city, state_or_county=state, country=country,
+                latitude=rng.uniform(36.0, 60.0), longitude=rng.uniform(-10.0, 30.0), availability=rng.random() < 0.9,
+            ))
+        Donor.objects.bulk_create(donors)
+
+
+def create_fake_requests(size, seed=42, batch_size=5000):
+    """ bulk creates size donation requests between the existing fake donors, roughly a third of them with an accepted donor """
+
+    from .models import DonationRequest, Donor
+
+    rng = random.Random(seed)
+    donors = list(Donor.objects.values_list("id", "user_id")[:10_000])
+
+    for offset in range(0, size, batch_size):
+        count = min(batch_size, size - offset)
+        pairs = [rng.sample(donors, 2) for _ in range(count)]
+        requests = DonationRequest.objects.bulk_create([
+            DonationRequest(
+                requester_id=requester[1], recipient_id=recipient[1], blood_type_needed=rng.choice(BLOOD_TYPE_ORDER),
+                location="City 1, State 1, Country 1", city="City 1", state="State 1", country="Country 1",
+                status="Pending",
+            )
+            for requester, recipient in pairs
+        ])
+
+        Through = DonationRequest.accepted_donors.through
+        Through.objects.bulk_create([
+            Through(donationrequest_id=request.id, donor_id=requester[0])
+            for request, (requester, _) in zip(requests, pairs) if rng.random() < 0.33
+        ])
+
+
+def python_region_counts(donors):
+    """ the old donor_locations_api aggregation (one row per donor, counted in python), kept as the baseline for the benchmark and the tests """
+
+    from collections import Counter
+
+    region_data = {}
+    for donor in donors:
+        region_key = ", ".join(filter(None, [donor['city'], donor['state_or_county'], donor['country']]))
+
+        if region_key not in region_data:
+            region_data[region_key] = {"count": 0, "blood_counts": Counter()}
+
+        region_data[region_key]["count"] += 1
+        region_data[region_key]["blood_counts"][donor["blood_type"]] += 1
+
+    response_data = []
+    for region, data in region_data.items():
+        sorted_blood_types = sorted(data["blood_counts"].items(), key=lambda x: -x[1])
+        blood_type_str = ", ".join([f"{bt} {count}" for bt, count in sorted_blood_types])
+        response_data.append({"region": region, "count": data["count"], "blood_types": blood_type_str})
+
+    return response_data
+
+
+@needs_database
+def bench_donor_locations(size=100_000, repeat=3):
+    """ donor_locations_api with the counting done by the database (GROUP BY) vs the old python Counter loop over every donor row """
+
+    from .models import Donor
+    from .views import count_donor_regions, donor_locations_api
+
+    create_fake_donors(size)
+    request = RequestFactory().get("/api/donor-locations/")
+
+    def python_counter():
+        donors = Donor.objects.filter(user__is_active=True, availability=True).order_by("id").values(
+            'city', 'state_or_county', 'country', 'blood_type'
+        )
+        return python_region_counts(donors)
+
+    if count_donor_regions("", "") != python_counter():
+        raise AssertionError("GROUP BY aggregation and the python Counter loop disagree")
+
+    # the first view call fills the region cache, after that every call is a cache hit
+    donor_locations_api(request)
+
+    rows = []
+    for label, func in (
+        ("python Counter loop", python_counter),
+        ("database GROUP BY", lambda: count_donor_regions("", "")),
+        ("view, cached", lambda: donor_locations_api(request)),
+    ):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        rows.append((f"{size:,} donors: {label}", f"{best * 1000:.1f} ms"))
+    return rows
+
+
+@needs_database
+def bench_serializers(size=20_000, repeat=3):
+    """ rows per second of the DRF serializers vs the fast values_list path, for the donor list and active requests endpoints """
+
+    from rest_framework.renderers import JSONRenderer
+
+    from .models import DonationRequest, Donor
+    from .serializers import DonationRequestSerializer, DonorSerializer, fast_donation_request_data, fast_donor_data, render_json
+
+    create_fake_donors(size)
+    create_fake_requests(size)
+
+    donors = Donor.objects.filter(availability=True).select_related("user").order_by("id")
+    requests = DonationRequest.objects.filter(status="Pending").select_related("requester").order_by("id")
+    renderer = JSONRenderer()
+
+    paths = {
+        "donors": (
+            donors,
+            lambda: renderer.render({"donors": DonorSerializer(donors, many=True).data}),
+            lambda: render_json({"donors": fast_donor_data(donors)}),
+        ),
+        "active requests": (
+            requests,
+            lambda: renderer.render({"active_requests": DonationRequestSerializer(DonationRequestSerializer.setup_eager_loading(requests), many=True).data}),
+            lambda: render_json({"active_requests": fast_donation_request_data(requests)}),
+        ),
+    }
+
+    rows = []
+    for name, (queryset, drf, fast) in paths.items():
+        if drf() != fast():
+            raise AssertionError(f"fast path output for {name} is not byte identical to DRF")
+
+        count = queryset.count()
+        for label, func in (("DRF serializer", drf), ("fast path", fast)):
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            rows.append((f"{name}: {label}", f"{count / best:,.0f} rows/s ({best * 1000:.0f} ms for {count:,} rows)"))
+    return rows
+
+
+@needs_database
+def bench_export(size=100_000):
+    """ rows per second and peak python memory of the streaming export, the peak should stay flat as the table grows """
+
+    import tracemalloc
+
+    from .exports import stream_export
+
+    rows = []
+    created = 0
+    for n in (size // 10, size):
+        create_fake_donors(n - created, seed=n)
+        created = n
+
+        for file_format in ("ndjson", "csv"):
+            tracemalloc.start()
+            start = timeit.default_timer()
+            written = sum(len(chunk) for chunk in stream_export("donors", file_format))
+            elapsed = timeit.default_timer() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            rows.append((f"{n:,} donors: {file_format}", f"{n / elapsed:,.0f} rows/s, {written / 1e6:.1f} MB written, peak {peak / 1e6:.1f} MB"))
+    return rows
+
+
+@contextmanager
+def slow_geocoder(delay):
+    """ points the geocoding client at a local stand in for HERE that answers every query with one result after delay seconds """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(delay)
+            body = json.dumps({"items": [{"address": {"city": "Paris", "countryName": "France"}, "position": {"lat": 48.85, "lng": 2.35}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with override_settings(HERE_GEOCODE_URL=f"http://127.0.0.1:{server.server_port}/v1/geocode", HERE_API_KEY="bench"):
+            yield
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@needs_database
+def bench_asgi(size=300, wsgi_threads=4, concurrency=100, delay=0.05):
+    """ requests per second of the sync views on a WSGI style pool of wsgi_threads threads vs the async views with concurrency requests in
+     flight on one event loop. The geocode proxy waits delay seconds on a stub HERE (every query is new so nothing is cached), the donor list
+     only waits on the database """
+
+    from . import async_views, views
+
+    create_fake_donors(5000)
+    factory, async_factory = RequestFactory(), AsyncRequestFactory()
+
+    def wsgi(view, url):
+        def call(i):
+            try:
+                return view(factory.get(url(i))).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=wsgi_threads) as pool:
+            return list(pool.map(call, range(size)))
+
+    def asgi(view, url):
+        async def main():
+            slots = asyncio.Semaphore(concurrency)
+
+            async def call(i):
+                async with slots:
+                    return (await view(async_factory.get(url(i)))).status_code
+
+            return await asyncio.gather(*(call(i) for i in range(size)))
+
+        return asyncio.run(main())
+
+    endpoints = (
+        ("geocode proxy", views.geocode_proxy, async_views.geocode_proxy, lambda run: lambda i: f"/api/geocode?q=bench+{run}+{i}"),
+        ("donor list", views.donor_list_api, async_views.donor_list_api, lambda run: lambda i: f"/api/donors/?page_size=50&blood_type={BLOOD_TYPE_ORDER[i % 8]}"),
+    )
+
+    rows = []
+    with slow_geocoder(delay):
+        for name, sync_view, async_view, urls in endpoints:
+            for label, runner, view in ((f"WSGI, {wsgi_threads} threads", wsgi, sync_view), (f"ASGI, {concurrency} in flight", asgi, async_view)):
+                start = timeit.default_timer()
+                statuses = runner(view, urls(label))
+                elapsed = timeit.default_timer() - start
+
+                if set(statuses) != {200}:
+                    raise AssertionError(f"{name} under {label} answered {sorted(set(statuses))}")
+                rows.append((f"{name}: {label}", f"{size / elapsed:,.0f} requests/s ({size} requests in {elapsed:.2f} s)"))
+    return rows
+
+
+def random_donor_rows(size, seed=42):
+    """ fake (donor_id, user_id, blood_type, latitude, longitude) rows spread over roughly europe, so the density is more like real data
+     than donors spread evenly over the oceans """
+
+    rng = random.Random(seed)
+    return [
+        (i, i, rng.choice(BLOOD_TYPE_ORDER), rng.uniform(36.0, 60.0), rng.uniform(-10.0, 30.0))
+        for i in range(size)
+    ]
+
+
+def bench_spatial(size=None, queries=20, k=10):
+    """ k nearest compatible donors, grid index vs a brute force haversine scan over every donor, at 10^4, 10^5 and 10^6 donors """
+
+    sizes = (size,) if size else (10_000, 100_000, 1_000_000)
+    rng = random.Random(7)
+
+    rows = []
+    for n in sizes:
+        donors = random_donor_rows(n)
+
+        start = timeit.default_timer()
+        grid = DonorGrid(donors)
+        build = timeit.default_timer() - start
+
+        points = [(rng.uniform(40.0, 55.0), rng.uniform(-5.0, 25.0), rng.choice(BLOOD_TYPE_ORDER)) for _ in range(queries)]
+
+        start = timeit.default_timer()
+        grid_results = [grid.nearest(lat, lng, k, blood_types=CAN_RECEIVE_FROM[bt]) for lat, lng, bt in points]
+        grid_time = (timeit.default_timer() - start) / queries
+
+        # the brute force scan gets slow fast, so it only runs a few of the queries at the bigger sizes
+        brute_queries = points[:max(1, queries * 10_000 // n)]
+        start = timeit.default_timer()
+        brute_results = [brute_force_nearest(donors, lat, lng, k, blood_types=CAN_RECEIVE_FROM[bt]) for lat, lng, bt in brute_queries]
+        brute_time = (timeit.default_timer() - start) / len(brute_queries)
+
+        for grid_result, brute_result in zip(grid_results, brute_results):
+            if [round(d, 6) for d, _ in grid_result] != [round(d, 6) for d, _ in brute_result]:
+                raise AssertionError("grid index and brute force scan returned different donors")
+
+        rows.append((f"{n:,} donors: grid build", f"{build * 1000:.1f} ms"))
+        rows.append((f"{n:,} donors: grid query (k={k})", f"{grid_time * 1000:.3f} ms"))
+        rows.append((f"{n:,} donors: brute force query", f"{brute_time * 1000:.1f} ms ({brute_time / grid_time:,.0f}x slower)"))
+    return rows
+
+
+@needs_database
+def bench_fanout(size=50_000, batch_size=5000):
+    """ a request whose requester shares a place with size available compatible donors: how long create_donor_request takes, and the worker
+     rounds that notify and email (locmem backend) all of them """
+
+    from django.core import mail
+    from django.core.mail import get_connection
+
+    from . import views
+    from .fanout import claim_fanouts, run_fanouts
+    from .locations import get_location
+    from .models import DonationRequest, Donor, Notification, User
+
+    place = get_location("Big City", "", "Country 1")
+    requester = Donor.objects.create(user=User.objects.create(username="requester", email="requester@example.com"), blood_type="AB+",
+                                     city="Big City", country="Country 1")
+    recipient = Donor.objects.create(user=User.objects.create(username="recipient"), blood_type="O-", city="Elsewhere", country="Country 1")
+
+    # AB+ can take every blood type, so every donor here is compatible
+    rng = random.Random(42)
+    for offset in range(0, size, batch_size):
+        users = User.objects.bulk_create([
+            User(username=f"fanout{offset + i}", email=f"fanout{offset + i}@example.com", password="!") for i in range(min(batch_size, size - offset))
+        ])
+        Donor.objects.bulk_create([
+            Donor(user=user, blood_type=rng.choice(BLOOD_TYPE_ORDER), city="Big City", country="Country 1", place=place) for user in users
+        ])
+
+    request = RequestFactory().post(f"/api/create_donor_request/{recipient.user_id}")
+    request.user = requester.user
+    start = timeit.default_timer()
+    response = views.create_donor_request(request, recipient.user_id)
+    response_time = timeit.default_timer() - start
+    if response.status_code != 200:
+        raise AssertionError(f"create_donor_request answered {response.status_code}")
+
+    rounds = []
+    with override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"):
+        mail.outbox = []
+        start = timeit.default_timer()
+        while jobs := claim_fanouts():
+            round_start = timeit.default_timer()
+            with get_connection() as mail_connection:
+                run_fanouts(jobs, mail_connection)
+            rounds.append(timeit.default_timer() - round_start)
+        total = timeit.default_timer() - start
+
+    notified = Notification.objects.filter(donation_request=DonationRequest.objects.get()).count()
+    return [
+        ("create_donor_request", f"{response_time * 1000:.1f} ms"),
+        ("fan-out", f"{notified:,} notified, {len(mail.outbox):,} emailed in {total:.2f} s ({notified / total:,.0f} donors/s)"),
+        ("worker rounds", f"{len(rounds)} rounds, longest {max(rounds) * 1000:.0f} ms"),
+    ]
+
+
+BENCHMARKS = {
+    "compatibility": bench_compatibility,
+    "spatial": bench_spatial,
+    "donor_locations": bench_donor_locations,
+    "serializers": bench_serializers,
+    "export": bench_export,
+    "asgi": bench_asgi,
+    "fanout": bench_fanout,
+}
@@ -0,0 +1,50 @@
+from django.core.checks import Error, Tags, Warning, register
+
+from .utils import BLOOD_TYPE_ORDER, validate_compatibility_index
+
+
+# system check that runs on startup (runserver, migrate, test, etc.) so a broken compatibility chart fails loudly before any request is served
+# instead of quietly returning the wrong donors, see https://docs.djangoproject.com/en/5.1/topics/checks/
+@register(Tags.models)
+def check_compatibility_index(app_configs, **kwargs):
+    """ makes sure the compiled compatibility index is consistent with itself and with the BLOOD_TYPES choices """
+
+    from .models import BLOOD_TYPES
+
+    errors = [Error(problem, id="compatibility.E001") for problem in validate_compatibility_index()]
+
+    if tuple(value for value, _ in BLOOD_TYPES) != BLOOD_TYPE_ORDER:
+        errors.append(Error(
+            "BLOOD_TYPES in models.py and BLOOD_TYPE_ORDER in utils.py list different blood types",
+            hint="Keep both in the same order, the compatibility bitmask depends on it.",
+            id="compatibility.E002",
+        ))
+
+    return errors
+
+
+# only runs with "manage.py check --database default" (database checks are skipped otherwise), compares the homepage rollup with a full recount
+@register(Tags.database)
+def check_site_stats(app_configs, databases=None, **kwargs):
+    """ warns when the site stats rollup (site_stats.py) has drifted from the donor table """
+
+    if not databases:
+        return []
+
+    from django.db import connection
+
+    from .models import SiteStats, SiteStatValue
+    from .site_stats import SITE_STATS_PK, reconcile
+
+    # migrate runs the database checks too, before the rollup tables exist on a new database
+    if not {SiteStats._meta.db_table, SiteStatValue._meta.db_table} <= set(connection.introspection.table_names()):
+        return []
+
+    # nothing to compare before the rollup is first built (get_site_stats does a full count then)
+    if not SiteStats.objects.filter(pk=SITE_STATS_PK).exists():
+        return []
+
+    return [
+        Warning(problem, hint="Run manage.py reconcile_site_stats to recount it.", id="compatibility.W001")
+        for problem in reconcile(fix=False)
+    ]
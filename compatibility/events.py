@@ -0,0 +1,137 @@
+# live request events for the profile page. The request transitions (models.DonationRequest.transition) and new requests (signals.py) publish
+# an event to the requester and the recipient once their transaction commits, and the notifications stream (async_views.notifications, served
+# over ASGI) forwards the events of the logged in user to the browser as server-sent events. An open stream is a coroutine waiting on a queue,
+# so a profile page that is just sitting there costs no queries and no requests, only a keepalive comment every SSE_HEARTBEAT seconds.
+
+# The broker is settings.EVENTS_BROKER, anything with
+#   publish(user_ids, event)               called from sync code on any thread, must not block
+#   subscribe(user_id, heartbeat)          async generator of the users events, yields None after heartbeat seconds without one
+#   cross_process                          True when publish reaches the streams of other processes
+# The default InProcessBroker only reaches streams served by the same process, which is enough for a single ASGI server (its sync views run
+# on its own threads). Several server processes, or events from a background worker (fanout.py), need a broker that goes through something
+# they share (redis pub/sub, postgres LISTEN/NOTIFY).
+
+import asyncio
+import json
+import threading
+
+from collections import defaultdict
+from contextlib import aclosing
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+# seconds between keepalive comments on an idle stream, under the usual 60s proxy read timeouts
+SSE_HEARTBEAT = 25
+
+# milliseconds the browser waits before reconnecting a dropped stream
+SSE_RETRY = 5000
+
+# events buffered per stream, a client that falls further behind than this gets a single "resync" event instead
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class InProcessBroker:
+    """ pub/sub between the threads and the event loop of one process, every open stream is an asyncio queue on the loop it runs on """
+
+    cross_process = False
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, user_ids, event):
+        with self.lock:
+            targets = [subscriber for user_id in set(user_ids) for subscriber in self.subscribers.get(user_id, ())]
+
+        # queues arent thread safe, the put runs on the loop that owns the queue
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(deliver, queue, event)
+            except RuntimeError:
+                # the loop was closed, the stream is gone
+                pass
+
+    async def subscribe(self, user_id, heartbeat=SSE_HEARTBEAT):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+        with self.lock:
+            self.subscribers[user_id].add(subscriber)
+
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                self.subscribers[user_id].discard(subscriber)
+                if not self.subscribers[user_id]:
+                    del self.subscribers[user_id]
+
+
+def deliver(queue, event):
+    """ puts an event on a subscribers queue, a full queue is replaced by one resync event (the client refetches everything anyway) """
+
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait({"type": "resync"})
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_broker():
+    """ the broker instance of settings.EVENTS_BROKER, one per process """
+
+    path = settings.EVENTS_BROKER
+    with _brokers_lock:
+        broker = _brokers.get(path)
+        if broker is None:
+            broker = _brokers[path] = import_string(path)()
+    return broker
+
+
+def publish(user_ids, event):
+    """ sends an event to the users streams """
+
+    get_broker().publish(user_ids, event)
+
+
+def reaches_other_processes():
+    """ True when events published here reach the streams of the web processes, a worker process has no streams of its own """
+
+    return getattr(get_broker(), "cross_process", False)
+
+
+def publish_request_event(donation_request, kind):
+    """ tells the requester and the recipient that a request was created, accepted, rejected or cancelled. Sent after commit so a
+     rolled back change never reaches anyone, and so the client refetching its lists straight away already sees it """
+
+    event = {"type": f"request_{kind}", "request_id": donation_request.pk, "status": donation_request.status}
+    user_ids = [donation_request.requester_id, donation_request.recipient_id]
+    transaction.on_commit(lambda: publish(user_ids, event))
+
+
+def format_event(event):
+    """ one event in the text/event-stream format, None is a keepalive comment """
+
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+async def event_stream(user_id):
+    """ the body of the notifications stream, runs until the client goes away (the ASGI handler cancels it) """
+
+    yield f"retry: {SSE_RETRY}\n\n"
+    # aclosing, so the subscription is dropped as soon as the stream is closed and not whenever the generator is collected
+    async with aclosing(get_broker().subscribe(user_id)) as events:
+        async for event in events:
+            yield format_event(event)
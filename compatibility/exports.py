@@ -0,0 +1,146 @@
+# bulk exports of donors, donation requests and match history as NDJSON (one json object per line) or CSV, for ops and the regional blood
+# services. Used by the export_api view (StreamingHttpResponse) and the "export" management command.
+# Rows are read with .values_list().iterator() and turned into records one chunk at a time, so memory stays the same no matter how many
+# millions of rows the table has, nothing ever holds the whole result. The records have the same fields as the api serializers (serializers.py).
+
+import csv
+import json
+
+from itertools import islice
+
+from .models import BloodMatchHistory, DonationRequest, Donor
+from .locations import country_q
+from .serializers import (
+    DONATION_REQUEST_COLUMNS, DONOR_COLUMNS, MATCH_HISTORY_COLUMNS, donation_request_data, donor_data, encode_json, match_history_data,
+)
+from .utils import BLOOD_TYPE_ORDER
+
+
+# rows fetched from the database per round trip, and records written per chunk of the response
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def export_donors(blood_type=None, status=None, country=None):
+    """ every donor (available or not), in id order """
+
+    if status:
+        raise ValueError("The status filter only applies to donation_requests.")
+
+    donors = Donor.objects.order_by("id")
+    if blood_type:
+        donors = donors.filter(blood_type=blood_type)
+    if country:
+        donors = donors.filter(country_q(country))
+
+    return donor_data(donors.values_list(*DONOR_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def export_donation_requests(blood_type=None, status=None, country=None):
+    """ every donation request in id order, the accepted donors contact info is fetched per chunk of requests """
+
+    if status and status not in dict(DonationRequest.STATUS_CHOICES):
+        raise ValueError(f"Unknown status {status}.")
+
+    requests = DonationRequest.objects.order_by("id")
+    if blood_type:
+        requests = requests.filter(blood_type_needed=blood_type)
+    if status:
+        requests = requests.filter(status=status)
+    if country:
+        requests = requests.filter(country_q(country))
+
+    rows = requests.values_list(*DONATION_REQUEST_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def records():
+        while chunk := list(islice(rows, EXPORT_CHUNK_SIZE)):
+            yield from donation_request_data(chunk)
+
+    return records()
+
+
+def export_match_history(blood_type=None, status=None, country=None):
+    """ every match history row in id order, blood type and country filter on the donor """
+
+    if status:
+        raise ValueError("The status filter only applies to donation_requests.")
+
+    history = BloodMatchHistory.objects.order_by("id")
+    if blood_type:
+        history = history.filter(donor_blood=blood_type)
+    if country:
+        history = history.filter(country_q(country, prefix="donor__place"))
+
+    return match_history_data(history.values_list(*MATCH_HISTORY_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+# name: (records function, csv header). The csv columns are the record keys, with nested objects flattened to parent_child
+EXPORTS = {
+    "donors": (
+        export_donors,
+        ["id", "blood_type", "availability", "user_id", "user_username", "user_email", "location", "city", "country"],
+    ),
+    "donation_requests": (
+        export_donation_requests,
+        ["recipient", "requester_username", "blood_type_needed", "location", "status", "country", "created_at", "donor_contact_info", "id"],
+    ),
+    "match_history": (
+        export_match_history,
+        ["id", "donor_id", "donor_username", "donor_email", "recipient_id", "recipient_username", "recipient_email",
+         "donor_blood", "recipient_blood", "is_compatible", "match_date", "donation_request"],
+    ),
+}
+
+
+def flatten(record):
+    """ one csv row from a record, nested objects become parent_child columns and lists (donor_contact_info) are written as json """
+
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            row.update((f"{key}_{child}", child_value) for child, child_value in value.items())
+        elif isinstance(value, list):
+            row[key] = json.dumps(value, ensure_ascii=False)
+        else:
+            row[key] = value
+    return row
+
+
+class Echo:
+    """ file like object for csv.writer that hands back each line instead of storing it, see
+     https://docs.djangoproject.com/en/5.1/howto/outputting-csv/#streaming-large-csv-files """
+
+    def write(self, value):
+        return value
+
+
+def stream_export(name, file_format="ndjson", blood_type=None, status=None, country=None):
+    """ returns an iterator of str chunks of the export, raises ValueError straight away (before anything is streamed) for a bad filter """
+
+    if name not in EXPORTS:
+        raise ValueError(f"Unknown export {name}, choose one of: {', '.join(EXPORTS)}.")
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {file_format}, choose one of: {', '.join(EXPORT_FORMATS)}.")
+    if blood_type and blood_type not in BLOOD_TYPE_ORDER:
+        raise ValueError(f"Unknown blood type {blood_type}.")
+
+    export, header = EXPORTS[name]
+    records = export(blood_type=blood_type, status=status, country=country)
+
+    if file_format == "ndjson":
+        lines = (encode_json(record) + "\n" for record in records)
+    else:
+        writer = csv.writer(Echo())
+        lines = (writer.writerow([flatten(record).get(column) for column in header]) for record in records)
+
+    def chunks():
+        if file_format == "csv":
+            yield writer.writerow(header)
+        while chunk := "".join(islice(lines, EXPORT_CHUNK_SIZE)):
+            yield chunk
+
+    return chunks()
@@ -0,0 +1,181 @@
+# fan-out of a new donation request to every available donor in the same place as the requester (their Location, the request copies its
+# location from them) whose blood the requester can take.
+# create_donor_request only calls enqueue_fanout, "manage.py notify_worker" claims due fan-outs like geocode_worker claims geocode jobs and
+# works through the donors in batches:
+# - one indexed range query per batch, on donor_available_place_idx (place, blood_type, id), one compatible blood type after the other in id
+#   order, so a batch costs the same however far into a 50k donor fan-out it is
+# - one bulk_create of the batches Notification rows, in the same transaction as the cursor update
+# - the batches emails through the one mail connection the worker opened for the round
+# The donors see the Notification rows the next time their profile page loads. A live event to the donors that have the page open is only
+# sent when settings.EVENTS_BROKER reaches the web processes (events.py), the default InProcessBroker would only reach streams of the worker
+# process itself, which has none.
+# After FANOUT_BATCHES_PER_ROUND batches the job goes back to Pending with its cursor, so a huge fan-out takes bounded time per round and the
+# other new requests get their turn in between. Emails are sent after the batch committed, a crash in between loses those emails rather than
+# sending them twice (the in-app notifications are there either way).
+
+import uuid
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .events import publish, reaches_other_processes
+from .models import DonationRequest, Donor, Notification, NotificationFanout
+from .utils import compatible_donor_types
+
+
+# donors per batch (one select, one bulk_create and one send_messages each), and batches per job before it goes back in the queue
+FANOUT_BATCH_SIZE = 500
+FANOUT_BATCHES_PER_ROUND = 20
+
+# fan-outs claimed per worker round
+FANOUT_CLAIM_SIZE = 10
+
+# a fan-out is given up after this many failed rounds, retried after FANOUT_RETRY_DELAY * 2^n seconds in between
+FANOUT_MAX_ATTEMPTS = 5
+FANOUT_RETRY_DELAY = 30
+
+# seconds after which a Running fan-out is assumed to belong to a dead worker and is claimed again
+FANOUT_JOB_LEASE = 5 * 60
+
+
+def enqueue_fanout(donation_request):
+    """ queues the fan-out of a request that was just created (call it in the same transaction, a rolled back request queues nothing) """
+
+    return NotificationFanout.objects.create(donation_request=donation_request)
+
+
+def claim_fanouts(claim_size=FANOUT_CLAIM_SIZE):
+    """ marks up to claim_size due fan-outs as Running for this worker and returns them, see geocode_jobs.claim_jobs """
+
+    now = timezone.now()
+    due = Q(status="Pending", run_after__lte=now) | Q(status="Running", claimed_at__lt=now - timedelta(seconds=FANOUT_JOB_LEASE))
+    ids = list(NotificationFanout.objects.filter(due).order_by("run_after").values_list("pk", flat=True)[:claim_size])
+    if not ids:
+        return []
+
+    claim = uuid.uuid4().hex
+    NotificationFanout.objects.filter(due, pk__in=ids).update(status="Running", claim=claim, claimed_at=now, updated_at=now)
+    return list(NotificationFanout.objects.filter(claim=claim, status="Running").order_by("run_after"))
+
+
+def held(job):
+    """ the fan-out, if this worker still holds it """
+
+    return NotificationFanout.objects.filter(pk=job.pk, claim=job.claim, status="Running")
+
+
+def fanout_message(donation_request, requester_name):
+    """ what the donors are told """
+
+    return f"{requester_name} needs {donation_request.blood_type_needed} blood in {donation_request.location}, you may be able to help."
+
+
+def fanout_batch(donation_request, place_id, blood_type, after_id, batch_size):
+    """ (donor id, user id, email) of the next batch_size donors of one blood type in the place, in id order after after_id """
+
+    return list(
+        Donor.objects.filter(availability=True, place_id=place_id, blood_type=blood_type, pk__gt=after_id, user__is_active=True)
+        .exclude(user_id__in=[donation_request.requester_id, donation_request.recipient_id])
+        .order_by("pk").values_list("pk", "user_id", "user__email")[:batch_size]
+    )
+
+
+def run_fanout(job, mail_connection, batch_size=FANOUT_BATCH_SIZE, max_batches=FANOUT_BATCHES_PER_ROUND):
+    """ runs up to max_batches batches of a claimed fan-out. Returns "done", "paused" (more to do, back in the queue) or "dropped" (the
+     worker lost the job, its lease ran out) """
+
+    donation_request = DonationRequest.objects.select_related("requester").get(pk=job.donation_request_id)
+
+    # the requesters own place rather than the requests, DonationRequest.save reads a two part "City, Country" location as city and state
+    place_id = Donor.objects.filter(user_id=donation_request.requester_id).values_list("place_id", flat=True).first()
+
+    # nothing to match on, or nobody needs to hear about it anymore
+    blood_types = compatible_donor_types(donation_request.blood_type_needed)
+    if place_id is None or donation_request.status != "Pending":
+        blood_types = ()
+
+    message = fanout_message(donation_request, donation_request.requester.username)
+    subject = f"{donation_request.blood_type_needed} blood needed in {donation_request.location}"
+
+    live = reaches_other_processes()
+
+    start = blood_types.index(job.last_blood_type) if job.last_blood_type in blood_types else 0
+    after_id = job.last_donor_id if job.last_blood_type in blood_types else 0
+    batches = 0
+
+    for blood_type in blood_types[start:]:
+        while True:
+            if batches == max_batches:
+                updated = held(job).update(status="Pending", claim="", run_after=timezone.now(), updated_at=timezone.now())
+                return "paused" if updated else "dropped"
+
+            rows = fanout_batch(donation_request, place_id, blood_type, after_id, batch_size)
+            if not rows:
+                break
+            batches += 1
+            after_id = rows[-1][0]
+
+            with transaction.atomic():
+                if not held(job).update(
+                    last_blood_type=blood_type, last_donor_id=after_id, notified=F("notified") + len(rows), updated_at=timezone.now(),
+                ):
+                    return "dropped"
+                Notification.objects.bulk_create(
+                    [Notification(user_id=user_id, donation_request=donation_request, message=message) for _, user_id, _ in rows],
+                    ignore_conflicts=True,
+                )
+
+            if live:
+                user_ids = [user_id for _, user_id, _ in rows]
+                publish(user_ids, {"type": "notification", "request_id": donation_request.pk, "message": message})
+
+            # one message per donor so nobody sees the other addresses, all of them over the same connection
+            emails = [EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [email]) for _, _, email in rows if email]
+            if emails:
+                try:
+                    sent = mail_connection.send_messages(emails) or 0
+                except Exception as e:
+                    held(job).update(last_error=f"Sending emails failed: {type(e).__name__}")
+                else:
+                    held(job).update(emailed=F("emailed") + sent)
+
+            if len(rows) < batch_size:
+                break
+
+        after_id = 0
+
+    return "done" if held(job).update(status="Done", claim="", updated_at=timezone.now()) else "dropped"
+
+
+def retry(job, error):
+    """ puts a fan-out that failed back in the queue with backoff (it keeps its cursor), or gives up after FANOUT_MAX_ATTEMPTS """
+
+    attempts = job.attempts + 1
+    if attempts >= FANOUT_MAX_ATTEMPTS:
+        return held(job).update(status="Failed", claim="", attempts=attempts, last_error=str(error)[:255], updated_at=timezone.now())
+    return held(job).update(
+        status="Pending", claim="", attempts=attempts, last_error=str(error)[:255], updated_at=timezone.now(),
+        run_after=timezone.now() + timedelta(seconds=FANOUT_RETRY_DELAY * 2 ** (attempts - 1)),
+    )
+
+
+def run_fanouts(jobs, mail_connection, **kwargs):
+    """ runs a round of claimed fan-outs. Returns {"done": n, "paused": n, "retried": n, "failed": n, "dropped": n} """
+
+    counts = {"done": 0, "paused": 0, "retried": 0, "failed": 0, "dropped": 0}
+    for job in jobs:
+        try:
+            counts[run_fanout(job, mail_connection, **kwargs)] += 1
+        except Exception as e:
+            if not retry(job, e):
+                counts["dropped"] += 1
+            elif job.attempts + 1 >= FANOUT_MAX_ATTEMPTS:
+                counts["failed"] += 1
+            else:
+                counts["retried"] += 1
+    return counts
@@ -0,0 +1,233 @@
+# local database backed queue for geocoding donor locations in the background. register and edit_profile save the raw location straight away
+# and call enqueue_geocode, "manage.py geocode_worker" claims due jobs in batches, geocodes each distinct query once (through geocoding.py, so
+# the cache and connection pool are shared) and fills in the donors location, city, state_or_county, country, latitude and longitude.
+# Claiming is a conditional UPDATE ... WHERE status='Pending' like the DonationRequest transitions, so several workers never run the same job.
+# Failed calls are retried with exponential backoff, a location HERE doesnt know fails straight away (retrying wont change the answer).
+
+# backfill_coordinates ("manage.py geocode_backfill") is the one off version for donors that have a city/country but never got coordinates (older
+# test users, donors created in the admin): it walks them in id order, resolves each distinct location once on a small thread pool behind a shared
+# rate limiter, and writes the coordinates back with one bulk_update per chunk.
+
+import uuid
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .geocoding import GeocodingError, RateLimiter, address_fields, cache_key, geocode
+from .models import Donor, GeocodeJob
+from .versions import DONOR, bump_version
+
+
+# jobs claimed per worker round
+GEOCODE_BATCH_SIZE = 50
+
+# a job is given up (status Failed) after this many failed calls
+GEOCODE_MAX_ATTEMPTS = 5
+
+# seconds before the first retry, doubled on every further attempt up to the max
+GEOCODE_RETRY_DELAY = 30
+GEOCODE_RETRY_MAX_DELAY = 60 * 60
+
+# seconds after which a Running job is assumed to belong to a dead worker and is claimed again
+GEOCODE_JOB_LEASE = 5 * 60
+
+# donors per backfill chunk (one select and one bulk_update each), pool threads, and HERE calls per second across all of them
+BACKFILL_CHUNK_SIZE = 500
+BACKFILL_WORKERS = 4
+BACKFILL_RATE = 5
+
+
+def enqueue_geocode(donor, query):
+    """ queues (or re-queues) the geocode of the donors location. A newer edit replaces a job that hasnt run yet, and a job that is running
+     right now drops its result instead of overwriting the newer location """
+
+    now = timezone.now()
+    job, _ = GeocodeJob.objects.update_or_create(donor=donor, defaults={
+        "query": query[:255], "status": "Pending", "attempts": 0, "run_after": now, "claim": "", "claimed_at": None, "last_error": "",
+    })
+    return job
+
+
+def geocode_status(donor):
+    """ status of the donors latest geocode job, None when their location was never queued """
+
+    return GeocodeJob.objects.filter(donor=donor).values_list("status", flat=True).first()
+
+
+def retry_delay(attempts):
+    """ seconds to wait after the nth failed attempt """
+
+    return min(GEOCODE_RETRY_DELAY * 2 ** (attempts - 1), GEOCODE_RETRY_MAX_DELAY)
+
+
+def claim_jobs(batch_size=GEOCODE_BATCH_SIZE):
+    """ marks up to batch_size due jobs as Running for this worker and returns them """
+
+    now = timezone.now()
+    due = Q(status="Pending", run_after__lte=now) | Q(status="Running", claimed_at__lt=now - timedelta(seconds=GEOCODE_JOB_LEASE))
+    ids = list(GeocodeJob.objects.filter(due).order_by("run_after").values_list("pk", flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    # another worker may have claimed some of these since the select, the condition is checked again by the UPDATE itself
+    claim = uuid.uuid4().hex
+    GeocodeJob.objects.filter(due, pk__in=ids).update(status="Running", claim=claim, claimed_at=now, updated_at=now)
+    return list(GeocodeJob.objects.filter(claim=claim, status="Running").order_by("run_after"))
+
+
+def finish(job, **fields):
+    """ updates a job this worker still holds, False when a newer edit re-queued it in the meantime """
+
+    fields.update(claim="", updated_at=timezone.now())
+    return bool(GeocodeJob.objects.filter(pk=job.pk, claim=job.claim, status="Running").update(**fields))
+
+
+def complete(job, item):
+    """ fills in the donor from a HERE result item, the job and the donor change together or not at all """
+
+    fields = address_fields(item)
+    with transaction.atomic():
+        if not finish(job, status="Done", last_error=""):
+            return False
+
+        # a plain save so the signals (site stats, versions, map cache) see the new region
+        donor = Donor.objects.select_for_update().get(pk=job.donor_id)
+        # the formatted 'City, State/County, Country' replaces the raw text the user typed, the requests copy it and DonationRequest.save
+        # splits it into city, state and country
+        donor.location = fields["location"]
+        donor.city = fields["city"]
+        donor.state_or_county = fields["state_or_county"] or None
+        donor.country = fields["country"]
+        donor.latitude = fields["latitude"]
+        donor.longitude = fields["longitude"]
+        donor.save()
+    return True
+
+
+def retry(job, error):
+    """ puts a failed job back in the queue with backoff, or gives up after GEOCODE_MAX_ATTEMPTS """
+
+    attempts = job.attempts + 1
+    if attempts >= GEOCODE_MAX_ATTEMPTS:
+        return finish(job, status="Failed", attempts=attempts, last_error=str(error)[:255])
+    return finish(
+        job, status="Pending", attempts=attempts, last_error=str(error)[:255],
+        run_after=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+    )
+
+
+def run_jobs(jobs):
+    """ geocodes a batch of claimed jobs, each distinct query once. Returns {"done": n, "retried": n, "failed": n, "dropped": n} """
+
+    results = {}
+    counts = {"done": 0, "retried": 0, "failed": 0, "dropped": 0}
+
+    for job in jobs:
+        key = cache_key(job.query, "en")
+        if key not in results:
+            try:
+                results[key] = geocode(job.query, lang="en").get("items", [])
+            except GeocodingError as e:
+                results[key] = e
+
+        result = results[key]
+        if isinstance(result, GeocodingError):
+            if not retry(job, result):
+                counts["dropped"] += 1
+            elif job.attempts + 1 >= GEOCODE_MAX_ATTEMPTS:
+                counts["failed"] += 1
+            else:
+                counts["retried"] += 1
+        elif not result:
+            counts["failed" if finish(job, status="Failed", last_error="No match for this location.") else "dropped"] += 1
+        else:
+            counts["done" if complete(job, result[0]) else "dropped"] += 1
+
+    return counts
+
+
+def donor_query(city, state_or_county, country):
+    """ what a donor without coordinates is geocoded by """
+
+    return ", ".join(filter(None, [city, state_or_county, country]))
+
+
+def missing_coordinates(start_after=0):
+    """ donors with a city or country but no coordinates, in id order after start_after. Donors with a queued job are left to the worker """
+
+    return Donor.objects.filter(
+        Q(latitude__isnull=True) | Q(longitude__isnull=True), Q(city__gt="") | Q(country__gt=""), pk__gt=start_after,
+    ).exclude(geocode_job__status__in=["Pending", "Running"]).order_by("pk")
+
+
+def resolve(query, limiter):
+    """ address_fields of the best match, None when HERE doesnt know the place, the GeocodingError when the call failed.
+     Runs on the pool threads, each opens its own connection (for the geocode cache) so it is closed again here """
+
+    try:
+        items = geocode(query, lang="en", limiter=limiter).get("items", [])
+        return address_fields(items[0]) if items else None
+    except GeocodingError as e:
+        return e
+    finally:
+        connection.close()
+
+
+def backfill_coordinates(chunk_size=BACKFILL_CHUNK_SIZE, workers=BACKFILL_WORKERS, rate=BACKFILL_RATE, start_after=0, limit=None):
+    """ fills in the coordinates of donors that have none, a chunk at a time. Yields the running totals after every chunk:
+     {"last_id", "donors", "lookups", "updated", "not_found", "failed"}. Every chunk is written before the next one is read, so an interrupted
+     run can start again after the last_id it reported (donors that got coordinates drop out of the query by themselves anyway) """
+
+    limiter = RateLimiter(rate)
+    totals = {"last_id": start_after, "donors": 0, "lookups": 0, "updated": 0, "not_found": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while limit is None or totals["donors"] < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - totals["donors"])
+
+            # keyset on id, the select costs the same however far into the table the run is
+            donors = list(missing_coordinates(totals["last_id"]).only("id", "city", "state_or_county", "country")[:size])
+            if not donors:
+                return
+
+            # donors in the same place are geocoded once
+            groups = defaultdict(list)
+            queries = {}
+            for donor in donors:
+                query = donor_query(donor.city, donor.state_or_county, donor.country)
+                key = cache_key(query, "en")
+                groups[key].append(donor)
+                queries.setdefault(key, query)
+
+            results = dict(zip(queries, pool.map(lambda query: resolve(query, limiter), queries.values())))
+
+            updated = []
+            for key, group in groups.items():
+                result = results[key]
+                if isinstance(result, GeocodingError):
+                    totals["failed"] += len(group)
+                elif result is None or result["latitude"] is None:
+                    totals["not_found"] += len(group)
+                else:
+                    for donor in group:
+                        donor.latitude = result["latitude"]
+                        donor.longitude = result["longitude"]
+                    updated.extend(group)
+
+            if updated:
+                Donor.objects.bulk_update(updated, ["latitude", "longitude"])
+
+                # bulk_update doesnt send the signals. The bump is what the conditional GETs and the spatial grid of every web process check,
+                # this command process has no grid of its own to update, the web processes rebuild theirs on their next distance query
+                bump_version(DONOR)
+
+            totals["last_id"] = donors[-1].pk
+            totals["donors"] += len(donors)
+            totals["lookups"] += len(queries)
+            totals["updated"] += len(updated)
+            yield dict(totals)
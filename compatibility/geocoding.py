@@ -0,0 +1,333 @@
+# client for the HERE geocoding api, used by the background geocode worker (geocode_jobs.py, for register / profile edits) and the geocode_proxy
+# view (map searches).
+# - one pooled requests.Session per process, so repeat calls reuse a keep-alive TLS connection instead of doing a new handshake every time, and
+#   every call has a (connect, read) timeout so a slow HERE cant hang a web worker forever
+# - two cache tiers keyed on the normalised query (locations.normalize_name): an in-process LRU in front of the GeocodeCacheEntry table, both
+#   expire after settings.GEOCODE_CACHE_TTL seconds. The same handful of cities are geocoded over and over, so most lookups never leave the server
+# - request coalescing, concurrent lookups of a query that isnt cached wait for the one HTTP call already in flight instead of each making their own
+# Failed calls raise GeocodingError and are never cached.
+# ageocode is the same thing for async views (async_views.py): the same cache tiers (the database one on a thread, like the async ORM), an
+# httpx.AsyncClient instead of the requests session and coalescing on asyncio futures, so waiting on HERE never holds a thread.
+
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+
+import httpx
+import requests
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .locations import normalize_name
+from .models import GeocodeCacheEntry
+
+
+# (connect, read) timeout in seconds for one call to HERE
+GEOCODE_TIMEOUT = (3.05, 10)
+
+# keep-alive connections kept open per host
+GEOCODE_POOL_SIZE = 10
+
+# queries kept in the in-process tier
+GEOCODE_LRU_SIZE = 1024
+
+
+class GeocodingError(Exception):
+    """ HERE couldnt be reached, timed out or answered with an error """
+
+
+@lru_cache(maxsize=1)
+def get_session():
+    """ the shared session, built on first use. requests sessions are fine to share between threads for plain GETs """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=GEOCODE_POOL_SIZE, pool_maxsize=GEOCODE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter:
+    """ spaces out calls so there are at most rate per second across every thread sharing it (HERE has a requests per second quota) """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(self.next_at, now)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class LRUCache:
+    """ small thread safe LRU of key -> (expires_at, value) """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+memory_cache = LRUCache(GEOCODE_LRU_SIZE)
+
+
+class InFlight:
+    """ one HTTP call that other threads asking for the same query are waiting on """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def cache_key(query, lang=None):
+    """ "Paris" and " paris " are the same lookup, hashed so any free text query fits the key column """
+
+    return hashlib.sha256(f"{lang or ''}|{normalize_name(query)}".encode()).hexdigest()
+
+
+def fetch(query, lang=None):
+    """ one call to HERE through the pooled session, returns the decoded json """
+
+    params = {"q": query, "apiKey": settings.HERE_API_KEY}
+    if lang:
+        params["lang"] = lang
+
+    try:
+        response = get_session().get(settings.HERE_GEOCODE_URL, params=params, timeout=GEOCODE_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+    # the messages leave out the url, it has the api key in it
+    except requests.HTTPError as e:
+        raise GeocodingError(f"Geocoding {query!r} failed: HERE answered {e.response.status_code}") from e
+    except (requests.RequestException, ValueError) as e:
+        raise GeocodingError(f"Geocoding {query!r} failed: {type(e).__name__}") from e
+
+
+def cached_response(key, now):
+    """ (response, expires_at) from the database tier, None on a miss. The tier is only a cache, a read that fails (a locked sqlite table for
+     example) counts as a miss instead of failing the lookup """
+
+    try:
+        return GeocodeCacheEntry.objects.filter(key=key, expires_at__gt=now).values_list("response", "expires_at").first()
+    except DatabaseError:
+        return None
+
+
+def store_response(key, query, response, now, expires_at):
+    """ writes a response to the database tier, a failed write only means the next process asks HERE again """
+
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            key=key, defaults={"query": normalize_name(query), "response": response, "fetched_at": now, "expires_at": expires_at},
+        )
+    except DatabaseError:
+        pass
+
+
+def lookup(key, query, lang, limiter=None):
+    """ the database tier, then HERE (waiting for the rate limiter first, if there is one). Whatever comes back is written to both tiers """
+
+    now = timezone.now()
+    cached = cached_response(key, now)
+    if cached is not None:
+        response, expires_at = cached
+        memory_cache.set(key, response, expires_at)
+        return response
+
+    if limiter is not None:
+        limiter.acquire()
+    response = fetch(query, lang)
+    expires_at = now + timedelta(seconds=settings.GEOCODE_CACHE_TTL)
+    store_response(key, query, response, now, expires_at)
+    memory_cache.set(key, response, expires_at)
+    return response
+
+
+def geocode(query, lang=None, limiter=None):
+    """ the HERE geocode response (json dict) for a free text query, from the cache when possible. Raises GeocodingError.
+     limiter (a RateLimiter) only holds up calls that actually go to HERE, cache hits are never slowed down """
+
+    key = cache_key(query, lang)
+    cached = memory_cache.get(key, timezone.now())
+    if cached is not None:
+        return cached
+
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = InFlight()
+
+    # someone else is already fetching this query, wait for their answer (a bit longer than their own timeout)
+    if not leader:
+        if not call.done.wait(timeout=sum(GEOCODE_TIMEOUT) + 1):
+            raise GeocodingError(f"Geocoding {query!r} timed out waiting for the call in flight")
+        if call.error is not None:
+            raise GeocodingError(str(call.error)) from call.error
+        return call.result
+
+    try:
+        call.result = lookup(key, query, lang, limiter)
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.done.set()
+
+    return call.result
+
+
+def address_fields(item):
+    """ city, state/county, country and coordinates of one HERE result item, plus the 'City, State/County, Country' string """
+
+    address = item["address"]
+    position = item.get("position", {})
+
+    # extract city and country and boroughs for weird american things
+    city = address.get("city", address.get("district", ""))
+    country = address.get("countryName", "")
+
+    # prioritize state but fallback to county (for UK and other regions)
+    state_or_county = address.get("state", address.get("county", ""))
+
+    return {
+        "city": city,
+        "state_or_county": state_or_county,
+        "country": country,
+        # formatted location (city, state/county, country)
+        "location": ", ".join(filter(None, [city, state_or_county, country])),
+        "latitude": position.get("lat"),
+        "longitude": position.get("lng"),
+    }
+
+
+class AsyncState:
+    """ per event loop, the httpx client (its pooled connections belong to the loop) and the lookups in flight """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GEOCODE_TIMEOUT[1], connect=GEOCODE_TIMEOUT[0]),
+            limits=httpx.Limits(max_keepalive_connections=GEOCODE_POOL_SIZE),
+        )
+        self.in_flight = {}
+
+
+_async_states = weakref.WeakKeyDictionary()
+
+
+def async_state():
+    """ the AsyncState of the running loop, an ASGI server has one loop per process so this is built once """
+
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        state = _async_states[loop] = AsyncState()
+    return state
+
+
+async def afetch(query, lang, client):
+    """ fetch through the httpx client """
+
+    params = {"q": query, "apiKey": settings.HERE_API_KEY}
+    if lang:
+        params["lang"] = lang
+
+    try:
+        response = await client.get(settings.HERE_GEOCODE_URL, params=params)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        raise GeocodingError(f"Geocoding {query!r} failed: HERE answered {e.response.status_code}") from e
+    except (httpx.HTTPError, ValueError) as e:
+        raise GeocodingError(f"Geocoding {query!r} failed: {type(e).__name__}") from e
+
+
+async def alookup(key, query, lang, client):
+    """ lookup for async code, the database tier runs on a thread (like the async ORM does) and HERE is called with httpx """
+
+    now = timezone.now()
+    cached = await sync_to_async(cached_response)(key, now)
+    if cached is not None:
+        response, expires_at = cached
+        memory_cache.set(key, response, expires_at)
+        return response
+
+    response = await afetch(query, lang, client)
+    expires_at = now + timedelta(seconds=settings.GEOCODE_CACHE_TTL)
+    await sync_to_async(store_response)(key, query, response, now, expires_at)
+    memory_cache.set(key, response, expires_at)
+    return response
+
+
+async def ageocode(query, lang=None):
+    """ geocode for async code, raises GeocodingError """
+
+    key = cache_key(query, lang)
+    cached = memory_cache.get(key, timezone.now())
+    if cached is not None:
+        return cached
+
+    state = async_state()
+
+    # shielded, a waiter that gets cancelled (client went away) mustnt cancel the lookup everyone else is waiting on
+    future = state.in_flight.get(key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = state.in_flight[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await alookup(key, query, lang, state.client)
+    except BaseException as e:
+        future.set_exception(e if isinstance(e, GeocodingError) else GeocodingError(f"Geocoding {query!r} was interrupted"))
+        # nobody may be waiting, this marks the exception as seen so asyncio doesnt log it
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        del state.in_flight[key]
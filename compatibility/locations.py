@@ -0,0 +1,111 @@
+# normalisation for the Location table (models.Location). Donors and donation requests keep their free text city/region/country for display,
+# but every row also points at a Location keyed by ISO country code + casefolded region and city, so the location filters are plain indexed
+# equality lookups instead of icontains/iexact scans over free text. A country that isnt in django_countries keys its Location on the
+# casefolded name instead (Location.country_key).
+
+from functools import lru_cache
+
+from django.db.models import Q
+from django.utils.translation import override
+from django_countries import countries
+from django_countries.data import COUNTRIES
+
+
+# names HERE Maps and people type that django_countries doesnt know (it calls the US "United States of America")
+COUNTRY_ALIASES = {
+    "united states": "US",
+    "usa": "US",
+    "uk": "GB",
+    "great britain": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+}
+
+
+def normalize_name(value):
+    """ the lookup key of a city/region/country name: surrounding and repeated whitespace dropped, casefolded """
+
+    return " ".join((value or "").split()).casefold()
+
+
+@lru_cache(maxsize=1)
+def country_lookup():
+    """ {normalised name or code: ISO code} for every country, built once (countries.by_name scans every country on every call) """
+
+    lookup = dict(COUNTRY_ALIASES)
+    with override("en"):
+        for code, name in countries:
+            lookup[normalize_name(name)] = code
+        for code, name in COUNTRIES.items():
+            lookup.setdefault(normalize_name(str(name)), code)
+    for code, names in countries.OLD_NAMES.items():
+        for name in names:
+            lookup.setdefault(normalize_name(name), code)
+    for code in COUNTRIES:
+        lookup.setdefault(code.casefold(), code)
+        lookup.setdefault(countries.alpha3(code).casefold(), code)
+    return lookup
+
+
+def country_code(value):
+    """ ISO 3166 alpha-2 code for a country name, alpha-2 or alpha-3 code, "" when it isnt a country we know """
+
+    return country_lookup().get(normalize_name(value), "")
+
+
+def unknown_country_key(country):
+    """ the Location.country_key of a typed country: its normalised name when it isnt a country we know, "" when it is (those are keyed on
+     the code, so "France" and "FR" share a Location) """
+
+    return "" if country_code(country) else normalize_name(country)
+
+
+def location_key(city, region, country):
+    """ the (country, country_key, region_key, city_key) a Location is unique on, None when there is no location at all. A row with only
+     a country we dont know still has a location, its country_key """
+
+    key = (country_code(country), unknown_country_key(country), normalize_name(region), normalize_name(city))
+    return key if any(key) else None
+
+
+def get_location(city, region, country):
+    """ the Location for these free text parts, created the first time it is seen (None when all parts are empty) """
+
+    from .models import Location
+
+    key = location_key(city, region, country)
+    if key is None:
+        return None
+
+    code, country_key, region_key, city_key = key
+    location, _ = Location.objects.get_or_create(
+        country=code, country_key=country_key, region_key=region_key, city_key=city_key,
+        defaults={"region": " ".join((region or "").split()), "city": " ".join((city or "").split())},
+    )
+    return location
+
+
+def place_q(text, prefix="place"):
+    """ Q matching rows whose Location city, region or country equals the text (case insensitive, a country also by its code).
+     prefix is the path to the Location from the model being filtered """
+
+    key = normalize_name(text)
+    query = Q(**{f"{prefix}__city_key": key}) | Q(**{f"{prefix}__region_key": key})
+
+    code = country_code(text)
+    if code:
+        query |= Q(**{f"{prefix}__country": code})
+    else:
+        query |= Q(**{f"{prefix}__country_key": key})
+    return query
+
+
+def country_q(text, prefix="place"):
+    """ Q matching rows in this country (name or code). A country we dont know is matched by its typed name (case insensitive), so rows
+     with a country django_countries doesnt have can still be filtered """
+
+    code = country_code(text)
+    if code:
+        return Q(**{f"{prefix}__country": code})
+    return Q(**{f"{prefix}__country_key": normalize_name(text)})
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from compatibility.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Runs one (or all) of the micro-benchmarks in compatibility/benchmarks.py and prints the timings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("names", nargs="*", help=f"benchmarks to run, any of: {', '.join(BENCHMARKS)} (default all)")
+        parser.add_argument("--size", type=int, default=None, help="override the default input size of the benchmark")
+
+    def handle(self, *args, **options):
+        names = options["names"] or list(BENCHMARKS)
+
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        for name in names:
+            kwargs = {"size": options["size"]} if options["size"] else {}
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"benchmark: {name}"))
+            for label, value in self.run_benchmark(BENCHMARKS[name], kwargs):
+                self.stdout.write(f"  {label:<40} {value}")
+
+    def run_benchmark(self, benchmark, kwargs):
+        """ database benchmarks run against a fresh test database that is thrown away afterwards, so the real data is never touched """
+
+        if not getattr(benchmark, "needs_database", False):
+            return benchmark(**kwargs)
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            return benchmark(**kwargs)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
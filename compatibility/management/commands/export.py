@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from compatibility.exports import EXPORT_FORMATS, EXPORTS, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams a full export of donors, donation requests or match history as NDJSON or CSV, to a file or stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", choices=list(EXPORTS), help="what to export")
+        parser.add_argument("--format", dest="file_format", choices=list(EXPORT_FORMATS), default="ndjson")
+        parser.add_argument("--blood-type", default=None, help="only rows with this blood type")
+        parser.add_argument("--status", default=None, help="only donation requests with this status")
+        parser.add_argument("--country", default=None, help="only rows in this country (name or ISO code)")
+        parser.add_argument("--output", "-o", default=None, help="file to write to (default stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            chunks = stream_export(
+                options["name"], options["file_format"],
+                blood_type=options["blood_type"], status=options["status"], country=options["country"],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if not options["output"]:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+
+        # newline="" so the csv module's own \r\n line endings are written as is
+        with open(options["output"], "w", encoding="utf-8", newline="") as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from compatibility.geocode_jobs import (
+    BACKFILL_CHUNK_SIZE, BACKFILL_RATE, BACKFILL_WORKERS, backfill_coordinates, missing_coordinates,
+)
+
+
+class Command(BaseCommand):
+    help = "Geocodes the donors that have a city/country but no coordinates, so they show up in the distance based features (safe to stop and rerun)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="donors read and written per round")
+        parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="concurrent geocoding calls")
+        parser.add_argument("--rate", type=float, default=BACKFILL_RATE, help="max geocoding calls per second, across all workers")
+        parser.add_argument("--start-after", type=int, default=0, help="donor id to resume after (printed with every chunk)")
+        parser.add_argument("--limit", type=int, default=None, help="stop after this many donors")
+
+    def handle(self, *args, **options):
+        total = missing_coordinates(options["start_after"]).count()
+        if options["limit"] is not None:
+            total = min(total, options["limit"])
+        self.stdout.write(f"{total:,} donors without coordinates")
+
+        start = time.monotonic()
+        progress = None
+        for progress in backfill_coordinates(
+            chunk_size=options["chunk_size"], workers=options["workers"], rate=options["rate"],
+            start_after=options["start_after"], limit=options["limit"],
+        ):
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"{progress['donors']:,}/{total:,} donors ({progress['lookups']:,} lookups), {progress['updated']:,} updated, "
+                f"{progress['not_found']:,} not found, {progress['failed']:,} failed, {progress['donors'] / elapsed:,.1f} donors/s, "
+                f"resume with --start-after {progress['last_id']}"
+            )
+
+        if progress is None:
+            self.stdout.write(self.style.SUCCESS("Nothing to backfill."))
+        elif progress["failed"]:
+            self.stdout.write(self.style.WARNING(f"Done, {progress['failed']:,} donors failed to geocode, rerun to retry them."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from compatibility.geocode_jobs import GEOCODE_BATCH_SIZE, claim_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs the background geocoding queue, filling in donor locations saved by register and edit_profile (run one or more of these next to the web server)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=GEOCODE_BATCH_SIZE, help="jobs claimed per round")
+        parser.add_argument("--sleep", type=float, default=2.0, help="seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="work through whatever is due now and exit instead of polling forever")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            jobs = claim_jobs(options["batch_size"])
+
+            if not jobs:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            counts = run_jobs(jobs)
+            self.stdout.write(", ".join(f"{count} {label}" for label, count in counts.items() if count) or "nothing to do")
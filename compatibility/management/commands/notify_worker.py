@@ -0,0 +1,32 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from compatibility.fanout import FANOUT_CLAIM_SIZE, claim_fanouts, run_fanouts
+
+
+class Command(BaseCommand):
+    help = "Runs the donation request fan-out queue, notifying the compatible donors near every new request (run one or more of these next to the web server)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--claim-size", type=int, default=FANOUT_CLAIM_SIZE, help="fan-outs claimed per round")
+        parser.add_argument("--sleep", type=float, default=2.0, help="seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="work through whatever is due now and exit instead of polling forever")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            jobs = claim_fanouts(options["claim_size"])
+
+            if not jobs:
+                if options["once"]:
+                    return
+                time.sleep(options["sleep"])
+                continue
+
+            # one mail connection for every email of the round
+            with get_connection() as mail_connection:
+                counts = run_fanouts(jobs, mail_connection)
+            self.stdout.write(", ".join(f"{count} {label}" for label, count in counts.items() if count) or "nothing to do")
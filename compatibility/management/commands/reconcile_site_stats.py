@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from compatibility.site_stats import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recounts the homepage statistics rollup from the donor table and fixes any drift (run it periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="only report drift, exit with an error instead of fixing it")
+
+    def handle(self, *args, **options):
+        problems = reconcile(fix=not options["check"])
+
+        for problem in problems:
+            self.stdout.write(f"  {problem}")
+
+        if problems and options["check"]:
+            raise CommandError("Site stats rollup does not match a full recount.")
+
+        self.stdout.write(self.style.SUCCESS("Site stats fixed." if problems else "Site stats match a full recount."))
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0009_donationrequest_city_donationrequest_country_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="donor",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="donor_lat_lng_idx"
+            ),
+        ),
+    ]
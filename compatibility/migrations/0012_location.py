@@ -0,0 +1,71 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:18
+
+import django.db.models.deletion
+import django_countries.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0011_tableversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Location",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "country",
+                    django_countries.fields.CountryField(blank=True, max_length=2),
+                ),
+                ("region", models.CharField(blank=True, max_length=100)),
+                ("city", models.CharField(blank=True, max_length=100)),
+                ("region_key", models.CharField(blank=True, max_length=100)),
+                ("city_key", models.CharField(blank=True, max_length=100)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["city_key"], name="location_city_key_idx"),
+                    models.Index(fields=["region_key"], name="location_region_key_idx"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("country", "region_key", "city_key"),
+                        name="unique_location",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="donationrequest",
+            name="place",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="donation_requests",
+                to="compatibility.location",
+            ),
+        ),
+        migrations.AddField(
+            model_name="donor",
+            name="place",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="donors",
+                to="compatibility.location",
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+from django.utils.translation import override
+from django_countries import countries
+from django_countries.data import COUNTRIES
+
+
+# the key logic as it was when this migration was written (compatibility/locations.py at the time), copied so later changes to the live
+# normalisation cant change what this migration does
+
+COUNTRY_ALIASES = {
+    "united states": "US",
+    "usa": "US",
+    "uk": "GB",
+    "great britain": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+}
+
+
+def normalize_name(value):
+    return " ".join((value or "").split()).casefold()
+
+
+def country_lookup():
+    lookup = dict(COUNTRY_ALIASES)
+    with override("en"):
+        for code, name in countries:
+            lookup[normalize_name(name)] = code
+        for code, name in COUNTRIES.items():
+            lookup.setdefault(normalize_name(str(name)), code)
+    for code, names in countries.OLD_NAMES.items():
+        for name in names:
+            lookup.setdefault(normalize_name(name), code)
+    for code in COUNTRIES:
+        lookup.setdefault(code.casefold(), code)
+        lookup.setdefault(countries.alpha3(code).casefold(), code)
+    return lookup
+
+
+def location_key(city, region, country, lookup):
+    """ the (country, region_key, city_key) a Location is unique on, None when there is no location at all """
+
+    key = (lookup.get(normalize_name(country), ""), normalize_name(region), normalize_name(city))
+    return key if any(key) else None
+
+
+def backfill_locations(apps, schema_editor):
+    """ creates a Location for every distinct (city, region, country) already on a donor or donation request and points the rows at it """
+
+    Location = apps.get_model("compatibility", "Location")
+    Donor = apps.get_model("compatibility", "Donor")
+    DonationRequest = apps.get_model("compatibility", "DonationRequest")
+
+    locations = {}
+    lookup = country_lookup()
+
+    def location_id(city, region, country):
+        key = location_key(city, region, country, lookup)
+        if key is None:
+            return None
+        if key not in locations:
+            code, region_key, city_key = key
+            locations[key] = Location.objects.get_or_create(
+                country=code, region_key=region_key, city_key=city_key,
+                defaults={"region": " ".join((region or "").split()), "city": " ".join((city or "").split())},
+            )[0].id
+        return locations[key]
+
+    # one UPDATE per distinct location instead of one per row
+    for model, region_field in ((Donor, "state_or_county"), (DonationRequest, "state")):
+        parts = model.objects.values_list("city", region_field, "country").distinct()
+        for city, region, country in parts:
+            model.objects.filter(city=city, **{region_field: region}, country=country).update(place_id=location_id(city, region, country))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0012_location"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0013_backfill_location"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SiteStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("total_donors", models.PositiveIntegerField(default=0)),
+                ("total_countries", models.PositiveIntegerField(default=0)),
+                ("total_cities", models.PositiveIntegerField(default=0)),
+                ("total_states_or_counties", models.PositiveIntegerField(default=0)),
+                ("total_blood_types", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SiteStatValue",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("field", models.CharField(max_length=20)),
+                ("value", models.CharField(blank=True, max_length=100)),
+                ("is_null", models.BooleanField(default=False)),
+                ("donor_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("field", "value", "is_null"),
+                        name="unique_site_stat_value",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0014_site_stats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="donationrequest",
+            index=models.Index(
+                fields=["status", "blood_type_needed", "place"],
+                name="request_status_blood_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donationrequest",
+            index=models.Index(
+                fields=["recipient", "status"], name="request_recipient_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donationrequest",
+            index=models.Index(
+                fields=["requester", "status"], name="request_requester_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donationrequest",
+            index=models.Index(fields=["-created_at"], name="request_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="donor",
+            index=models.Index(
+                fields=["blood_type", "id"], name="donor_blood_type_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donor",
+            index=models.Index(
+                condition=models.Q(("availability", True)),
+                fields=["id"],
+                name="donor_available_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="donor",
+            index=models.Index(
+                condition=models.Q(("availability", True)),
+                fields=["place", "blood_type"],
+                name="donor_available_place_idx",
+            ),
+        ),
+    ]
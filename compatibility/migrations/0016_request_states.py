@@ -0,0 +1,42 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:25
+
+from django.db import migrations, models
+
+
+def clean_up_statuses(apps, schema_editor):
+    """ 'Matched' (set by the old accept_request, never a valid choice) becomes 'Accepted', and of duplicate pending requests between
+     the same two users only the newest stays pending so the constraint can be added """
+
+    DonationRequest = apps.get_model("compatibility", "DonationRequest")
+
+    DonationRequest.objects.filter(status="Matched").update(status="Accepted")
+
+    seen = set()
+    duplicates = []
+    for request_id, requester_id, recipient_id in DonationRequest.objects.filter(status="Pending").order_by("-created_at", "-id").values_list(
+        "id", "requester_id", "recipient_id"
+    ):
+        if (requester_id, recipient_id) in seen:
+            duplicates.append(request_id)
+        seen.add((requester_id, recipient_id))
+
+    DonationRequest.objects.filter(id__in=duplicates).update(status="Cancelled")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0015_composite_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_up_statuses, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="donationrequest",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "Pending")),
+                fields=("requester", "recipient"),
+                name="unique_pending_request",
+            ),
+        ),
+    ]
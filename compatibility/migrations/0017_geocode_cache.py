@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0016_request_states"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GeocodeCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("query", models.TextField()),
+                ("response", models.JSONField()),
+                ("fetched_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
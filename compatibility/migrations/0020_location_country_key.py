@@ -0,0 +1,106 @@
+# Generated by Django 5.1.15 on 2026-10-18 00:24
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils.translation import override
+from django_countries import countries
+from django_countries.data import COUNTRIES
+
+
+# the key logic as it was when this migration was written (compatibility/locations.py with the country_key this migration adds), copied so
+# later changes to the live normalisation cant change what this migration does
+
+COUNTRY_ALIASES = {
+    "united states": "US",
+    "usa": "US",
+    "uk": "GB",
+    "great britain": "GB",
+    "england": "GB",
+    "scotland": "GB",
+    "wales": "GB",
+}
+
+
+def normalize_name(value):
+    return " ".join((value or "").split()).casefold()
+
+
+def country_lookup():
+    lookup = dict(COUNTRY_ALIASES)
+    with override("en"):
+        for code, name in countries:
+            lookup[normalize_name(name)] = code
+        for code, name in COUNTRIES.items():
+            lookup.setdefault(normalize_name(str(name)), code)
+    for code, names in countries.OLD_NAMES.items():
+        for name in names:
+            lookup.setdefault(normalize_name(name), code)
+    for code in COUNTRIES:
+        lookup.setdefault(code.casefold(), code)
+        lookup.setdefault(countries.alpha3(code).casefold(), code)
+    return lookup
+
+
+def location_key(city, region, country, lookup):
+    """ the (country, country_key, region_key, city_key) a Location is unique on, None when there is no location at all """
+
+    code = lookup.get(normalize_name(country), "")
+    key = (code, "" if code else normalize_name(country), normalize_name(region), normalize_name(city))
+    return key if any(key) else None
+
+
+def key_unknown_countries(apps, schema_editor):
+    """ moves the donors and donation requests whose country wasnt recognised to a Location keyed on that country's name. That is the rows
+     on a Location without a country, and the rows with only such a country, which had no Location at all """
+
+    Location = apps.get_model("compatibility", "Location")
+    Donor = apps.get_model("compatibility", "Donor")
+    DonationRequest = apps.get_model("compatibility", "DonationRequest")
+
+    lookup = country_lookup()
+
+    # one UPDATE per distinct location like 0013
+    for model, region_field in ((Donor, "state_or_county"), (DonationRequest, "state")):
+        parts = model.objects.filter(Q(place__isnull=True) | Q(place__country="")).exclude(country="").exclude(country__isnull=True)
+        for city, region, country in parts.values_list("city", region_field, "country").distinct():
+            key = location_key(city, region, country, lookup)
+            if key is None or not key[1]:
+                continue
+
+            code, country_key, region_key, city_key = key
+            location, _ = Location.objects.get_or_create(
+                country=code, country_key=country_key, region_key=region_key, city_key=city_key,
+                defaults={"region": " ".join((region or "").split()), "city": " ".join((city or "").split())},
+            )
+            model.objects.filter(city=city, **{region_field: region}, country=country).update(place_id=location.id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("compatibility", "0019_notification_fanout"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="location",
+            name="unique_location",
+        ),
+        migrations.AddField(
+            model_name="location",
+            name="country_key",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name="location",
+            index=models.Index(fields=["country_key"], name="location_country_key_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="location",
+            constraint=models.UniqueConstraint(
+                fields=("country", "country_key", "region_key", "city_key"),
+                name="unique_location",
+            ),
+        ),
+        migrations.RunPython(key_unknown_countries, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django_countries.fields import CountryField
 
 
-# importing the is_compatible function which returns true if the donor blood is compatible with recipient blood.
-from compatibility.utils import is_compatible
+# importing the is_compatible function which returns true if the donor blood is compatible with recipient blood, and the recipient -> donors
+# side of the same compiled index (used to be a separate COMPATIBILITY_CHART in this file)
+from compatibility.utils import is_compatible, compatible_donor_types
+from compatibility.locations import get_location
 
 
 # Global lists for better reuse, too much to keep track of when there are individual blood type
@@ -15,18 +19,6 @@ BLOOD_TYPES = [
 ]
 
 
-COMPATIBILITY_CHART = {
-    "A+": ["A+", "A-", "O+", "O-"],
-    "A-": ["A-", "O-"],
-    "B+": ["B+", "B-", "O+", "O-"],
-    "B-": ["B-", "O-"],
-    "AB+": ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"],
-    "AB-": ["A-", "B-", "AB-", "O-"],
-    "O+": ["O+", "O-"],
-    "O-": ["O-"],
-}
-
-
 # extending AbstractUser to include extra fields (and fixing reverse access error as sugegsted by ddb)
 class User(AbstractUser):
 
@@ -39,6 +31,37 @@ class User(AbstractUser):
         return f"{self.username}"
 
 
+# normalised location dimension, donors and donation requests point at one of these (see locations.py). The free text city/region/country on
+# them is still what gets displayed, the filters go through the indexed keys here instead
+class Location(models.Model):
+    """ one (country, region, city), unique on the ISO country code and the casefolded region and city """
+
+    country = CountryField(blank=True)  # ISO code, blank when the typed country wasnt recognised
+    region = models.CharField(max_length=100, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+
+    # casefolded region and city (locations.normalize_name), what the filters compare against
+    region_key = models.CharField(max_length=100, blank=True)
+    city_key = models.CharField(max_length=100, blank=True)
+
+    # casefolded typed country when it wasnt recognised (so country is blank), filters fall back to it
+    country_key = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        constraints = [
+            # also the index for country filters, country is its first column
+            models.UniqueConstraint(fields=["country", "country_key", "region_key", "city_key"], name="unique_location"),
+        ]
+        indexes = [
+            models.Index(fields=["city_key"], name="location_city_key_idx"),
+            models.Index(fields=["region_key"], name="location_region_key_idx"),
+            models.Index(fields=["country_key"], name="location_country_key_idx"),
+        ]
+
+    def __str__(self):
+        return ", ".join(filter(None, [self.city, self.region, self.country.name or self.country_key]))
+
+
 # donor model for having a registered donor and being able to represent the donor on the MAP using API
 class Donor(models.Model):
     """ model representing a registered blood donor """
@@ -59,9 +82,27 @@ class Donor(models.Model):
     # and latitude/longitudes arent ever displayed (Stores combined address, default "Unknown")
     location = models.CharField(max_length=255, blank=True, null=True, default="Unknown")
 
+    # normalised city/state_or_county/country, kept in sync on save
+    place = models.ForeignKey(Location, on_delete=models.SET_NULL, null=True, blank=True, related_name="donors")
+
     availability = models.BooleanField(default=True)
     date_registered = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # bounding box prefilter of the radius search (donors_nearby_api)
+            models.Index(fields=["latitude", "longitude"], name="donor_lat_lng_idx"),
+
+            # blood type filters, (blood_type, id) also gives donor_list_api its keyset order and match_donors its id order
+            models.Index(fields=["blood_type", "id"], name="donor_blood_type_idx"),
+
+            # the list views only ever show available donors, so these only index those rows. id alone serves the unfiltered list in
+            # keyset order, (place, blood_type, id) the country filter and the request fan-out (fanout.py), which walks one place and blood
+            # type at a time in id order
+            models.Index(fields=["id"], condition=models.Q(availability=True), name="donor_available_idx"),
+            models.Index(fields=["place", "blood_type", "id"], condition=models.Q(availability=True), name="donor_available_place_idx"),
+        ]
+
     def __str__(self):
         return f"Donor: {self.user.username} ({self.blood_type}) - {self.city or 'Unknown'}, {self.country or 'Unknown'}"
 
@@ -89,6 +130,7 @@ class Donor(models.Model):
 
         # for backward compatibility
         self.update_location()
+        self.place = get_location(self.city, self.state_or_county, self.country)
         super().save(*args, **kwargs)
 
 
@@ -105,6 +147,9 @@ class DonationRequest(models.Model):
         ('Cancelled', 'Cancelled'),
     ]
 
+    # a request starts as Pending and can only leave Pending, once, to one of these (see transition)
+    CLOSED_STATUSES = ('Accepted', 'Rejected', 'Cancelled')
+
     requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_requests")
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="received_requests")
     blood_type_needed = models.CharField(max_length=3, choices=BLOOD_TYPES)
@@ -116,6 +161,9 @@ class DonationRequest(models.Model):
     state = models.CharField(max_length=100, blank=True, null=True)
     country = models.CharField(max_length=100, blank=True, null=True)
 
+    # normalised city/state/country, set together with them from location
+    place = models.ForeignKey(Location, on_delete=models.SET_NULL, null=True, blank=True, related_name="donation_requests")
+
     donors = models.ManyToManyField(Donor, related_name="donations", blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -123,16 +171,43 @@ class DonationRequest(models.Model):
     accepted_donors = models.ManyToManyField(Donor, related_name="accepted_requests", blank=True)
     is_accepted = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # active_requests_api and donation_history, status first since every active requests query filters on it
+            models.Index(fields=["status", "blood_type_needed", "place"], name="request_status_blood_idx"),
+
+            # incoming requests of a user (get_requests, profile page) and their own outgoing ones (profile page)
+            models.Index(fields=["recipient", "status"], name="request_recipient_status_idx"),
+            models.Index(fields=["requester", "status"], name="request_requester_status_idx"),
+
+            # newest first on the homepage and donation_history
+            models.Index(fields=["-created_at"], name="request_created_idx"),
+        ]
+        constraints = [
+            # a donor can only have one pending request to the same donor, two parallel clicks cant both get through
+            models.UniqueConstraint(fields=["requester", "recipient"], condition=models.Q(status="Pending"), name="unique_pending_request"),
+        ]
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """ remembers the location the row was loaded with, so save only splits it again when it changed """
+
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_location = instance.__dict__.get("location")
+        return instance
 
     def save(self, *args, **kwargs):
-        """ Autofill city, state, and country from location if available """
+        """ Autofill city, state, and country (and the normalised place) from location if available """
 
-        if self.location:
+        if self.location and self.location != getattr(self, "_loaded_location", None):
             parts = self.location.split(", ")
             self.city = parts[0] if len(parts) > 0 else ""
             self.state = parts[1] if len(parts) > 1 else ""
             self.country = parts[2] if len(parts) > 2 else ""
+            self.place = get_location(self.city, self.state, self.country)
         super().save(*args, **kwargs)
+        self._loaded_location = self.location
 
     def __str__(self):
         return f"Request by {self.recipient.username} for {self.blood_type_needed} blood"
@@ -143,21 +218,77 @@ class DonationRequest(models.Model):
 
     def find_potential_donors(self):
         """ finds donors whose blood type is compatible with the requested blood type """
-        return Donor.objects.filter(blood_type__in=COMPATIBILITY_CHART.get(self.blood_type_needed, []))
+        return Donor.objects.filter(blood_type__in=compatible_donor_types(self.blood_type_needed))
+
+    # constant cost checks for the request workflow, eligibility is just the compatibility bitmask and membership is one indexed row lookup on
+    # the m2m through table (the unique (donationrequest_id, donor_id) index), neither loads a queryset of donors
+    def can_be_donated_by(self, donor):
+        """ True if the donors blood type can be given for this request """
+        return is_compatible(donor.blood_type, self.blood_type_needed)
+
+    def has_donor(self, donor):
+        """ True if donor is one of the donors on this request """
+        return DonationRequest.donors.through.objects.filter(donationrequest_id=self.pk, donor_id=donor.pk).exists()
+
+    def has_accepted_donor(self, donor):
+        """ True if donor is one of the accepted donors of this request """
+        return DonationRequest.accepted_donors.through.objects.filter(donationrequest_id=self.pk, donor_id=donor.pk).exists()
+
+    # the state machine. Every transition is a single conditional UPDATE ... WHERE status='Pending' instead of read, check, save, so when two
+    # clicks race the database lets exactly one of them through and the other one gets False back. Queryset updates dont send signals,
+    # so the table version for conditional GETs is bumped (and the live event for the two users is sent, events.py) here
+    def transition(self, new_status, **fields):
+        """ moves a pending request to new_status (one of CLOSED_STATUSES), returns False if it wasnt pending anymore """
+
+        from .events import publish_request_event
+        from .versions import DONATION_REQUEST, bump_version
+
+        if new_status not in self.CLOSED_STATUSES:
+            raise ValueError(f"A request can't move to {new_status}")
+
+        if not DonationRequest.objects.filter(pk=self.pk, status='Pending').update(status=new_status, **fields):
+            return False
+
+        self.status = new_status
+        for field, value in fields.items():
+            setattr(self, field, value)
+        bump_version(DONATION_REQUEST)
+        publish_request_event(self, new_status.lower())
+        return True
+
+    def accept(self, donors=None):
+        """ accepts a pending request and reveals the contact info of donors (default every donor on the request), all or nothing """
+
+        with transaction.atomic():
+            if not self.transition('Accepted', is_accepted=True):
+                return False
+
+            donor_ids = [donor.pk for donor in donors] if donors is not None else list(self.donors.values_list("id", flat=True))
+            Through = DonationRequest.accepted_donors.through
+            Through.objects.bulk_create(
+                [Through(donationrequest_id=self.pk, donor_id=donor_id) for donor_id in donor_ids], ignore_conflicts=True,
+            )
+        return True
+
+    def reject(self):
+        """ the recipient turned a pending request down """
+        return self.transition('Rejected')
+
+    def cancel(self):
+        """ the requester withdrew a pending request """
+        return self.transition('Cancelled')
 
     def accept_request(self, donor):
-        """ allows a donor to accept the request and reveals contact info """
-        
-        if donor in self.donors.all():
-            self.accepted_donors.add(donor)
-            self.is_accepted = True
-            self.status = 'Matched'
-            self.save()
+        """ allows a donor on the request to accept it and reveals their contact info, False if they cant (anymore) """
+
+        if not self.has_donor(donor):
+            return False
+        return self.accept([donor])
 
     def donor_contact_info(self, donor):
         """ returns donor contact info if the request is accepted """
 
-        if donor in self.accepted_donors.all():
+        if self.has_accepted_donor(donor):
             return {"email": donor.user.email, "location": donor.location}
         return {"email": "Hidden until accepted", "location": "Hidden until accepted"}
 
@@ -184,3 +315,159 @@ class BloodMatchHistory(models.Model):
 
 
 
+# change counter per table, bumped by the signals in signals.py on every save/delete so the read-only json endpoints can answer
+# conditional GETs (ETag / Last-Modified) with one tiny query instead of running their main query (see versions.py)
+class TableVersion(models.Model):
+
+    table = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+
+
+# rollup of the homepage numbers, a single row kept up to date by the Donor signals (site_stats.py) so the index page reads it in one fetch
+# instead of counting the donor table on every hit. "manage.py reconcile_site_stats" recounts it from scratch
+class SiteStats(models.Model):
+
+    total_donors = models.PositiveIntegerField(default=0)
+    total_countries = models.PositiveIntegerField(default=0)
+    total_cities = models.PositiveIntegerField(default=0)
+    total_states_or_counties = models.PositiveIntegerField(default=0)
+    total_blood_types = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.total_donors} donors in {self.total_countries} countries"
+
+
+# how many donors have each distinct country/city/state_or_county/blood_type value, the distinct totals in SiteStats go up when a value
+# gets its first donor and down when it loses its last one. NULL counts as a value of its own (is_null), like in SELECT DISTINCT
+class SiteStatValue(models.Model):
+
+    field = models.CharField(max_length=20)
+    value = models.CharField(max_length=100, blank=True)
+    is_null = models.BooleanField(default=False)
+    donor_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["field", "value", "is_null"], name="unique_site_stat_value"),
+        ]
+
+    def __str__(self):
+        return f"{self.field}={'NULL' if self.is_null else self.value}: {self.donor_count}"
+
+
+# HERE geocode responses cached in the database (second tier under the in-process LRU in geocoding.py), keyed on a hash of the normalised query
+# so the same city typed with different case/spacing is one entry. Entries past expires_at are refetched, and a lookup of a cached query never
+# leaves the server
+class GeocodeCacheEntry(models.Model):
+
+    key = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    response = models.JSONField()
+    fetched_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.query} (until {self.expires_at:%Y-%m-%d})"
+
+
+# background geocode of a donors location (geocode_jobs.py, run by "manage.py geocode_worker"), so register and edit_profile only record the
+# raw location and never wait on HERE. One row per donor, a newer edit resets it. status is what the profile page polls
+class GeocodeJob(models.Model):
+
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Running", "Running"),
+        ("Done", "Done"),
+        ("Failed", "Failed"),
+    ]
+
+    donor = models.OneToOneField(Donor, on_delete=models.CASCADE, related_name="geocode_job")
+    query = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+
+    # the worker batch running the job and when it took it, a job whose worker died is taken again after geocode_jobs.GEOCODE_JOB_LEASE
+    claim = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    last_error = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the workers "what is due" query
+            models.Index(fields=["status", "run_after"], name="geocode_job_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"Geocode {self.query} for {self.donor_id}: {self.status}"
+
+
+
+# in-app notification of a user, written by the request fan-out (fanout.py) for every available compatible donor in the region of a new request
+class Notification(models.Model):
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    donation_request = models.ForeignKey(DonationRequest, on_delete=models.CASCADE, null=True, blank=True, related_name="notifications")
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # the newest notifications of a user (get_notifications)
+            models.Index(fields=["user", "-created_at"], name="notification_user_idx"),
+        ]
+        constraints = [
+            # a fan-out batch that runs again after a crash doesnt notify anyone twice
+            models.UniqueConstraint(fields=["user", "donation_request"], name="unique_request_notification"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.message}"
+
+
+# background fan-out of a new donation request (fanout.py, run by "manage.py notify_worker"), so create_donor_request returns as soon as the
+# request is saved however many donors it reaches. The cursor (last_blood_type, last_donor_id) is where the next batch starts, the job goes
+# back to Pending after every few batches so one huge fan-out cant hold a worker and a crashed one carries on where it stopped
+class NotificationFanout(models.Model):
+
+    STATUS_CHOICES = [
+        ("Pending", "Pending"),
+        ("Running", "Running"),
+        ("Done", "Done"),
+        ("Failed", "Failed"),
+    ]
+
+    donation_request = models.OneToOneField(DonationRequest, on_delete=models.CASCADE, related_name="fanout")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+
+    last_blood_type = models.CharField(max_length=3, blank=True)
+    last_donor_id = models.PositiveBigIntegerField(default=0)
+    notified = models.PositiveIntegerField(default=0)
+    emailed = models.PositiveIntegerField(default=0)
+
+    # same lease as GeocodeJob, see fanout.FANOUT_JOB_LEASE
+    claim = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    last_error = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the workers "what is due" query
+            models.Index(fields=["status", "run_after"], name="fanout_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"Fan-out of request {self.donation_request_id}: {self.status}, {self.notified} notified"
@@ -0,0 +1,97 @@
+# cache for the map region aggregates (donor_locations_api), one entry per (blood_type, location) filter combination.
+# Entries are keyed on the change versions of the tables the aggregates read (versions.py, the Donor and User TableVersion rows the signals
+# bump), which conditional_on has already loaded for the request. The versions live in the database, so an edit made by any process (another
+# web process, geocode_worker, notify_worker, the admin) moves every process to new keys on its next request, whichever cache backend
+# settings.CACHES has. Stale entries are never deleted, nothing reads their old keys anymore and they expire after REGION_CACHE_TIMEOUT.
+# The key is taken from the versions read before the count runs, so a count that raced an edit is stored under the old key and never served.
+
+# With the default local memory cache every process keeps its own entries and its own hit/miss counters (cache_stats is per process then).
+
+import hashlib
+
+from django.core.cache import cache
+
+from .locations import normalize_name
+from .versions import DONOR, USER, aget_versions, get_versions
+
+
+CACHE_PREFIX = "donor_locations"
+HITS_KEY = f"{CACHE_PREFIX}:hits"
+MISSES_KEY = f"{CACHE_PREFIX}:misses"
+
+# the tables the aggregates are counted from, the view has to be conditional_on the same ones
+REGION_TABLES = (DONOR, USER)
+
+# seconds a cached aggregate lives, only to free the memory of entries whose versions are gone
+REGION_CACHE_TIMEOUT = 600
+
+
+def cache_key(blood_type, location, versions):
+    """ key of the entry for these filters at these table versions ({table: (version, modified_at)}, versions.get_versions). Location
+     filtering is case insensitive so the key is too, hashed so any free text location makes a valid memcached key """
+
+    parts = [blood_type, normalize_name(location), *(versions[table][0] for table in REGION_TABLES)]
+    return f"{CACHE_PREFIX}:{hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()}"
+
+
+def count(key):
+    """ increments one of the hit/miss counters, creating it on first use """
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+async def acount(key):
+    """ count with the async cache api, for async views """
+
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
+
+
+def get_region_counts(request, blood_type, location):
+    """ returns (key, cached response data) for these filters, the data is None on a miss. Pass the key to set_region_counts """
+
+    key = cache_key(blood_type, location, get_versions(request, REGION_TABLES))
+    data = cache.get(key)
+    count(HITS_KEY if data is not None else MISSES_KEY)
+    return key, data
+
+
+def set_region_counts(key, data):
+    """ caches the response data under the key get_region_counts returned, if a table changed since then nobody reads that key anymore """
+
+    cache.set(key, data, REGION_CACHE_TIMEOUT)
+
+
+async def aget_region_counts(request, blood_type, location):
+    """ get_region_counts with the async cache api, a shared backend (redis, memcached) is then never waited on from the event loop """
+
+    key = cache_key(blood_type, location, await aget_versions(request, REGION_TABLES))
+    data = await cache.aget(key)
+    await acount(HITS_KEY if data is not None else MISSES_KEY)
+    return key, data
+
+
+async def aset_region_counts(key, data):
+    """ set_region_counts with the async cache api """
+
+    await cache.aset(key, data, REGION_CACHE_TIMEOUT)
+
+
+def cache_stats():
+    """ hit/miss counters since the cache was last cleared, for checking the hit rate in production """
+
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+    }
@@ -1,3 +1,7 @@
+import json
+
+from django.db.models import Prefetch
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Donor, DonationRequest, User, BloodMatchHistory
 
@@ -42,8 +46,19 @@ class DonationRequestSerializer(serializers.ModelSerializer):
     requester_username = serializers.CharField(source='requester.username', read_only=True)
     country = serializers.CharField(read_only=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """ loads everything the serializer reads for a whole page up front, the requester with a join and the accepted donors with their
+         users in one prefetch query, so the number of queries doesnt grow with the number of rows """
+
+        return queryset.select_related("requester").prefetch_related(
+            Prefetch("accepted_donors", queryset=Donor.objects.select_related("user").order_by("id"))
+        )
+
     def get_donor_contact_info(self, obj):
-        return [obj.donor_contact_info(donor) for donor in obj.accepted_donors.all()]
+        # every donor in accepted_donors has accepted, so there is no need for obj.donor_contact_info to check membership again (that was a
+        # query per donor), the prefetched donors and their users are used as they are
+        return [{"email": donor.user.email, "location": donor.location} for donor in obj.accepted_donors.all()]
 
     class Meta:
         model = DonationRequest
@@ -62,3 +77,156 @@ class BloodMatchHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = BloodMatchHistory
         fields = '__all__'
+
+
+
+# Fast path for the list endpoints (opt-in with settings.FAST_JSON_SERIALIZATION). Instead of running every row through DRF's per-field machinery,
+# rows are built straight from .values_list() tuples (user columns joined in the same query) and encoded with the C json encoder, configured
+# exactly like DRF's JSONRenderer with the default settings (compact, unicode, strict), so the bytes on the wire are the same either way.
+# Keep the dict keys below in the same order as the serializers fields above.
+
+FAST_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def encode_json(data):
+    """ encodes data to a str the same way rest_framework.renderers.JSONRenderer does (data must already be plain python types) """
+
+    ret = FAST_JSON_ENCODER.encode(data)
+
+    # same as DRF, \u2028 and \u2029 are always escaped so the output is a strict javascript subset
+    return ret.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+
+
+def render_json(data):
+    """ encode_json, as the bytes of a response body """
+
+    return encode_json(data).encode()
+
+
+def represent_datetime(value):
+    """ same as DRF's DateTimeField.to_representation with the default ISO 8601 format """
+
+    if value is None:
+        return None
+
+    if timezone.is_aware(value):
+        value = value.astimezone(timezone.get_current_timezone())
+
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def represent_str(value):
+    """ DRF CharField, None stays None and everything else becomes a string """
+
+    return None if value is None else str(value)
+
+
+DONOR_COLUMNS = ("id", "blood_type", "availability", "user_id", "user__username", "user__email", "location", "city", "country")
+
+
+def donor_data(rows):
+    """ DonorSerializer data for each DONOR_COLUMNS row, lazily so the export can stream it """
+
+    for donor_id, blood_type, availability, user_id, username, email, location, city, country in rows:
+        yield {
+            "id": donor_id,
+            "blood_type": blood_type,
+            "availability": availability,
+            "user": {"id": user_id, "username": username, "email": email},
+            "location": represent_str(location),
+            "city": represent_str(city),
+            "country": represent_str(country),
+        }
+
+
+def fast_donor_data(queryset):
+    """ DonorSerializer(queryset, many=True).data, in one query """
+
+    return list(donor_data(queryset.values_list(*DONOR_COLUMNS)))
+
+
+DONATION_REQUEST_COLUMNS = ("id", "recipient_id", "requester__username", "blood_type_needed", "location", "status", "country", "created_at")
+
+
+def accepted_contact_info(request_ids):
+    """ (request id, email, location) of every accepted donor of these requests, read from the through table with the donor and user columns
+     joined in """
+
+    return DonationRequest.accepted_donors.through.objects.filter(
+        donationrequest_id__in=request_ids
+    ).order_by("donor_id").values_list("donationrequest_id", "donor__user__email", "donor__location")
+
+
+def donation_request_data(rows, accepted=None):
+    """ DonationRequestSerializer data for a list of DONATION_REQUEST_COLUMNS rows, plus one query for the contact info of all their
+     accepted donors (unless the accepted_contact_info rows are passed in already) """
+
+    if accepted is None:
+        accepted = accepted_contact_info([row[0] for row in rows])
+
+    contact_info = {}
+    for request_id, email, location in accepted:
+        contact_info.setdefault(request_id, []).append({"email": email, "location": location})
+
+    return [
+        {
+            "recipient": recipient_id,
+            "requester_username": represent_str(requester_username),
+            "blood_type_needed": blood_type_needed,
+            "location": represent_str(location),
+            "status": status,
+            "country": represent_str(country),
+            "created_at": represent_datetime(created_at),
+            "donor_contact_info": contact_info.get(request_id, []),
+            "id": request_id,
+        }
+        for request_id, recipient_id, requester_username, blood_type_needed, location, status, country, created_at in rows
+    ]
+
+
+def fast_donation_request_data(queryset):
+    """ DonationRequestSerializer(queryset, many=True).data, in two queries (requests, then the contact info of all their accepted donors) """
+
+    return donation_request_data(list(queryset.values_list(*DONATION_REQUEST_COLUMNS)))
+
+
+async def afast_donor_data(queryset):
+    """ fast_donor_data with the async ORM """
+
+    return list(donor_data([row async for row in queryset.values_list(*DONOR_COLUMNS)]))
+
+
+async def afast_donation_request_data(queryset):
+    """ fast_donation_request_data with the async ORM """
+
+    rows = [row async for row in queryset.values_list(*DONATION_REQUEST_COLUMNS)]
+    accepted = [row async for row in accepted_contact_info([row[0] for row in rows])]
+    return donation_request_data(rows, accepted)
+
+
+# BloodMatchHistorySerializer nests the whole UserSerializer for donor and recipient, the export keeps the same fields but only with the
+# id/username/email of each user like DonorSerializer does (the rest of the user row is account data, not match history)
+MATCH_HISTORY_COLUMNS = (
+    "id", "donor_id", "donor__user__username", "donor__user__email", "recipient_id", "recipient__username", "recipient__email",
+    "donor_blood", "recipient_blood", "is_compatible", "match_date", "donation_request_id",
+)
+
+
+def match_history_data(rows):
+    """ export data for each MATCH_HISTORY_COLUMNS row, lazily """
+
+    for (history_id, donor_id, donor_username, donor_email, recipient_id, recipient_username, recipient_email,
+         donor_blood, recipient_blood, compatible, match_date, donation_request_id) in rows:
+        yield {
+            "id": history_id,
+            "donor": {"id": donor_id, "username": donor_username, "email": donor_email},
+            "recipient": {"id": recipient_id, "username": recipient_username, "email": recipient_email},
+            "donor_blood": donor_blood,
+            "recipient_blood": recipient_blood,
+            "is_compatible": compatible,
+            "match_date": represent_datetime(match_date),
+            "donation_request": donation_request_id,
+        }
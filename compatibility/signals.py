@@ -0,0 +1,106 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .events import publish_request_event
+from .models import DonationRequest, Donor, User
+from .site_stats import apply_donor_change
+from .spatial import update_donor_grid
+from .versions import DONATION_REQUEST, DONOR, USER, bump_version
+
+
+# signal receivers that keep the derived/cached donor data and the table change versions (versions.py) in sync with the models, connected in
+# apps.py ready()
+# see https://docs.djangoproject.com/en/5.1/topics/signals/
+
+
+def region_state(donor):
+    """ the donor fields the homepage rollup counts, in the order site_stats.REGION_STATE_FIELDS expects """
+
+    return (donor.blood_type, donor.city, donor.state_or_county, donor.country)
+
+
+def refresh_grid(donor_ids, versions):
+    """ updates these donors in the spatial grid once the change committed, a rolled back change never reaches it. versions is what the
+     change bumped, the grid is rebuilt for a version it never saw applied. robust, so a grid update that fails (it is logged) cant break the
+     other on commit callbacks or the request that already committed """
+
+    transaction.on_commit(lambda: update_donor_grid(donor_ids, versions), robust=True)
+
+
+@receiver(pre_save, sender=Donor)
+def remember_donor_region(sender, instance, **kwargs):
+    """ keeps the region/blood type the donor had before this save, so the homepage rollup can move the donor from the old values """
+
+    instance._old_region_state = None
+
+    if instance.pk:
+        instance._old_region_state = Donor.objects.filter(pk=instance.pk).values_list("blood_type", "city", "state_or_county", "country").first()
+
+
+@receiver(post_save, sender=Donor)
+def donor_saved(sender, instance, created, **kwargs):
+    """ a donor was created or edited, so the spatial grid, the homepage rollup and everything keyed on the donor version (conditional GETs,
+     the map region cache) are out of date """
+
+    refresh_grid([instance.pk], bump_version(DONOR))
+
+    old_state = getattr(instance, "_old_region_state", None)
+    new_state = region_state(instance)
+
+    # homepage numbers, a save with no old row is a new donor
+    apply_donor_change(old_state, new_state)
+
+
+@receiver(post_delete, sender=Donor)
+def donor_deleted(sender, instance, **kwargs):
+    """ a donor was deleted (also when their user is deleted, through the cascade) """
+
+    refresh_grid([instance.pk], bump_version(DONOR))
+    apply_donor_change(region_state(instance), None)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """ User.is_active decides if a donor is shown at all, but logging in also saves the user (only last_login), so skip that one """
+
+    if created or (update_fields is not None and set(update_fields) == {"last_login"}):
+        return
+
+    versions = bump_version(USER)
+
+    # a user without a donor still bumped the version, the grid has to know that change is applied too
+    donor_id = Donor.objects.filter(user=instance).values_list("pk", flat=True).first()
+    refresh_grid([donor_id] if donor_id else [], versions)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """ the donor list and active requests show user names and emails. Their donor went with them (donor_deleted) """
+
+    refresh_grid([], bump_version(USER))
+
+
+@receiver(post_save, sender=DonationRequest)
+@receiver(post_delete, sender=DonationRequest)
+def donation_request_changed(sender, instance, **kwargs):
+    """ any change to a request can change the active requests list """
+
+    bump_version(DONATION_REQUEST)
+
+
+@receiver(post_save, sender=DonationRequest)
+def donation_request_created(sender, instance, created, **kwargs):
+    """ a new request shows up live on the recipients (and the requesters other tabs) profile page, the transitions send their own """
+
+    if created:
+        publish_request_event(instance, "created")
+
+
+@receiver(m2m_changed, sender=DonationRequest.donors.through)
+@receiver(m2m_changed, sender=DonationRequest.accepted_donors.through)
+def donation_request_donors_changed(sender, action, **kwargs):
+    """ accepting a request only touches the m2m tables, the active requests list shows the accepted donors contact info """
+
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_version(DONATION_REQUEST)
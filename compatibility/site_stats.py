@@ -0,0 +1,146 @@
+# the homepage statistics (total donors and distinct countries, cities, states/counties and blood types) as a rollup that is updated incrementally.
+# The Donor signals call apply_donor_change with the donor's region state before and after every create/update/delete, which moves the per value
+# donor counts in SiteStatValue and the totals in the single SiteStats row, so index() reads everything with one row fetch.
+# bulk_create, queryset .update() and raw SQL dont send signals, reconcile() (manage.py reconcile_site_stats, also run by "manage.py check
+# --database default") recounts everything from the donor table and fixes any drift.
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Donor, SiteStats, SiteStatValue
+
+
+SITE_STATS_PK = 1
+
+# Donor field -> SiteStats column with its number of distinct values
+DISTINCT_FIELDS = {
+    "country": "total_countries",
+    "city": "total_cities",
+    "state_or_county": "total_states_or_counties",
+    "blood_type": "total_blood_types",
+}
+
+STAT_COLUMNS = ("total_donors", *DISTINCT_FIELDS.values())
+
+# the fields of a signals.region_state tuple, in order
+REGION_STATE_FIELDS = ("blood_type", "city", "state_or_county", "country")
+
+
+def get_site_stats():
+    """ the homepage numbers as a dict, one query. The first call ever (no rollup yet) builds the rollup with a full recount """
+
+    stats = SiteStats.objects.filter(pk=SITE_STATS_PK).values(*STAT_COLUMNS).first()
+    if stats is None:
+        reconcile()
+        stats = SiteStats.objects.filter(pk=SITE_STATS_PK).values(*STAT_COLUMNS).first()
+    return stats
+
+
+def move_value_count(field, value, delta):
+    """ adds delta (+1 or -1) to the donor count of one value, returns +1/-1 when the value just got its first donor / lost its last one,
+     else 0. Call it inside a transaction """
+
+    key = {"field": field, "value": value or "", "is_null": value is None}
+
+    # the unique constraint makes a second process creating the same row at the same time get the existing one
+    SiteStatValue.objects.get_or_create(**key)
+
+    # the increment happens in the database like the SiteStats totals, so concurrent donor changes all count. A decrement of a count that is
+    # already 0 (a drifted rollup) changes nothing
+    rows = SiteStatValue.objects.filter(**key)
+    if delta < 0:
+        rows = rows.filter(donor_count__gte=-delta)
+    if not rows.update(donor_count=Greatest(F("donor_count") + delta, 0)):
+        return 0
+
+    # the UPDATE holds the rows write lock until the transaction ends, so this reads the count it left behind
+    after = SiteStatValue.objects.filter(**key).values_list("donor_count", flat=True).get()
+    before = after - delta
+
+    if before == 0 and after > 0:
+        return 1
+    if before > 0 and after == 0:
+        return -1
+    return 0
+
+
+def apply_donor_change(old_state, new_state):
+    """ updates the rollup for one donor going from old_state to new_state (signals.region_state tuples, None for a created/deleted donor).
+     Does nothing until the rollup exists, get_site_stats builds it from a full count the first time it is read """
+
+    if old_state == new_state:
+        return
+
+    old_values = dict(zip(REGION_STATE_FIELDS, old_state)) if old_state is not None else None
+    new_values = dict(zip(REGION_STATE_FIELDS, new_state)) if new_state is not None else None
+
+    with transaction.atomic():
+        if not SiteStats.objects.filter(pk=SITE_STATS_PK).exists():
+            return
+
+        changes = {}
+        if old_values is None:
+            changes["total_donors"] = 1
+        elif new_values is None:
+            changes["total_donors"] = -1
+
+        for field, column in DISTINCT_FIELDS.items():
+            if old_values is not None and new_values is not None and old_values[field] == new_values[field]:
+                continue
+
+            change = 0
+            if old_values is not None:
+                change += move_value_count(field, old_values[field], -1)
+            if new_values is not None:
+                change += move_value_count(field, new_values[field], 1)
+            if change:
+                changes[column] = change
+
+        if changes:
+            SiteStats.objects.filter(pk=SITE_STATS_PK).update(**{column: F(column) + change for column, change in changes.items()})
+
+
+def recount():
+    """ full recount from the donor table, returns (totals dict like get_site_stats, {(field, value): donor count}) """
+
+    totals = {"total_donors": Donor.objects.count()}
+    value_counts = {}
+
+    for field, column in DISTINCT_FIELDS.items():
+        groups = Donor.objects.values_list(field).annotate(donors=Count("id")).order_by()
+        for value, donors in groups:
+            value_counts[(field, value)] = donors
+        totals[column] = len(groups)
+
+    return totals, value_counts
+
+
+def reconcile(fix=True):
+    """ compares the rollup with a full recount and (with fix) rewrites it to match, returns the list of columns that were off """
+
+    totals, value_counts = recount()
+
+    stored = SiteStats.objects.filter(pk=SITE_STATS_PK).values(*STAT_COLUMNS).first() or {}
+    stored_counts = {
+        (field, None if is_null else value): donor_count
+        for field, value, is_null, donor_count in SiteStatValue.objects.filter(donor_count__gt=0).values_list("field", "value", "is_null", "donor_count")
+    }
+
+    problems = [
+        f"{column} is {stored.get(column)}, a full recount gives {count}"
+        for column, count in totals.items() if stored.get(column) != count
+    ]
+    if stored_counts != value_counts:
+        problems.append("the per value donor counts dont match a full recount")
+
+    if fix and problems:
+        with transaction.atomic():
+            SiteStatValue.objects.all().delete()
+            SiteStatValue.objects.bulk_create([
+                SiteStatValue(field=field, value=value or "", is_null=value is None, donor_count=donors)
+                for (field, value), donors in value_counts.items()
+            ])
+            SiteStats.objects.update_or_create(pk=SITE_STATS_PK, defaults=totals)
+
+    return problems
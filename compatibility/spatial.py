@@ -0,0 +1,379 @@
+# spatial index over Donor.latitude/longitude, used to rank compatible donors by distance (match_donors?sort=distance)
+# donors are bucketed into a uniform grid of lat/lng cells, a k nearest query starts at the cell of the search point and walks outwards ring by ring,
+# stopping as soon as nothing outside the rings already visited can be closer than the k-th best donor found so far. So a query only looks at the
+# donors around the point instead of running haversine over every donor in the table.
+
+import heapq
+import math
+import threading
+
+from collections import defaultdict
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# 0.5 degrees is roughly 55km north-south, small enough that a city sits in a handful of cells and big enough that rural areas arent all empty cells
+DEFAULT_CELL_DEGREES = 0.5
+
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """ great circle distance in km between two points given in degrees """
+
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many_km(lat, lng, lats, lngs):
+    """ distances in km from one point to every (lats[i], lngs[i]) point, in a single pass. The trig for the fixed point is worked out once
+     instead of per pair, this is the hot loop of the radius search """
+
+    lat0 = math.radians(lat)
+    lng0 = math.radians(lng)
+    cos_lat0 = math.cos(lat0)
+    diameter = 2 * EARTH_RADIUS_KM
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+
+    return [
+        diameter * asin(min(1.0, sqrt(
+            sin((radians(lat2) - lat0) / 2) ** 2 + cos_lat0 * cos(radians(lat2)) * sin((radians(lng2) - lng0) / 2) ** 2
+        )))
+        for lat2, lng2 in zip(lats, lngs)
+    ]
+
+
+def approx_distance_bound(lat, km):
+    """ the largest approximate distance (squared degrees with the longitude scaled by cos(lat), what donors_nearby_api orders by) a point
+     within km of latitude lat can have. The scaling is only right along the parallel of lat, towards the pole a degree of longitude is
+     shorter and a point can be much further away by the approximation than it really is. From the haversine formula
+     sin²(dlat/2) + cos(lat)cos(lat2)sin²(dlng/2) = sin²(km/2R), the largest value is at one end, all latitude or all longitude """
+
+    theta = km / EARTH_RADIUS_KM
+    lat0 = math.radians(abs(lat))
+    limit = math.sin(theta / 2) ** 2
+
+    # cos(lat)cos(lat2) for the point within km that is nearest the pole
+    scale = math.cos(lat0) * math.cos(min(math.pi / 2, lat0 + theta))
+    if scale > limit:
+        lng_delta = 2 * math.asin(math.sqrt(limit / scale))
+        bound = max(theta ** 2, (math.cos(lat0) * lng_delta) ** 2)
+    else:
+        # the circle reaches round the pole, the longitude difference can be anything
+        bound = theta ** 2 + (math.cos(lat0) * math.pi) ** 2
+
+    # in squared degrees, with some slack for the rounding of the database arithmetic
+    return math.degrees(1) ** 2 * bound * (1 + 1e-9)
+
+
+def bounding_box(lat, lng, radius_km):
+    """ returns (min_lat, max_lat, min_lng, max_lng) of a box that contains every point within radius_km of the point.
+     min_lng > max_lng means the box wraps around the antimeridian, and the longitude range is None when the circle reaches a pole """
+
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - lat_delta, lat + lat_delta
+
+    # near the poles every longitude can be inside the circle
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    # widest longitude span of the circle (at the latitude where it touches the box side), see
+    # http://janmatuschek.de/LatitudeLongitudeBoundingCoordinates
+    lng_delta = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+
+    min_lng = (lng - lng_delta + 180) % 360 - 180
+    max_lng = (lng + lng_delta + 180) % 360 - 180
+    return min_lat, max_lat, min_lng, max_lng
+
+
+# server side clustering for the map (donor_clusters_api). At zoom 0 a cluster cell is 90 degrees (a 256px tile split into 4x4 cells of 64px)
+# and every zoom level halves it, like map tiles do. Zoom is capped so a cluster is never smaller than a couple of km, clusters are drawn at the
+# cell centre and a one donor cluster at zoom 18 would otherwise give away where that donor lives
+CLUSTER_CELL_DEGREES_AT_ZOOM_0 = 90.0
+MAX_CLUSTER_ZOOM = 12
+
+# upper bound on the number of cells a single viewport can be split into, bigger viewports get coarser cells instead of more of them
+MAX_CLUSTER_CELLS = 1024
+
+
+def cluster_cell_degrees(zoom, south, west, north, east):
+    """ returns the cluster cell size in degrees for a viewport, halving per zoom level but never splitting the viewport into more
+     than MAX_CLUSTER_CELLS cells """
+
+    cell = CLUSTER_CELL_DEGREES_AT_ZOOM_0 / 2 ** min(max(zoom, 0), MAX_CLUSTER_ZOOM)
+
+    lat_span = max(north - south, 0)
+    lng_span = (east - west) % 360 or 360
+
+    while (math.floor(lat_span / cell) + 2) * (math.floor(lng_span / cell) + 2) > MAX_CLUSTER_CELLS:
+        cell *= 2
+
+    return cell
+
+
+class DonorGrid:
+    """ in-memory uniform grid of donors, each row is a (donor_id, user_id, blood_type, latitude, longitude) tuple """
+
+    def __init__(self, rows, cell_degrees=DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.lat_cells = math.ceil(180 / cell_degrees)
+        self.lng_cells = math.ceil(360 / cell_degrees)
+        self.cells = defaultdict(list)
+
+        # donor_id -> row, so a donor that moved or went away can be found in its old cell
+        self.rows = {}
+
+        for row in rows:
+            self.cells[self.cell_for(row[3], row[4])].append(row)
+            self.rows[row[0]] = row
+
+    def __len__(self):
+        return len(self.rows)
+
+    # put and discard replace the cell list instead of changing it, so a query walking the old list on another thread is never disturbed
+
+    def put(self, row):
+        """ adds a donor, or moves them to the cell of their new coordinates """
+
+        self.discard(row[0])
+        cell = self.cell_for(row[3], row[4])
+        self.cells[cell] = self.cells.get(cell, []) + [row]
+        self.rows[row[0]] = row
+
+    def discard(self, donor_id):
+        """ removes a donor if they are in the grid """
+
+        row = self.rows.pop(donor_id, None)
+        if row is None:
+            return
+
+        cell = self.cell_for(row[3], row[4])
+        remaining = [other for other in self.cells.get(cell, ()) if other[0] != donor_id]
+        if remaining:
+            self.cells[cell] = remaining
+        else:
+            self.cells.pop(cell, None)
+
+    def cell_for(self, lat, lng):
+        """ returns the (row, column) of the cell a point falls into, longitudes wrap around at 180 """
+
+        cell_row = min(max(int((lat + 90) // self.cell_degrees), 0), self.lat_cells - 1)
+        cell_col = int((lng + 180) // self.cell_degrees) % self.lng_cells
+        return cell_row, cell_col
+
+    def ring_cells(self, center_row, center_col, ring):
+        """ yields the cells on the border of the square 'ring' cells away from the center cell """
+
+        rows = range(max(center_row - ring, 0), min(center_row + ring, self.lat_cells - 1) + 1)
+
+        # once the ring is wider than the whole globe the columns start repeating, so just take every column once
+        if 2 * ring + 1 >= self.lng_cells:
+            cols = range(self.lng_cells)
+        else:
+            cols = [(center_col + offset) % self.lng_cells for offset in range(-ring, ring + 1)]
+
+        for cell_row in rows:
+            if ring == 0 or abs(cell_row - center_row) == ring or len(cols) == self.lng_cells:
+                yield from ((cell_row, cell_col) for cell_col in cols)
+            else:
+                # only the left and right edge of the ring on the middle rows
+                yield cell_row, cols[0]
+                yield cell_row, cols[-1]
+
+    def distance_outside(self, lat, lng, center_row, center_col, ring):
+        """ lower bound (km) on the distance from the point to any donor outside the rings 0..ring that were already visited """
+
+        # north/south, the gap to the edge of the visited block (a block that reaches a pole has nothing beyond it on that side)
+        south_row, north_row = center_row - ring, center_row + ring
+        south_gap = lat - (-90 + south_row * self.cell_degrees) if south_row > 0 else math.inf
+        north_gap = (-90 + (north_row + 1) * self.cell_degrees) - lat if north_row < self.lat_cells - 1 else math.inf
+        lat_bound = EARTH_RADIUS_KM * math.radians(min(south_gap, north_gap))
+
+        # east/west, the distance to the meridian at the edge of the visited block (cross track distance, valid for any latitude on that meridian)
+        if 2 * ring + 1 >= self.lng_cells:
+            return lat_bound
+
+        west_gap = (lng + 180) - (center_col - ring) * self.cell_degrees
+        east_gap = (center_col + ring + 1) * self.cell_degrees - (lng + 180)
+        lng_gap = math.radians(min(west_gap, east_gap, 90))
+        lng_bound = EARTH_RADIUS_KM * math.asin(min(1.0, math.sin(lng_gap) * math.cos(math.radians(lat))))
+
+        return min(lat_bound, lng_bound)
+
+    def nearest(self, lat, lng, k, blood_types=None, max_km=None, exclude_user_id=None):
+        """ returns up to k (distance_km, row) pairs closest to the point, nearest first.
+         blood_types limits the search to donors with one of those blood types, max_km drops anything further away """
+
+        if k <= 0 or not self.rows:
+            return []
+
+        # normalise the longitude into [-180, 180) so the gaps in distance_outside are measured from the right cell
+        lng = (lng + 180) % 360 - 180
+        center_row, center_col = self.cell_for(lat, lng)
+        max_ring = max(self.lat_cells, self.lng_cells // 2 + 1)
+
+        # max heap of the best k so far, stored as (-distance, donor_id, row) so the worst of the k is on top
+        best = []
+
+        # rings near the poles or wider than the globe can hand back cells that were already visited
+        visited = set()
+
+        for ring in range(max_ring + 1):
+            for cell in self.ring_cells(center_row, center_col, ring):
+                if cell in visited:
+                    continue
+                visited.add(cell)
+
+                for row in self.cells.get(cell, ()):
+                    if blood_types is not None and row[2] not in blood_types:
+                        continue
+                    if row[1] == exclude_user_id:
+                        continue
+
+                    distance = haversine_km(lat, lng, row[3], row[4])
+                    if max_km is not None and distance > max_km:
+                        continue
+
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, row[0], row))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, row[0], row))
+
+            # stop once everything that hasnt been visited yet is further away than the k-th best (or than max_km)
+            bound = self.distance_outside(lat, lng, center_row, center_col, ring)
+            if len(best) == k and -best[0][0] <= bound:
+                break
+            if max_km is not None and bound > max_km:
+                break
+
+        return [(-neg_distance, row) for neg_distance, _, row in sorted(best, reverse=True)]
+
+
+def brute_force_nearest(rows, lat, lng, k, blood_types=None, max_km=None, exclude_user_id=None):
+    """ reference implementation of DonorGrid.nearest, runs haversine over every row (used by the tests and the benchmark) """
+
+    candidates = (
+        (haversine_km(lat, lng, row[3], row[4]), row)
+        for row in rows
+        if (blood_types is None or row[2] in blood_types) and row[1] != exclude_user_id
+    )
+    if max_km is not None:
+        candidates = ((distance, row) for distance, row in candidates if distance <= max_km)
+    return heapq.nsmallest(k, candidates, key=lambda pair: (pair[0], pair[1][0]))
+
+
+# per process cache of the grid built from the database. Every process (each web process, geocode_worker) builds its own and it is kept for
+# as long as it matches the Donor and User table versions (versions.py), so:
+# - a donor change made by this process is applied to it one donor at a time once it commits (update_donor_grid, from the signals in
+#   signals.py), and the version that change bumped is remembered as applied
+# - a change made by another process, or by a queryset update that only bumps the version, leaves a version this process never applied, and
+#   the next query rebuilds the grid from the table
+# Each query reads the two versions (one small query), a grid is never served once the database has a change it doesnt hold. The lock makes
+# concurrent requests wait for the one rebuild instead of each scanning the donor table, and keeps single donor updates from racing a rebuild
+_donor_grid = None
+_donor_grid_lock = threading.Lock()
+
+# {table: version} the grid holds every change up to, and {table: versions applied past that} for changes that committed out of order
+_donor_grid_versions = None
+_applied_versions = defaultdict(set)
+
+
+def grid_donors():
+    """ the donors the grid holds, available and active with coordinates """
+
+    from .models import Donor
+
+    return Donor.objects.filter(
+        availability=True, user__is_active=True, latitude__isnull=False, longitude__isnull=False,
+    ).values_list("id", "user_id", "blood_type", "latitude", "longitude")
+
+
+def grid_versions():
+    """ the current versions of the tables the grid is read from, {table: version} """
+
+    from .models import TableVersion
+    from .versions import DONOR, USER
+
+    found = dict(TableVersion.objects.filter(table__in=(DONOR, USER)).values_list("table", "version"))
+    return {table: found.get(table, 0) for table in (DONOR, USER)}
+
+
+def grid_is_behind(versions):
+    """ True while there is no grid or the database has a change the grid doesnt hold """
+
+    held = _donor_grid_versions
+    return _donor_grid is None or any(held.get(table, 0) < version for table, version in versions.items())
+
+
+def catch_up():
+    """ moves the grid versions past the applied ones that follow on from them, call with the lock held """
+
+    global _donor_grid_versions
+
+    versions = dict(_donor_grid_versions)
+    for table, applied in _applied_versions.items():
+        while versions.get(table, 0) + 1 in applied:
+            versions[table] = versions.get(table, 0) + 1
+        applied.difference_update([version for version in applied if version <= versions.get(table, 0)])
+
+    # replaced, not changed, the lock free check in get_donor_grid reads it
+    _donor_grid_versions = versions
+
+
+def get_donor_grid():
+    """ returns the grid of available, active donors that have coordinates, rebuilding it if it was invalidated or another process changed
+     the donors """
+
+    global _donor_grid, _donor_grid_versions
+
+    current = grid_versions()
+    grid = _donor_grid
+    if grid is not None and not grid_is_behind(current):
+        return grid
+
+    with _donor_grid_lock:
+        # another thread may have rebuilt it while this one waited, or this process applied the change meanwhile
+        if _donor_grid is not None:
+            catch_up()
+
+        if grid_is_behind(current):
+            # versions before rows, a change that commits in between is in the rows and read again by its update, never missed
+            versions = grid_versions()
+            _donor_grid = DonorGrid(grid_donors().iterator(chunk_size=5000))
+            _donor_grid_versions = versions
+            catch_up()
+        return _donor_grid
+
+
+def update_donor_grid(donor_ids, versions):
+    """ reads these donors again into the cached grid, so one added, moved, unavailable or deleted donor costs a primary key lookup instead
+     of a rebuild. versions is what bump_version returned for the change, {table: version}. Nothing to do while no grid is built, the next
+     query reads them anyway """
+
+    if _donor_grid is None:
+        return
+
+    with _donor_grid_lock:
+        if _donor_grid is None:
+            return
+
+        # read under the lock, so two updates of the same donor cant apply their rows in the wrong order
+        if donor_ids:
+            rows = {row[0]: row for row in grid_donors().filter(id__in=donor_ids)}
+            for donor_id in donor_ids:
+                if donor_id in rows:
+                    _donor_grid.put(rows[donor_id])
+                else:
+                    _donor_grid.discard(donor_id)
+
+        for table, version in versions.items():
+            _applied_versions[table].add(version)
+        catch_up()
+
+
+def invalidate_donor_grid():
+    """ throws the cached grid away so the next query rebuilds it """
+
+    global _donor_grid
+    with _donor_grid_lock:
+        _donor_grid = None
@@ -27,15 +27,33 @@ document.addEventListener("DOMContentLoaded", () => {
             setupProfilePage();
         }
 
+        // the own profile page comes with its requests and matches embedded (profile_bootstrap), nothing to fetch
+        const profileBootstrap = document.getElementById("profile-bootstrap");
+        if (profileBootstrap) {
+            const data = JSON.parse(profileBootstrap.textContent);
+            renderProfileBootstrap(data);
+
+            // a location saved just before the page was loaded may still be geocoding in the background
+            const displayLocation = document.getElementById("display-location");
+            if (displayLocation && ["Pending", "Running"].includes(data.edit_profile.geocode_status)) {
+                pollGeocodeStatus(displayLocation);
+            }
+        }
+
         if (document.getElementById("pendingRequestsList")) {
             loadPendingRequests();
         }
 
         // Cancel section
-        if (document.getElementById("outgoingRequestsList")) {
+        if (document.getElementById("outgoingRequestsList") && !profileBootstrap) {
             loadOutgoingRequests();
         }
 
+        // live updates for both request lists
+        if (document.getElementById("pendingRequestsList") || document.getElementById("outgoingRequestsList")) {
+            listenForRequestEvents();
+        }
+
         if (document.getElementById("compatibility-data")) {
             setupCheckCompatibility();
         }
@@ -51,7 +69,7 @@ document.addEventListener("DOMContentLoaded", () => {
             initLocationAutocomplete(locationInput, cityInput, countryInput, latitudeInput, longitudeInput);
         }
 
-        if (document.getElementById("matchedDonorsSection")) {
+        if (document.getElementById("matchedDonorsSection") && !profileBootstrap) {
             setupMatchDonors();
         }
         console.log("match donors called", setupMatchDonors); // debug
@@ -210,6 +228,11 @@ function setupProfilePage() {
                     ].filter(Boolean).join(", ") || "Not provided";
 
                     toggleEditMode(false);
+
+                    // the location is geocoded in the background, show the tidied up city/state/country once the worker is done
+                    if (data.geocode_status === "Pending" || data.geocode_status === "Running") {
+                        pollGeocodeStatus(displayLocation);
+                    }
                 }
             })
             .catch(error => console.error("Error updating profile:", error));
@@ -236,6 +259,25 @@ function setupProfilePage() {
 }
 
 
+// polls the profile until the background geocode of a new location finishes (or gives up after a while), then updates the displayed location
+function pollGeocodeStatus(displayLocation, attempts = 30) {
+    setTimeout(() => {
+        fetch(`/api/edit_profile/`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.geocode_status === "Done") {
+                    displayLocation.textContent = [data.city, data.state_or_county, data.country].filter(Boolean).join(", ") || "Not provided";
+                } else if (data.geocode_status === "Failed") {
+                    showNotification("We couldn't find that location on the map, please try a more specific one.");
+                } else if (attempts > 1) {
+                    pollGeocodeStatus(displayLocation, attempts - 1);
+                }
+            })
+            .catch(error => console.error("Error checking location status:", error));
+    }, 2000);
+}
+
+
 // HERE Maps API & Geolocation Integration
 function initLocationAutocomplete(locationInput, cityInput, countryInput, stateOrCountyInput, latitudeInput, longitudeInput) {
     console.log("initializing HERE location autocomplete");
@@ -411,45 +453,132 @@ function initLocationAutocomplete(locationInput, cityInput, countryInput, stateO
 
 
 
+// the server pushes an event when a request of this user is created, accepted, rejected or cancelled (server-sent events from /api/notifications/)
+// and the request lists are only refetched then, so an open profile page doesnt keep asking. Without the ASGI server the endpoint answers 204,
+// the EventSource gives up and the lists refresh after the users own actions like before
+function listenForRequestEvents() {
+    if (!window.EventSource) return;
+
+    const source = new EventSource("/api/notifications/");
+    let connected = false;
+
+    // the browser reconnects by itself when the stream drops, anything that happened in between is picked up by refetching
+    source.addEventListener("open", () => {
+        if (connected) refreshRequestLists();
+        connected = true;
+    });
+
+    ["request_created", "request_accepted", "request_rejected", "request_cancelled", "resync"].forEach(type => {
+        source.addEventListener(type, refreshRequestLists);
+    });
+
+    // a new request nearby that this donor could help with (the request fan-out)
+    source.addEventListener("notification", (event) => {
+        showNotification(`🩸 ${JSON.parse(event.data).message}`);
+    });
+}
+
+// refetches whichever request lists the page has, the own profile page gets all of them (and its matches) in one call
+function refreshRequestLists() {
+    if (document.getElementById("incomingRequestsList")) {
+        fetch(`/api/profile_bootstrap/`)
+            .then(response => response.json())
+            .then(renderProfileBootstrap)
+            .catch(error => console.error("Error refreshing the profile:", error));
+        return;
+    }
+    if (document.getElementById("pendingRequestsList")) {
+        loadPendingRequests();
+    }
+    if (document.getElementById("outgoingRequestsList")) {
+        loadOutgoingRequests();
+    }
+}
+
+// fills the own profile page from the profile_bootstrap json, the edit_profile, get_requests, get_outgoing_requests and match_donors payloads
+function renderProfileBootstrap(data) {
+    renderIncomingRequests(data.get_requests);
+    renderOutgoingRequests(data.get_outgoing_requests);
+    renderMatches(data.match_donors);
+}
+
+// renders the get_requests json into the incoming requests list, with accept/reject buttons
+function renderIncomingRequests(data) {
+    const incomingList = document.getElementById("incomingRequestsList");
+    if (!incomingList) return;
+
+    incomingList.innerHTML = "";
+    if (!data.requests || data.requests.length === 0) {
+        incomingList.innerHTML = `<li class="list-group-item text-muted" id="noIncomingRequests">No incoming requests.</li>`;
+        return;
+    }
+
+    data.requests.forEach(request => {
+        const item = document.createElement("li");
+        item.className = "list-group-item d-flex justify-content-between align-items-center";
+        item.innerHTML = `
+            <span>
+                Request from: <strong>${request.requester_username}</strong>
+                (Blood Type: ${request.blood_type_needed})
+            </span>
+            <div>
+                <button class="btn btn-success btn-sm accept-btn" data-request-id="${request.id}">Accept</button>
+                <button class="btn btn-danger btn-sm reject-btn" data-request-id="${request.id}">Reject</button>
+            </div>
+        `;
+        incomingList.appendChild(item);
+    });
+
+    incomingList.querySelectorAll(".accept-btn").forEach(button => {
+        button.addEventListener("click", () => handleRequest(button.dataset.requestId, "accept"));
+    });
+    incomingList.querySelectorAll(".reject-btn").forEach(button => {
+        button.addEventListener("click", () => handleRequest(button.dataset.requestId, "reject"));
+    });
+}
+
 // fetch and display outgoing requests for the current user when in the own profile ie, user_profile.html (with cancel button)
 function loadOutgoingRequests() {
     fetch(`/api/get_outgoing_requests/`)
         .then(response => response.json())
-        .then(data => {
-            const outgoingList = document.getElementById("outgoingRequestsList");
-            if (!outgoingList) return;
+        .then(renderOutgoingRequests)
+        .catch(error => console.error("Error fetching outgoing requests:", error));
+}
 
-            // clear current content
-            outgoingList.innerHTML = "";
+// renders the get_outgoing_requests json into the outgoing requests list
+function renderOutgoingRequests(data) {
+    const outgoingList = document.getElementById("outgoingRequestsList");
+    if (!outgoingList) return;
 
-            // if there are no requests after looking at the request data, display/change the innerHTML to say so.
-            if (!data.requests || data.requests.length === 0) {
-                outgoingList.innerHTML = `<li class="list-group-item text-muted">No outgoing requests.</li>`;
-                return;
-            }
+    // clear current content
+    outgoingList.innerHTML = "";
 
-            // else show the requests with a cancel button that cancel the request
-            data.requests.forEach(request => {
-                const item = document.createElement("li");
-                item.id = `request-${request.id}`;
-                item.className = "list-group-item d-flex justify-content-between align-items-center";
-                item.innerHTML = `
-                    <span>
-                        Request to: <strong>${request.recipient_username}</strong>
-                        (Blood Type: ${request.blood_type_needed})
-                    </span>
-                    <button class="btn btn-danger btn-sm cancel-request" data-request-id="${request.id}">
-                        Cancel
-                    </button>
-                `;
+    // if there are no requests after looking at the request data, display/change the innerHTML to say so.
+    if (!data.requests || data.requests.length === 0) {
+        outgoingList.innerHTML = `<li class="list-group-item text-muted">No outgoing requests.</li>`;
+        return;
+    }
 
-                outgoingList.appendChild(item);
-            });
+    // else show the requests with a cancel button that cancel the request
+    data.requests.forEach(request => {
+        const item = document.createElement("li");
+        item.id = `request-${request.id}`;
+        item.className = "list-group-item d-flex justify-content-between align-items-center";
+        item.innerHTML = `
+            <span>
+                Request to: <strong>${request.recipient_username}</strong>
+                (Blood Type: ${request.blood_type_needed})
+            </span>
+            <button class="btn btn-danger btn-sm cancel-request" data-request-id="${request.id}">
+                Cancel
+            </button>
+        `;
 
-            // attach event listeners for cancel requests
-            setupCancelRequest();
-        })
-        .catch(error => console.error("Error fetching outgoing requests:", error));
+        outgoingList.appendChild(item);
+    });
+
+    // attach event listeners for cancel requests
+    setupCancelRequest();
 }
 
 // attach cancel event listeners to outgoing requests, giving the cancel button in the loadOutgoingRequests() function the ability to delete the request
@@ -511,7 +640,7 @@ function handleRequest(requestId, action) {
             showNotification("There was an Error: " + data.error);
         } else {
             showNotification(`✅ Request ${action}ed successfully!`);
-            loadPendingRequests(); // refresh the list (func call, defined below)
+            refreshRequestLists(); // refresh the lists (func call, defined above)
         }
     })
     .catch(error => {
@@ -609,58 +738,64 @@ function setupMatchDonors() {
             if (!response.ok) throw new Error("Failed to fetch donor matches.");
             return response.json();
         })
-        .then(data => {
-            // handle API errors
-            if (data.error) {
-                matchesList.innerHTML = `<li class="text-danger">${data.error}</li>`;
-                return;
-            }
-
-            // if no matches are found (for whatever reason), return an html list tag(because that section and contents therein as displayed as lists)
-            //  that says matches were not found
-            if (data.matches.length === 0) {
-                matchesList.innerHTML = `<li class="text-muted">No compatible donors found.</li>`;
-                return;
-            }
-
-            // populate donor list dynamically, we want to show the list of matched donors, and only their imp info for privacy reasons
-            // this means the location is hidden for each matched user, if not accepted. else, if the matched user is someone the current logged in user,
-            // has accepted a request from, then show locaiton, use the ternary if else operator
-            // then show the request donation button
-            matchesList.innerHTML = "";
-            data.matches.forEach(donor => {
-                const donorItem = document.createElement("li");
-                donorItem.className = "list-group-item d-flex justify-content-between align-items-center";
-
-                donorItem.innerHTML = `
-                    <div>
-                        <strong><a href="/user/${donor.id}/profile/">${donor.username}</a></strong>
-                        (${donor.blood_type})<br>
-                        📧 Email: <a href="mailto:${donor.email}">${donor.email}</a><br>
-                        📍 Location: ${donor.is_accepted ? donor.location : "Hidden until accepted"}
-                    </div>
-                    <button class="btn btn-sm btn-danger request-btn" data-donor-id="${donor.id}">
-                        Request Donation
-                    </button>
-                `;
-
-                matchesList.appendChild(donorItem); // update the matches list div
-            });
-
-            // attach event listeners to all request buttons, call createDonationRequest function on the donorId(in models.py)
-            document.querySelectorAll(".request-btn").forEach(button => {
-                button.addEventListener("click", (e) => {
-                    const donorId = e.target.getAttribute("data-donor-id");
-                    createDonationRequest(donorId);
-                });
-            });
-        })
+        .then(renderMatches)
         .catch(error => {
             console.error("Error fetching donor matches:", error);
             matchesList.innerHTML = `<li class="text-danger">Error loading matches. Please try again later.</li>`;
         });
 }
 
+// renders the match_donors json into the matches list
+function renderMatches(data) {
+    const matchesList = document.getElementById("matchesList");
+    if (!matchesList) return;
+
+    // handle API errors
+    if (data.error) {
+        matchesList.innerHTML = `<li class="text-danger">${data.error}</li>`;
+        return;
+    }
+
+    // if no matches are found (for whatever reason), return an html list tag(because that section and contents therein as displayed as lists)
+    //  that says matches were not found
+    if (data.matches.length === 0) {
+        matchesList.innerHTML = `<li class="text-muted">No compatible donors found.</li>`;
+        return;
+    }
+
+    // populate donor list dynamically, we want to show the list of matched donors, and only their imp info for privacy reasons
+    // this means the location is hidden for each matched user, if not accepted. else, if the matched user is someone the current logged in user,
+    // has accepted a request from, then show locaiton, use the ternary if else operator
+    // then show the request donation button
+    matchesList.innerHTML = "";
+    data.matches.forEach(donor => {
+        const donorItem = document.createElement("li");
+        donorItem.className = "list-group-item d-flex justify-content-between align-items-center";
+
+        donorItem.innerHTML = `
+            <div>
+                <strong><a href="/user/${donor.id}/profile/">${donor.username}</a></strong>
+                (${donor.blood_type})<br>
+                📧 Email: <a href="mailto:${donor.email}">${donor.email}</a><br>
+                📍 Location: ${donor.is_accepted ? donor.location : "Hidden until accepted"}
+            </div>
+            <button class="btn btn-sm btn-danger request-btn" data-donor-id="${donor.id}">
+                Request Donation
+            </button>
+        `;
+
+        matchesList.appendChild(donorItem); // update the matches list div
+    });
+
+    // attach event listeners to all request buttons, call createDonationRequest function on the donorId(in models.py)
+    document.querySelectorAll(".request-btn").forEach(button => {
+        button.addEventListener("click", (e) => {
+            const donorId = e.target.getAttribute("data-donor-id");
+            createDonationRequest(donorId);
+        });
+    });
+}
+
 
 // Function: Toggle Matches Section, this function sets up event listeners attached to the  "hide matches" button, changing the buttons innerHTML
 // depending on if its clicked. The matches are shown by default, when the button is clicked, it hides the matchedDonorsSection and the button text
@@ -730,16 +865,19 @@ function setupDonorList() {
     // exit if the donor list section is not found
     if (!donorList) return;
 
-    // start with first donor
-    let counter = 1;
+    // cursor of the next page (from the api), null once the last page has been loaded
+    let nextCursor = null;
+    let hasMore = true;
+    let loading = false;
 
     // load donors 15 at a time
     const quantity = 15;
 
-    // when DOM loads, render the first 15 donors
-    document.addEventListener('DOMContentLoaded', fetchDonorList);
+    // current filters, kept so scrolling keeps loading the filtered list
+    let currentBloodType = "";
+    let currentCountry = "";
 
-    // if scrolled to bottom, load the next 15 posts
+    // if scrolled to bottom, load the next 15 donors (appended below the ones already shown)
     window.onscroll = () => {
         if (window.innerHeight + window.scrollY >= document.body.offsetHeight) {
             fetchDonorList();
@@ -757,38 +895,46 @@ function setupDonorList() {
 
             // get form data
             const formData = new FormData(filterForm);
-            const bloodType = formData.get("blood_type");
-            const country = formData.get("country");
+            currentBloodType = formData.get("blood_type") || "";
+            currentCountry = formData.get("country") || "";
 
-            // reset to 1 so filtered list starts from beginning instead of nothing
-            counter = 1
+            // reset the cursor so the filtered list starts from the beginning instead of nothing
+            nextCursor = null;
+            hasMore = true;
+            donorList.innerHTML = "";
 
             // fetch filtered donor list
-            fetchDonorList(bloodType, country);
+            fetchDonorList();
         });
     }
 
-    // Function: Fetch donors based on filters and populate the list, contained within setupDonorList()
-    function fetchDonorList(bloodType = "", country = "") {
+    // Function: Fetch the next page of donors based on filters and append it to the list, contained within setupDonorList()
+    function fetchDonorList() {
+
+        // nothing left to load, or a page is already on its way
+        if (!hasMore || loading) return;
+        loading = true;
 
-        // set start and end donor numbers, and update counter
-        const start = counter;
-        const end = start + quantity - 1;
-        counter = end + 1;
+        // the api pages with a cursor (keyset pagination), the first page has no cursor
+        const params = new URLSearchParams({ blood_type: currentBloodType, country: currentCountry, page_size: quantity });
+        if (nextCursor) params.append("cursor", nextCursor);
 
-        // place "&start=${start}&end=${end}" parameters to get the donors within the specified range, in this case it is filters to apply the pagination
-        fetch(`/api/donors/?blood_type=${bloodType}&country=${country}&start=${start}&end=${end}`)
+        fetch(`/api/donors/?${params.toString()}`)
             .then(response => {
                 if (!response.ok) throw new Error("Failed to fetch donors.");
                 return response.json();
             })
             .then(data => {
+                const isFirstPage = !nextCursor;
+                nextCursor = data.next_cursor;
+                hasMore = Boolean(data.next_cursor);
+
                 // populate the updated donor cards
-                if (data.donors.length === 0) {
+                if (isFirstPage && data.donors.length === 0) {
                     donorList.innerHTML = `<p class="text-muted">No registered donors available.</p>`;
                 } else {
-                    // edit innerHTML of donorList with donor cards and links to the user profile, along with a request button and other donor info
-                    donorList.innerHTML = data.donors.map(donor => `
+                    // append donor cards with links to the user profile, along with a request button and other donor info
+                    donorList.insertAdjacentHTML("beforeend", data.donors.map(donor => `
                         <div class="col-md-4">
                             <div class="card shadow-sm border-0">
                                 <div class="card-body">
@@ -805,12 +951,13 @@ function setupDonorList() {
                                 </div>
                             </div>
                         </div>
-                    `).join("");
+                    `).join(""));
                 }
 
-                // attach event listeners to "Request Donation" buttons, that calls the previous createDonationRequest() function to send a request
-                // to the donorId
-                document.querySelectorAll(".request-btn").forEach(button => {
+                // attach event listeners to the new "Request Donation" buttons, that calls the previous createDonationRequest() function to
+                // send a request to the donorId
+                donorList.querySelectorAll(".request-btn:not([data-bound])").forEach(button => {
+                    button.dataset.bound = "true";
                     button.addEventListener("click", function () {
                         const donorId = this.getAttribute("data-donor-id");
                         console.log("Sending request to donor ID:", donorId);
@@ -821,6 +968,9 @@ function setupDonorList() {
             .catch(error => {
                 console.error("Error fetching donors:", error);
                 donorList.innerHTML = `<p class="text-danger">Error loading donors. Try again later.</p>`;
+            })
+            .finally(() => {
+                loading = false;
             });
     }
 }
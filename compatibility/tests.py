@@ -1,5 +1,54 @@
-from django.test import TestCase, Client
-from .models import User, Donor, DonationRequest
+import asyncio
+import csv
+import importlib
+import io
+import json
+import math
+import random
+import threading
+import time
+
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.apps import apps
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.mail import get_connection
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from . import async_views
+from .models import User, Donor, DonationRequest, BloodMatchHistory, Location, GeocodeCacheEntry, GeocodeJob, Notification, NotificationFanout
+from .utils import (
+    COMPATIBILITY_CHART, BLOOD_TYPE_ORDER, CAN_DONATE_TO, CAN_RECEIVE_FROM, is_compatible, are_compatible,
+    compatible_donor_types, compatible_recipient_types, validate_compatibility_index,
+)
+from .benchmarks import python_region_counts
+from .checks import check_compatibility_index, check_site_stats
+from .events import InProcessBroker, deliver, get_broker
+from .exports import EXPORT_CHUNK_SIZE
+from .fanout import claim_fanouts, run_fanouts
+from .geocoding import GeocodingError, RateLimiter, address_fields, geocode, memory_cache
+from .geocode_jobs import GEOCODE_MAX_ATTEMPTS, GEOCODE_RETRY_DELAY, claim_jobs, enqueue_geocode, run_jobs
+from .locations import country_code, normalize_name
+from .site_stats import get_site_stats, reconcile
+from .serializers import DonationRequestSerializer, DonorSerializer
+from .region_cache import HITS_KEY, MISSES_KEY, REGION_TABLES, cache_key, cache_stats, get_region_counts, set_region_counts
+from .spatial import (
+    MAX_CLUSTER_CELLS, DonorGrid, approx_distance_bound, bounding_box, cluster_cell_degrees, brute_force_nearest, get_donor_grid, haversine_km, invalidate_donor_grid,
+    update_donor_grid,
+)
+from .versions import DONOR, bump_version, get_versions
+from .views import MATCH_DONORS_PAGE_SIZE, NEARBY_CANDIDATE_FACTOR, encode_cursor
 
 
 # unittest class that will define a few function that fit in the class, each of which is something we would like to test
@@ -182,3 +231,2260 @@ class DonorTestCase(TestCase):
         response = c.get("/user/999/profile/")
         self.assertEqual(response.status_code, 404)
 
+
+
+    # find_potential_donors uses the recipient -> donors side of the compatibility index
+    def test_find_potential_donors(self):
+
+        requester = User.objects.get(username="testuser")
+        recipient = User.objects.get(username="testuser2")
+        donation_request = DonationRequest.objects.create(requester=requester, recipient=recipient, blood_type_needed="B+", location="Tokyo")
+
+        potential = set(donation_request.find_potential_donors().values_list("blood_type", flat=True))
+        self.assertEqual(potential, {"B+", "B-", "O+", "O-"})
+
+
+# tests for the bitmask compatibility engine in utils.py, no database needed so SimpleTestCase is enough here
+class CompatibilityEngineTestCase(SimpleTestCase):
+
+    # every one of the 64 pairs has to give the same answer as the original list based chart
+    def test_bitmask_matches_chart(self):
+
+        for donor in BLOOD_TYPE_ORDER:
+            for recipient in BLOOD_TYPE_ORDER:
+                self.assertEqual(is_compatible(donor, recipient), recipient in COMPATIBILITY_CHART[donor], (donor, recipient))
+
+
+    # unknown or empty blood types are never compatible
+    def test_unknown_blood_types(self):
+
+        self.assertFalse(is_compatible("X", "A+"))
+        self.assertFalse(is_compatible("O-", ""))
+        self.assertFalse(is_compatible(None, None))
+
+
+    # the batch api returns one boolean per pair, in order
+    def test_batch_matches_scalar(self):
+
+        donors = ["O-", "A+", "AB+", "B-", "X"]
+        recipients = ["AB+", "O+", "AB+", "B+", "A+"]
+
+        self.assertEqual(are_compatible(donors, recipients), [is_compatible(d, r) for d, r in zip(donors, recipients)])
+        self.assertEqual(are_compatible(donors, recipients), [True, False, True, True, False])
+
+        with self.assertRaises(ValueError):
+            are_compatible(["O-"], [])
+
+
+    # the recipient -> donors side has to be the exact mirror of the donor -> recipients side
+    def test_index_directions_agree(self):
+
+        for donor in BLOOD_TYPE_ORDER:
+            for recipient in BLOOD_TYPE_ORDER:
+                self.assertEqual(recipient in CAN_DONATE_TO[donor], donor in CAN_RECEIVE_FROM[recipient])
+                self.assertEqual(donor in compatible_donor_types(recipient), recipient in compatible_recipient_types(donor))
+
+        # universal donor and universal recipient
+        self.assertEqual(set(compatible_recipient_types("O-")), set(BLOOD_TYPE_ORDER))
+        self.assertEqual(set(compatible_donor_types("AB+")), set(BLOOD_TYPE_ORDER))
+        self.assertEqual(compatible_donor_types("X"), ())
+
+
+    # the startup check reports no problems for the shipped chart
+    def test_index_validates(self):
+
+        self.assertEqual(validate_compatibility_index(), [])
+        self.assertEqual(check_compatibility_index(None), [])
+
+
+# match_donors has to run a constant number of queries, no matter how many donors or accepted requests there are
+class MatchDonorsTestCase(TestCase):
+
+    def setUp(self):
+
+        # users are created without a password here, hashing passwords is slow and these tests create a lot of donors
+        self.user = User.objects.create(username="recipient", email="recipient@example.com")
+        Donor.objects.create(user=self.user, blood_type="A+", city="Paris", country="France")
+        self.client.force_login(self.user)
+
+    def add_donors(self, count, blood_type="O-", start=0):
+        donors = []
+        for i in range(start, start + count):
+            donor_user = User.objects.create(username=f"donor{blood_type}{i}", email=f"donor{i}@example.com")
+            donors.append(Donor.objects.create(user=donor_user, blood_type=blood_type, city="Paris", country="France"))
+        return donors
+
+    def accept(self, donor):
+        donation_request = DonationRequest.objects.create(requester=donor.user, recipient=self.user, blood_type_needed="A+", location="Paris")
+        donation_request.donors.add(donor)
+        donation_request.accept_request(donor)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/match_donors/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+
+    # only compatible donors come back, and never the user themselves
+    def test_only_compatible_donors(self):
+
+        self.add_donors(2, "O-")
+        self.add_donors(2, "B+")
+
+        matches = self.client.get("/api/match_donors/").json()["matches"]
+        self.assertEqual(len(matches), 2)
+        self.assertTrue(all(match["blood_type"] == "O-" for match in matches))
+        self.assertNotIn(self.user.id, [match["id"] for match in matches])
+
+
+    # accepted donors come first and show their location
+    def test_accepted_matches(self):
+
+        donor = self.add_donors(1, "A-")[0]
+        self.accept(donor)
+
+        matches = self.client.get("/api/match_donors/").json()["matches"]
+        self.assertEqual(matches[0]["id"], donor.user.id)
+        self.assertTrue(matches[0]["is_accepted"])
+        self.assertEqual(matches[0]["location"], "Paris, France")
+        self.assertFalse(matches[1]["is_accepted"])
+
+
+    # the query count stays the same when the number of donors and accepted requests grows
+    def test_constant_queries(self):
+
+        self.accept(self.add_donors(1, "A-")[0])
+        self.add_donors(2)
+        small = self.count_queries()
+
+        for donor in self.add_donors(5, "A-", start=10):
+            self.accept(donor)
+        self.add_donors(20, start=100)
+        self.assertEqual(self.count_queries(), small)
+
+
+    # potential matches are paginated and the limit is capped
+    def test_pagination(self):
+
+        self.add_donors(5)
+
+        first = self.client.get("/api/match_donors/?limit=3").json()
+        self.assertEqual(len(first["matches"]), 3)
+        self.assertEqual(first["next_offset"], 3)
+
+        second = self.client.get(f"/api/match_donors/?limit=3&offset={first['next_offset']}").json()
+        self.assertEqual(len(second["matches"]), 2)
+        self.assertIsNone(second["next_offset"])
+
+        self.add_donors(MATCH_DONORS_PAGE_SIZE, start=100)
+        capped = self.client.get("/api/match_donors/?limit=100000").json()
+        self.assertEqual(len(capped["matches"]), MATCH_DONORS_PAGE_SIZE)
+
+        self.assertEqual(self.client.get("/api/match_donors/?offset=abc").status_code, 400)
+
+
+    # ?sort=distance ranks compatible, available donors with coordinates nearest first
+    def test_sort_by_distance(self):
+
+        Donor.objects.filter(user=self.user).update(latitude=48.8566, longitude=2.3522)  # paris
+        far, near, middle = self.add_donors(3)
+        Donor.objects.filter(id=far.id).update(latitude=40.4168, longitude=-3.7038)  # madrid
+        Donor.objects.filter(id=near.id).update(latitude=49.2583, longitude=4.0317)  # reims
+        Donor.objects.filter(id=middle.id).update(latitude=50.8503, longitude=4.3517)  # brussels
+        Donor.objects.create(user=User.objects.create(username="incompatible"), blood_type="B+", latitude=48.86, longitude=2.35)
+        invalidate_donor_grid()
+
+        matches = self.client.get("/api/match_donors/?sort=distance").json()["matches"]
+        self.assertEqual([match["id"] for match in matches], [near.user.id, middle.user.id, far.user.id])
+        self.assertEqual(matches[0]["distance_km"], 130)
+
+        # an explicit point overrides the users own coordinates
+        matches = self.client.get("/api/match_donors/?sort=distance&lat=40.4&lng=-3.7&limit=1").json()
+        self.assertEqual(matches["matches"][0]["id"], far.user.id)
+        self.assertEqual(matches["next_offset"], 1)
+
+
+
+    # donor changes are applied to the grid one donor at a time once they commit, the grid is never rebuilt for them
+    def test_grid_follows_donor_changes(self):
+
+        invalidate_donor_grid()
+        grid = get_donor_grid()
+
+        def ids():
+            return {row[0] for _, row in get_donor_grid().nearest(48.85, 2.35, 10)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donor = Donor.objects.create(user=User.objects.create(username="new"), blood_type="O-", latitude=48.86, longitude=2.35)
+        self.assertEqual(ids(), {donor.id})
+
+        # moved to madrid, into another cell
+        with self.captureOnCommitCallbacks(execute=True):
+            donor.latitude, donor.longitude = 40.4168, -3.7038
+            donor.save()
+        self.assertEqual(len(get_donor_grid().nearest(48.85, 2.35, 10, max_km=100)), 0)
+        self.assertEqual(ids(), {donor.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donor.user.is_active = False
+            donor.user.save()
+        self.assertEqual(ids(), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donor.user.is_active = True
+            donor.user.save()
+        self.assertEqual(ids(), {donor.id})
+
+        # a rolled back change never reaches the grid
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            donor.availability = False
+            donor.save()
+            raise IntegrityError
+        self.assertEqual(ids(), {donor.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donor.delete()
+        self.assertEqual(ids(), set())
+        self.assertIs(get_donor_grid(), grid)
+
+
+    # a change made by another process bumps a version this process never applied, the next query rebuilds the grid
+    def test_grid_follows_other_processes(self):
+
+        invalidate_donor_grid()
+        grid = get_donor_grid()
+
+        donor = Donor.objects.create(user=User.objects.create(username="new"), blood_type="O-", latitude=48.86, longitude=2.35)
+        Donor.objects.filter(pk=donor.pk).update(latitude=40.4168, longitude=-3.7038)
+
+        # the signals ran here but their on commit updates didnt (the test transaction never commits), like in a worker process
+        rebuilt = get_donor_grid()
+        self.assertIsNot(rebuilt, grid)
+        self.assertEqual([row[0] for _, row in rebuilt.nearest(40.4, -3.7, 1, max_km=10)], [donor.id])
+        self.assertIs(get_donor_grid(), rebuilt)
+
+        # a version whose update never ran (it failed) rebuilds the grid too
+        first, second = bump_version(DONOR), bump_version(DONOR)
+        update_donor_grid([], second)
+        self.assertIsNot(get_donor_grid(), rebuilt)
+        rebuilt = get_donor_grid()
+
+        # the updates of this process can commit out of order, the grid catches up once every version up to the current one is applied
+        first, second = bump_version(DONOR), bump_version(DONOR)
+        update_donor_grid([], second)
+        update_donor_grid([], first)
+        self.assertIs(get_donor_grid(), rebuilt)
+
+
+# the grid index has to return exactly what a full haversine scan would
+class SpatialIndexTestCase(SimpleTestCase):
+
+    def test_grid_matches_brute_force(self):
+
+        rng = random.Random(1)
+        rows = [(i, i, rng.choice(BLOOD_TYPE_ORDER), rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(2000)]
+        grid = DonorGrid(rows, cell_degrees=2)
+
+        # the same grid after moving and removing donors one at a time
+        moved = DonorGrid(rows, cell_degrees=2)
+        for row in rows[:200]:
+            moved.put((row[0], row[1], row[2], -row[3], row[4]))
+        for row in rows[200:300]:
+            moved.discard(row[0])
+        moved_rows = [(row[0], row[1], row[2], -row[3], row[4]) for row in rows[:200]] + rows[300:]
+        self.assertEqual(len(moved), len(moved_rows))
+
+        # random points plus the awkward ones, poles and both sides of the antimeridian
+        points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(50)] + [(89.9, 0), (-89.9, 10), (0, 180), (10, -180), (0, 179.99)]
+
+        for lat, lng in points:
+            for blood_types, max_km in ((None, None), (CAN_RECEIVE_FROM["A-"], None), (None, 2000)):
+                expected = [round(d, 6) for d, _ in brute_force_nearest(rows, lat, lng, 7, blood_types, max_km)]
+                actual = [round(d, 6) for d, _ in grid.nearest(lat, lng, 7, blood_types, max_km)]
+                self.assertEqual(actual, expected, (lat, lng, max_km))
+
+                expected = [round(d, 6) for d, _ in brute_force_nearest(moved_rows, lat, lng, 7, blood_types, max_km)]
+                actual = [round(d, 6) for d, _ in moved.nearest(lat, lng, 7, blood_types, max_km)]
+                self.assertEqual(actual, expected, (lat, lng, max_km))
+
+
+    def test_haversine(self):
+
+        # london to paris is about 344km
+        self.assertAlmostEqual(haversine_km(51.5074, -0.1278, 48.8566, 2.3522), 343.5, delta=1)
+        self.assertEqual(haversine_km(10, 10, 10, 10), 0)
+
+
+    # every point inside the radius has to be inside the bounding box, including boxes that wrap the antimeridian or reach a pole
+    def test_bounding_box_contains_circle(self):
+
+        rng = random.Random(2)
+        for lat, lng in [(48.85, 2.35), (-17.7, 179.9), (64.1, -179.95), (89.5, 0), (0, 0)]:
+            radius_km = 100
+            min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+
+            for _ in range(500):
+                point_lat, point_lng = lat + rng.uniform(-3, 3), (lng + rng.uniform(-60, 60) + 180) % 360 - 180
+                if abs(point_lat) > 90 or haversine_km(lat, lng, point_lat, point_lng) > radius_km:
+                    continue
+
+                self.assertTrue(min_lat <= point_lat <= max_lat)
+                if min_lng is None:
+                    continue
+                if min_lng <= max_lng:
+                    self.assertTrue(min_lng <= point_lng <= max_lng)
+                else:
+                    self.assertTrue(point_lng >= min_lng or point_lng <= max_lng)
+
+
+# radius search, /api/donors/nearby/
+class NearbyDonorsTestCase(TestCase):
+
+    def setUp(self):
+
+        # (username, blood type, lat, lng), searched from the centre of paris
+        for username, blood_type, lat, lng in [
+            ("paris_o_neg", "O-", 48.8606, 2.3376),  # under 2km
+            ("versailles_o_neg", "O-", 48.8049, 2.1204),  # about 18km
+            ("versailles_a_pos", "A+", 48.8049, 2.1204),
+            ("reims_o_neg", "O-", 49.2583, 4.0317),  # about 130km
+            ("fiji_o_neg", "O-", -17.7134, 178.0650),
+        ]:
+            Donor.objects.create(user=User.objects.create(username=username), blood_type=blood_type, latitude=lat, longitude=lng)
+
+        Donor.objects.create(user=User.objects.create(username="unavailable"), blood_type="O-", latitude=48.86, longitude=2.34, availability=False)
+
+    def search(self, **params):
+        response = self.client.get("/api/donors/nearby/", {"lat": 48.8566, "lng": 2.3522, **params})
+        return response.status_code, response.json()
+
+    def usernames(self, data):
+        return [donor["user"]["username"] for donor in data["donors"]]
+
+
+    # only available donors within the radius, nearest first
+    def test_radius(self):
+
+        status, data = self.search(radius_km=25, blood_type="O-", match="exact")
+        self.assertEqual(status, 200)
+        self.assertEqual(self.usernames(data), ["paris_o_neg", "versailles_o_neg"])
+        self.assertEqual(data["donors"][1]["distance_km"], 18)
+        self.assertFalse(data["truncated"])
+
+
+    # compatible matching uses the compatibility index, exact matching only the one blood type
+    def test_compatible_and_exact(self):
+
+        self.assertEqual(self.usernames(self.search(blood_type="A+")[1]), ["paris_o_neg", "versailles_o_neg", "versailles_a_pos"])
+        self.assertEqual(self.usernames(self.search(blood_type="A+", match="exact")[1]), ["versailles_a_pos"])
+        self.assertEqual(self.usernames(self.search(blood_type="O-")[1]), ["paris_o_neg", "versailles_o_neg"])
+
+
+    # the result is capped by limit and flagged as truncated
+    def test_limit(self):
+
+        status, data = self.search(radius_km=200, limit=2)
+        self.assertEqual(self.usernames(data), ["paris_o_neg", "versailles_o_neg"])
+        self.assertTrue(data["truncated"])
+
+
+    # a dense city only sends limit * NEARBY_CANDIDATE_FACTOR candidates to python, still the exact nearest ones
+    def test_candidates_are_capped(self):
+
+        rng = random.Random(3)
+        for i in range(200):
+            Donor.objects.create(
+                user=User.objects.create(username=f"dense{i}"), blood_type="AB+",
+                latitude=48.8566 + rng.uniform(-0.1, 0.1), longitude=2.3522 + rng.uniform(-0.1, 0.1),
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            status, data = self.search(blood_type="AB+", match="exact", limit=5)
+        self.assertIn(f"LIMIT {5 * NEARBY_CANDIDATE_FACTOR}", queries[0]["sql"])
+
+        donors = Donor.objects.filter(blood_type="AB+")
+        expected = sorted(donors, key=lambda donor: haversine_km(48.8566, 2.3522, donor.latitude, donor.longitude))[:5]
+        self.assertEqual(self.usernames(data), [donor.user.username for donor in expected])
+        self.assertTrue(data["truncated"])
+
+
+    # the bounding box wraps around the antimeridian, and the nearest donor is found across it
+    def test_antimeridian(self):
+
+        response = self.client.get("/api/donors/nearby/", {"lat": -17.7, "lng": -179.9, "radius_km": 300})
+        self.assertEqual(self.usernames(response.json()), ["fiji_o_neg"])
+
+        Donor.objects.create(user=User.objects.create(username="tonga_o_neg"), blood_type="O-", latitude=-17.7, longitude=-177.8)
+        response = self.client.get("/api/donors/nearby/", {"lat": -17.7, "lng": 179.9, "radius_km": 300})
+        self.assertEqual(self.usernames(response.json()), ["fiji_o_neg", "tonga_o_neg"])
+        response = self.client.get("/api/donors/nearby/", {"lat": -17.7, "lng": 179.9, "radius_km": 300, "limit": 1})
+        self.assertEqual(self.usernames(response.json()), ["fiji_o_neg"])
+        self.assertTrue(response.json()["truncated"])
+
+
+    # near the pole a degree of longitude is short, the donor across the pole is the nearest but the approximation puts it after every one of
+    # the limit * NEARBY_CANDIDATE_FACTOR donors due south, the error bound widens the window to reach it
+    def test_near_the_pole(self):
+
+        for i in range(4):
+            Donor.objects.create(user=User.objects.create(username=f"south{i}"), blood_type="B+", latitude=88.5, longitude=i * 0.5)  # 111km
+        Donor.objects.create(user=User.objects.create(username="across"), blood_type="B+", latitude=89.9, longitude=180)  # 67km, over the pole
+
+        response = self.client.get("/api/donors/nearby/", {"lat": 89.5, "lng": 0, "radius_km": 200, "blood_type": "B+", "match": "exact", "limit": 1})
+        self.assertEqual(self.usernames(response.json()), ["across"])
+        self.assertEqual(response.json()["donors"][0]["distance_km"], 67)
+        self.assertTrue(response.json()["truncated"])
+
+        response = self.client.get("/api/donors/nearby/", {"lat": 89.5, "lng": 0, "radius_km": 200, "blood_type": "B+", "match": "exact"})
+        self.assertEqual(self.usernames(response.json()), ["across", "south0", "south1", "south2", "south3"])
+        self.assertFalse(response.json()["truncated"])
+
+
+    # no point within the distance is further by the approximation than the bound, at any latitude
+    def test_approx_distance_bound(self):
+
+        rng = random.Random(4)
+        for lat in (0, 48.85, -64.1, 80, 89.5, -89.99, 90):
+            for km in (1, 25, 111, 500):
+                bound = approx_distance_bound(lat, km)
+                for _ in range(500):
+                    point_lat = max(-90, min(90, lat + rng.uniform(-5, 5)))
+                    lng_delta = rng.uniform(-180, 180) if abs(lat) > 80 else rng.uniform(-10, 10)
+                    if haversine_km(lat, 0, point_lat, lng_delta) > km:
+                        continue
+                    approx = (point_lat - lat) ** 2 + (lng_delta * math.cos(math.radians(lat))) ** 2
+                    self.assertLessEqual(approx, bound, (lat, km, point_lat, lng_delta))
+
+
+    def test_invalid_parameters(self):
+
+        self.assertEqual(self.client.get("/api/donors/nearby/").status_code, 400)
+        self.assertEqual(self.search(radius_km=10_000)[0], 400)
+        self.assertEqual(self.search(lat=100)[0], 400)
+        self.assertEqual(self.search(blood_type="O-", match="fuzzy")[0], 400)
+
+
+# donor_locations_api counts in the database now, the response has to be exactly what the old one-row-per-donor Counter loop produced
+class DonorLocationsTestCase(TestCase):
+
+    def setUp(self):
+
+        # the region cache lives outside the test database, so start every test with an empty one
+        cache.clear()
+
+        rng = random.Random(5)
+        regions = [("Paris", None, "France"), ("Paris", "", "France"), ("Lyon", "Rhone", "France"), ("Mumbai", "Maharashtra", "India"), (None, None, None)]
+
+        for i in range(120):
+            city, state, country = rng.choice(regions)
+            Donor.objects.create(
+                user=User.objects.create(username=f"donor{i}", is_active=i % 17 != 0),
+                blood_type=rng.choice(BLOOD_TYPE_ORDER), city=city, state_or_county=state, country=country,
+                availability=i % 11 != 0,
+            )
+
+    def old_response(self, **filters):
+        donors = Donor.objects.filter(user__is_active=True, availability=True, **filters).order_by("id").values(
+            'city', 'state_or_county', 'country', 'blood_type'
+        )
+        return python_region_counts(donors)
+
+
+    def test_same_as_python_counter(self):
+
+        self.assertEqual(self.client.get("/api/donor-locations/").json(), self.old_response())
+
+
+    def test_same_as_python_counter_filtered(self):
+
+        self.assertEqual(self.client.get("/api/donor-locations/?blood_type=O-").json(), self.old_response(blood_type="O-"))
+        self.assertEqual(self.client.get("/api/donor-locations/?location=paris").json(), self.old_response(city__icontains="paris"))
+
+
+# the region aggregates are cached per filter and only the entries a donor change affects are thrown away
+class RegionCacheTestCase(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+        self.paris = Donor.objects.create(user=User.objects.create(username="paris"), blood_type="O-", city="Paris", country="France")
+        self.mumbai = Donor.objects.create(user=User.objects.create(username="mumbai"), blood_type="A+", city="Mumbai", country="India")
+
+    def get(self, **params):
+        return self.client.get("/api/donor-locations/", params).json()
+
+
+    def test_hits_and_misses(self):
+
+        self.get(location="paris")
+        self.get(location="Paris")  # location filtering is case insensitive, so is the cache
+        self.get(location="paris", blood_type="O-")
+
+        stats = cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+
+    # a donor edit moves every entry to new keys, they are counted again
+    def test_invalidation(self):
+
+        self.get(location="paris")
+        self.get(location="mumbai")
+
+        self.mumbai.blood_type = "B+"
+        self.mumbai.save()
+        cache.delete_many([HITS_KEY, MISSES_KEY])
+
+        self.assertEqual(self.get(location="mumbai"), [{"region": "Mumbai, India", "count": 1, "blood_types": "B+ 1"}])
+        self.get(location="paris")
+        self.get(location="paris")
+        self.assertEqual((cache_stats()["hits"], cache_stats()["misses"]), (1, 2))
+
+
+    # moving a donor invalidates both the region they left and the one they moved to
+    def test_moving_donor(self):
+
+        self.assertEqual(len(self.get(location="india")), 1)
+        self.assertEqual(self.get(location="france")[0]["count"], 1)
+
+        self.mumbai.city, self.mumbai.country = "Lyon", "France"
+        self.mumbai.save()
+
+        self.assertEqual(self.get(location="india"), [])
+        self.assertEqual(len(self.get(location="france")), 2)
+
+
+    # deactivating the user or deleting the donor removes them from the cached counts
+    def test_user_and_delete_signals(self):
+
+        self.assertEqual(len(self.get()), 2)
+
+        self.paris.user.is_active = False
+        self.paris.user.save()
+        self.assertEqual([region["region"] for region in self.get()], ["Mumbai, India"])
+
+        self.mumbai.delete()
+        self.assertEqual(self.get(), [])
+
+
+    # the keys come from the table versions in the database, so a change made by another process (a worker, which has its own local memory
+    # cache, or a queryset update that bumps the version itself) is seen here without this process hearing about it
+    def test_changes_from_other_processes(self):
+
+        self.assertEqual(len(self.get(location="france")), 1)
+
+        Donor.objects.filter(pk=self.paris.pk).update(availability=False)
+        self.assertEqual(len(self.get(location="france")), 1)
+
+        bump_version(DONOR)
+        self.assertEqual(self.get(location="france"), [])
+
+
+    # a miss that counted before an edit and stores after it stores under the old key, the stale counts are never served
+    def test_count_racing_an_edit(self):
+
+        request = RequestFactory().get("/api/donor-locations/")
+        key, data = get_region_counts(request, "", "france")
+        self.assertIsNone(data)
+        stale = self.client.get("/api/donor-locations/", {"location": "france"}).json()
+
+        self.mumbai.city, self.mumbai.country = "Lyon", "France"
+        self.mumbai.save()
+        set_region_counts(key, stale)
+
+        self.assertEqual(len(self.get(location="france")), 2)
+        self.assertNotEqual(cache_key("", "france", get_versions(RequestFactory().get("/"), REGION_TABLES)), key)
+
+
+    def test_stats_are_staff_only(self):
+
+        user = User.objects.create(username="staff")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/api/donor-locations/cache-stats/").status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get("/api/donor-locations/cache-stats/").json()["misses"], 0)
+
+
+# zoom aware clustering, /api/donor-clusters/
+class DonorClustersTestCase(TestCase):
+
+    def setUp(self):
+
+        for i, (blood_type, lat, lng) in enumerate([
+            ("O-", 48.8606, 2.3376), ("O-", 48.8049, 2.1204), ("A+", 48.8049, 2.1204),  # paris and versailles
+            ("B+", 51.5074, -0.1278),  # london
+            ("AB+", -17.7134, 178.0650),  # fiji
+        ]):
+            Donor.objects.create(user=User.objects.create(username=f"donor{i}"), blood_type=blood_type, latitude=lat, longitude=lng)
+
+        Donor.objects.create(user=User.objects.create(username="unavailable"), blood_type="O-", latitude=48.86, longitude=2.34, availability=False)
+
+    def clusters(self, **params):
+        response = self.client.get("/api/donor-clusters/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["clusters"]
+
+
+    # zoomed out over europe paris and versailles end up in one cluster, with counts per blood type
+    def test_zoomed_out(self):
+
+        clusters = self.clusters(south=35, west=-15, north=65, east=30, zoom=4)
+        self.assertEqual([cluster["count"] for cluster in clusters], [3, 1])
+        self.assertEqual(clusters[0]["blood_types"], {"O-": 2, "A+": 1})
+        self.assertEqual(clusters[1]["blood_types"], {"B+": 1})
+
+
+    # zoomed in on paris they split up, and london is off screen
+    def test_zoomed_in(self):
+
+        clusters = self.clusters(south=48.7, west=2.0, north=48.95, east=2.5, zoom=12)
+        self.assertEqual(sorted(cluster["count"] for cluster in clusters), [1, 2])
+
+        # clusters sit at the cell centre, never on the donors own coordinates
+        for cluster in clusters:
+            self.assertNotIn((cluster["lat"], cluster["lng"]), [(48.8606, 2.3376), (48.8049, 2.1204)])
+
+
+    def test_blood_type_and_antimeridian(self):
+
+        self.assertEqual(self.clusters(south=35, west=-15, north=65, east=30, zoom=4, blood_type="O-")[0]["blood_types"], {"O-": 2})
+        self.assertEqual(self.clusters(south=-30, west=170, north=0, east=-170, zoom=5)[0]["blood_types"], {"AB+": 1})
+
+
+    # a whole world viewport at high zoom gets coarser cells instead of an unbounded number of them
+    def test_cells_are_bounded(self):
+
+        cell = cluster_cell_degrees(18, -90, -180, 90, 180)
+        self.assertLessEqual((180 / cell + 2) * (360 / cell + 2), MAX_CLUSTER_CELLS)
+        self.assertEqual(cluster_cell_degrees(4, 48, 2, 49, 3), 90 / 2 ** 4)
+
+
+    def test_invalid_parameters(self):
+
+        self.assertEqual(self.client.get("/api/donor-clusters/?south=1").status_code, 400)
+        self.assertEqual(self.client.get("/api/donor-clusters/?south=50&west=0&north=40&east=10").status_code, 400)
+
+
+# donor_list_api pages with a keyset cursor on the donor id
+class DonorListPaginationTestCase(TestCase):
+
+    def setUp(self):
+
+        for i in range(40):
+            Donor.objects.create(
+                user=User.objects.create(username=f"donor{i}"), blood_type="O-" if i % 2 else "A+", country="France" if i < 30 else "Spain",
+                availability=i != 5,
+            )
+
+    def get(self, **params):
+        response = self.client.get("/api/donors/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+    # walking every page returns every available donor exactly once, in id order
+    def test_walk_all_pages(self):
+
+        seen, cursor = [], None
+        while True:
+            data = self.get(page_size=7, **({"cursor": cursor} if cursor else {}))
+            seen.extend(donor["id"] for donor in data["donors"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(seen, list(Donor.objects.filter(availability=True).order_by("id").values_list("id", flat=True)))
+
+
+    # filters apply to every page, and a page that ends exactly on the last donor has no next cursor
+    def test_filters_and_last_page(self):
+
+        first = self.get(country="spain", page_size=5)
+        self.assertEqual(len(first["donors"]), 5)
+        second = self.get(country="spain", page_size=5, cursor=first["next_cursor"])
+        self.assertEqual(len(second["donors"]), 5)
+        self.assertIsNone(second["next_cursor"])
+
+        self.assertTrue(all(donor["blood_type"] == "O-" for donor in self.get(blood_type="O-", page_size=100)["donors"]))
+
+
+    # start/end from older clients set the page size, and the page size is always capped
+    def test_page_size(self):
+
+        self.assertEqual(len(self.get(start=1, end=15)["donors"]), 15)
+        self.assertEqual(len(self.get()["donors"]), settings.DONOR_LIST_PAGE_SIZE)
+
+        with self.settings(DONOR_LIST_MAX_PAGE_SIZE=10):
+            self.assertEqual(len(self.get(page_size=1000)["donors"]), 10)
+
+
+    # a deep page is the same single query as the first one (plus the table versions lookup for the ETag)
+    def test_deep_page_query(self):
+
+        last_cursor = encode_cursor(Donor.objects.order_by("-id").values_list("id", flat=True)[3])
+        with CaptureQueriesContext(connection) as queries:
+            self.get(cursor=last_cursor)
+        self.assertEqual(len(queries), 2)
+        self.assertIn("compatibility_tableversion", queries[0]["sql"])
+        self.assertNotIn("OFFSET", queries[1]["sql"].upper())
+
+
+    def test_invalid_cursor(self):
+
+        self.assertEqual(self.client.get("/api/donors/?cursor=!!").status_code, 400)
+        self.assertEqual(self.client.get("/api/donors/?page_size=ten").status_code, 400)
+
+
+# the fast serialization path has to produce exactly the same bytes as DRF
+class FastSerializationTestCase(TestCase):
+
+    def setUp(self):
+
+        # unicode, the line separators DRF escapes, and empty/None fields
+        paris = Donor.objects.create(user=User.objects.create(username="zoë", email="zoe@example.com"), blood_type="O-", city="Paris", country="France")
+        odd = Donor.objects.create(user=User.objects.create(username="line\u2028sep"), blood_type="AB+", location="Köln\u2029", city=None)
+        Donor.objects.create(user=User.objects.create(username="nothing"))
+
+        accepted = DonationRequest.objects.create(requester=paris.user, recipient=odd.user, blood_type_needed="O-", location="Paris, Île-de-France, France")
+        accepted.accepted_donors.add(paris, odd)
+        DonationRequest.objects.create(requester=odd.user, recipient=paris.user, blood_type_needed="AB+", location="Köln")
+
+    def both_paths(self, url):
+        with self.settings(FAST_JSON_SERIALIZATION=False):
+            slow = self.client.get(url)
+        with self.settings(FAST_JSON_SERIALIZATION=True):
+            fast = self.client.get(url)
+
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(slow["Content-Type"], fast["Content-Type"])
+        return slow.content, fast.content
+
+
+    def test_donor_list_identical(self):
+
+        slow, fast = self.both_paths("/api/donors/?page_size=2")
+        self.assertEqual(fast, slow)
+        self.assertIn("zoë".encode(), fast)
+        self.assertIn(b"\\u2028", fast)
+
+
+    def test_active_requests_identical(self):
+
+        slow, fast = self.both_paths("/api/active-requests/")
+        self.assertEqual(fast, slow)
+        self.assertIn(b"zoe@example.com", fast)
+
+
+    # the browsable api is never served from the fast path
+    def test_browsable_api_unchanged(self):
+
+        with self.settings(FAST_JSON_SERIALIZATION=True):
+            response = self.client.get("/api/donors/", HTTP_ACCEPT="text/html")
+        self.assertIn("text/html", response["Content-Type"])
+
+
+# ETag / Last-Modified on the polled json endpoints, backed by the per table change versions in versions.py
+class ConditionalGetTestCase(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+        self.donor = Donor.objects.create(user=User.objects.create(username="donor", email="donor@example.com"), blood_type="O-", city="Paris", country="France")
+        self.recipient = User.objects.create(username="recipient")
+        self.donation_request = DonationRequest.objects.create(requester=self.recipient, recipient=self.recipient, blood_type_needed="O-", location="Paris")
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+        return response["ETag"]
+
+
+    # an unchanged dataset answers 304 after only looking at the version table
+    def test_not_modified(self):
+
+        for url in ("/api/donors/", "/api/active-requests/", "/api/donor-locations/"):
+            etag = self.etag(url)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(len(queries), 1, url)
+            self.assertIn("compatibility_tableversion", queries[0]["sql"])
+
+
+    def test_changes_give_a_new_etag(self):
+
+        donors = self.etag("/api/donors/")
+        requests = self.etag("/api/active-requests/")
+
+        self.donor.city = "Lyon"
+        self.donor.save()
+        self.assertNotEqual(self.etag("/api/donors/"), donors)
+        self.assertNotEqual(self.etag("/api/active-requests/"), requests)
+
+        # accepting a request only writes to the m2m table, the donor list doesnt show requests so it stays the same
+        donors = self.etag("/api/donors/")
+        requests = self.etag("/api/active-requests/")
+        self.donation_request.accepted_donors.add(self.donor)
+        self.assertEqual(self.etag("/api/donors/"), donors)
+        self.assertNotEqual(self.etag("/api/active-requests/"), requests)
+
+        # user names/emails are in both
+        self.recipient.email = "new@example.com"
+        self.recipient.save()
+        self.assertNotEqual(self.etag("/api/active-requests/"), requests)
+
+
+    # logging in only saves last_login, that shouldnt make every client download the list again
+    def test_last_login_keeps_etag(self):
+
+        etag = self.etag("/api/donors/")
+        self.recipient.save(update_fields=["last_login"])
+        self.assertEqual(self.client.get("/api/donors/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+    def test_etag_depends_on_accept(self):
+
+        self.assertNotEqual(
+            self.client.get("/api/donors/", HTTP_ACCEPT="application/json")["ETag"],
+            self.client.get("/api/donors/", HTTP_ACCEPT="text/html")["ETag"],
+        )
+
+
+
+# streaming exports (exports.py), same fields as the api serializers
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+
+        self.paris = Donor.objects.create(user=User.objects.create(username="paris", email="paris@example.com"), blood_type="O-", city="Paris", country="France")
+        self.berlin = Donor.objects.create(user=User.objects.create(username="berlin"), blood_type="A+", city="Berlin", country="Germany", availability=False)
+
+        accepted = DonationRequest.objects.create(requester=self.paris.user, recipient=self.berlin.user, blood_type_needed="A+", location="Berlin, Berlin, Germany")
+        accepted.accepted_donors.add(self.paris)
+        DonationRequest.objects.create(requester=self.berlin.user, recipient=self.paris.user, blood_type_needed="O-", location="Paris, IDF, France", status="Cancelled")
+
+        BloodMatchHistory.objects.create(donor=self.paris, recipient=self.berlin.user, donor_blood="O-", recipient_blood="A+", is_compatible=True, donation_request=accepted)
+
+        self.client.force_login(User.objects.create(username="staff", is_staff=True))
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+
+    def test_ndjson_matches_serializers(self):
+
+        donors = [json.loads(line) for line in self.export("/api/export/donors/").splitlines()]
+        self.assertEqual(donors, json.loads(json.dumps(DonorSerializer(Donor.objects.order_by("id"), many=True).data)))
+
+        requests = [json.loads(line) for line in self.export("/api/export/donation_requests/").splitlines()]
+        self.assertEqual(requests, json.loads(json.dumps(DonationRequestSerializer(DonationRequest.objects.order_by("id"), many=True).data)))
+
+        history = [json.loads(line) for line in self.export("/api/export/match_history/").splitlines()]
+        self.assertEqual(history[0]["donor"], {"id": self.paris.id, "username": "paris", "email": "paris@example.com"})
+        self.assertTrue(history[0]["is_compatible"])
+
+
+    def test_csv(self):
+
+        rows = list(csv.DictReader(io.StringIO(self.export("/api/export/donation_requests/?format=csv"))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(json.loads(rows[0]["donor_contact_info"]), [{"email": "paris@example.com", "location": "Paris, France"}])
+
+        rows = list(csv.DictReader(io.StringIO(self.export("/api/export/donors/?format=csv&country=france"))))
+        self.assertEqual([(row["user_username"], row["user_email"], row["blood_type"]) for row in rows], [("paris", "paris@example.com", "O-")])
+
+        # an empty export still has its header
+        self.assertTrue(self.export("/api/export/match_history/?format=csv&blood_type=AB-").startswith("id,donor_id,"))
+
+
+    def test_filters(self):
+
+        self.assertEqual(len(self.export("/api/export/donation_requests/?status=Cancelled").splitlines()), 1)
+        self.assertEqual(len(self.export("/api/export/donors/?blood_type=A%2B").splitlines()), 1)
+
+        for url in (
+            "/api/export/donors/?status=Pending", "/api/export/donation_requests/?status=Nope", "/api/export/donors/?blood_type=C+",
+            "/api/export/donors/?format=xml", "/api/export/everything/",
+        ):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+
+    def test_staff_only(self):
+
+        self.client.force_login(self.paris.user)
+        self.assertEqual(self.client.get("/api/export/donors/").status_code, 403)
+
+
+    # more rows than one chunk, the donation requests contact info is looked up once per chunk
+    def test_chunks(self):
+
+        Donor.objects.bulk_create([
+            Donor(user=user, blood_type="B+") for user in User.objects.bulk_create([User(username=f"bulk{i}") for i in range(EXPORT_CHUNK_SIZE + 10)])
+        ])
+        self.assertEqual(len(self.export("/api/export/donors/").splitlines()), EXPORT_CHUNK_SIZE + 12)
+
+
+    def test_command(self):
+
+        out = io.StringIO()
+        call_command("export", "donors", "--format", "csv", "--blood-type", "O-", stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[1].split(",")[:3], [str(self.paris.id), "O-", "True"])
+
+
+
+# the normalised Location table behind the location filters (locations.py)
+class LocationTestCase(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+        self.paris = Donor.objects.create(user=User.objects.create(username="paris"), blood_type="O-", city="Paris", state_or_county="IDF", country="France")
+        self.other_paris = Donor.objects.create(user=User.objects.create(username="paris2"), blood_type="A+", city="  paris ", state_or_county="idf", country="FR")
+        self.texas = Donor.objects.create(user=User.objects.create(username="texas"), blood_type="B+", city="Paris", state_or_county="Texas", country="United States")
+
+
+    def test_normalisation(self):
+
+        self.assertEqual(normalize_name("  New   York "), "new york")
+        self.assertEqual([country_code(name) for name in ("France", "fr", "FRA", "united states", "Deutschland", None)], ["FR", "FR", "FR", "US", "", ""])
+
+        # the same place typed differently is one Location
+        self.assertEqual(self.paris.place_id, self.other_paris.place_id)
+        self.assertNotEqual(self.paris.place_id, self.texas.place_id)
+        self.assertEqual(str(self.paris.place), "Paris, IDF, France")
+
+
+    def test_donation_request_only_splits_changed_location(self):
+
+        donation_request = DonationRequest.objects.create(requester=self.paris.user, recipient=self.texas.user, blood_type_needed="O-", location="Paris, Texas, United States")
+        self.assertEqual(donation_request.place_id, self.texas.place_id)
+
+        donation_request = DonationRequest.objects.get(pk=donation_request.pk)
+        donation_request.city = "Dallas"
+        donation_request.save()
+        self.assertEqual(DonationRequest.objects.get(pk=donation_request.pk).city, "Dallas")
+
+        donation_request.location = "Paris, IDF, France"
+        donation_request.save()
+        self.assertEqual((donation_request.city, donation_request.place_id), ("Paris", self.paris.place_id))
+
+
+    # country filters take a name or code and are equality lookups on the Location
+    def test_filters(self):
+
+        for country in ("France", "fr", " FRANCE "):
+            donors = self.client.get("/api/donors/", {"country": country}).json()["donors"]
+            self.assertEqual([donor["id"] for donor in donors], [self.paris.id, self.other_paris.id], country)
+        self.assertEqual(self.client.get("/api/donors/", {"country": "Atlantis"}).json()["donors"], [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/donors/", {"country": "France"})
+            self.client.get("/api/donor-locations/", {"location": "paris"})
+        self.assertFalse([query["sql"] for query in queries if "LIKE" in query["sql"].upper()])
+
+        regions = self.client.get("/api/donor-locations/", {"location": "texas"}).json()
+        self.assertEqual([region["region"] for region in regions], ["Paris, Texas, United States"])
+        self.assertEqual(len(self.client.get("/api/donor-locations/", {"location": "paris"}).json()), 3)
+
+
+    # a country django_countries doesnt have is matched by its typed name, with the same indexed lookup
+    def test_unknown_country(self):
+
+        self.assertEqual(self.client.get("/api/donor-locations/", {"location": "Atlantis"}).json(), [])
+        atlantis = Donor.objects.create(user=User.objects.create(username="atlantis"), blood_type="O-", city="Poseidonia", country="Atlantis")
+        lemuria = Donor.objects.create(user=User.objects.create(username="lemuria"), blood_type="O-", city="Poseidonia", country="Lemuria")
+        self.assertNotEqual(atlantis.place_id, lemuria.place_id)
+        self.assertEqual(str(atlantis.place), "Poseidonia, atlantis")
+
+        for country in ("Atlantis", " atlantis "):
+            donors = self.client.get("/api/donors/", {"country": country}).json()["donors"]
+            self.assertEqual([donor["id"] for donor in donors], [atlantis.id], country)
+        self.assertEqual(self.client.get("/api/donors/", {"country": "Narnia"}).json()["donors"], [])
+
+        # a row with nothing but a country we dont know has a Location too
+        hyperborea = Donor.objects.create(user=User.objects.create(username="hyperborea"), blood_type="O-", country="Hyperborea")
+        self.assertEqual((hyperborea.place.country_key, hyperborea.place.city_key), ("hyperborea", ""))
+        donors = self.client.get("/api/donors/", {"country": "HYPERBOREA "}).json()["donors"]
+        self.assertEqual([donor["id"] for donor in donors], [hyperborea.id])
+
+        # and by the map location filter, whose cached entry the new donor invalidated
+        regions = self.client.get("/api/donor-locations/", {"location": "atlantis"}).json()
+        self.assertEqual([region["region"] for region in regions], ["Poseidonia, Atlantis"])
+
+
+    def test_donation_history_filters(self):
+
+        DonationRequest.objects.create(requester=self.paris.user, recipient=self.texas.user, blood_type_needed="O-", location="Paris, Texas, United States")
+        DonationRequest.objects.create(requester=self.texas.user, recipient=self.paris.user, blood_type_needed="B+", location="Lyon, ARA, France")
+
+        response = self.client.get("/donation_history/", {"city": "PARIS"})
+        self.assertEqual([r.city for r in response.context["donation_requests"]], ["Paris"])
+        response = self.client.get("/donation_history/", {"country": "fr"})
+        self.assertEqual([r.city for r in response.context["donation_requests"]], ["Lyon"])
+
+
+    # the 0013 data migration points rows that existed before the Location table at their Location
+    def test_backfill(self):
+
+        Donor.objects.update(place=None)
+        Location.objects.all().delete()
+
+        backfill = importlib.import_module("compatibility.migrations.0013_backfill_location").backfill_locations
+        backfill(apps, None)
+
+        places = dict(Donor.objects.values_list("id", "place_id"))
+        self.assertEqual(Location.objects.count(), 2)
+        self.assertEqual(places[self.paris.id], places[self.other_paris.id])
+        self.assertEqual(Location.objects.get(pk=places[self.texas.id]).country, "US")
+
+
+    # the 0020 data migration moves rows with a country we dont know off the Location they shared with every other such country
+    def test_unknown_country_backfill(self):
+
+        atlantis = Donor.objects.create(user=User.objects.create(username="atlantis"), blood_type="O-", city="Poseidonia", country="Atlantis")
+        shared = Location.objects.create(city="Poseidonia", city_key="poseidonia")
+        Donor.objects.filter(pk=atlantis.pk).update(place=shared)
+
+        importlib.import_module("compatibility.migrations.0020_location_country_key").key_unknown_countries(apps, None)
+
+        place = Donor.objects.get(pk=atlantis.pk).place
+        self.assertEqual((place.country, place.country_key, place.city_key), ("", "atlantis", "poseidonia"))
+        self.assertEqual(Donor.objects.get(pk=self.paris.pk).place_id, self.paris.place_id)
+
+        # rows with only a country we dont know had no Location at all
+        lemuria = Donor.objects.create(user=User.objects.create(username="lemuria"), blood_type="O-", country="Lemuria")
+        Donor.objects.filter(pk=lemuria.pk).update(place=None)
+        importlib.import_module("compatibility.migrations.0020_location_country_key").key_unknown_countries(apps, None)
+        place = Donor.objects.get(pk=lemuria.pk).place
+        self.assertEqual((place.country, place.country_key, place.region_key, place.city_key), ("", "lemuria", "", ""))
+
+
+
+# the homepage numbers come from a rollup the donor signals keep in sync (site_stats.py), it always has to match a full recount
+class SiteStatsTestCase(TestCase):
+
+    def setUp(self):
+
+        self.paris = Donor.objects.create(user=User.objects.create(username="paris"), blood_type="O-", city="Paris", country="France")
+        self.lyon = Donor.objects.create(user=User.objects.create(username="lyon"), blood_type="O-", city="Lyon", state_or_county="Rhone", country="France")
+
+    def full_recount(self):
+        donors = Donor.objects.all()
+        return {
+            "total_donors": donors.count(),
+            "total_countries": donors.values("country").distinct().count(),
+            "total_cities": donors.values("city").distinct().count(),
+            "total_states_or_counties": donors.values("state_or_county").distinct().count(),
+            "total_blood_types": donors.values("blood_type").distinct().count(),
+        }
+
+
+    def test_incremental_updates_match_recount(self):
+
+        self.assertEqual(get_site_stats(), self.full_recount())
+
+        steps = [
+            lambda: Donor.objects.create(user=User.objects.create(username="mumbai"), blood_type="A+", city="Mumbai", state_or_county="MH", country="India"),
+            lambda: Donor.objects.create(user=User.objects.create(username="nowhere"), blood_type="B+"),
+            lambda: setattr(self.lyon, "city", "Paris") or self.lyon.save(),
+            lambda: setattr(self.paris, "blood_type", "AB+") or self.paris.save(),
+            lambda: User.objects.get(username="mumbai").delete(),
+            lambda: self.paris.delete(),
+        ]
+        for step in steps:
+            step()
+            self.assertEqual(get_site_stats(), self.full_recount())
+            self.assertEqual(reconcile(fix=False), [])
+
+
+    def test_homepage_reads_one_row(self):
+
+        get_site_stats()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/")
+        self.assertEqual(response.context["total_countries"], 1)
+        self.assertEqual(response.context["total_cities"], 2)
+        self.assertFalse([query["sql"] for query in queries if "COUNT(" in query["sql"].upper()])
+
+
+    # bulk_create skips the signals, the database check notices and reconcile fixes it
+    def test_reconcile(self):
+
+        get_site_stats()
+        Donor.objects.bulk_create([Donor(user=User.objects.create(username="bulk"), blood_type="A-", city="Berlin", country="Germany")])
+
+        self.assertEqual([warning.id for warning in check_site_stats(None, databases=["default"])], ["compatibility.W001"] * 5)
+        self.assertEqual(check_site_stats(None), [])
+
+        out = io.StringIO()
+        call_command("reconcile_site_stats", stdout=out)
+        self.assertIn("fixed", out.getvalue())
+        self.assertEqual(get_site_stats(), self.full_recount())
+        call_command("reconcile_site_stats", "--check", stdout=io.StringIO())
+
+
+
+# every list/filter view has to be served by an index, EXPLAIN QUERY PLAN of each query they run must not contain a plain "SCAN <table>"
+# (a full table scan, "SCAN <table> USING INDEX" walks an index and is fine). The unfiltered map counts aggregate every donor so they are left out
+class QueryPlanTestCase(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+        self.user = User.objects.create(username="me", email="me@example.com")
+        self.donor = Donor.objects.create(user=self.user, blood_type="O-", city="Paris", country="France", latitude=48.85, longitude=2.35)
+        other = Donor.objects.create(user=User.objects.create(username="other"), blood_type="A+", city="Lyon", country="France", latitude=45.76, longitude=4.84)
+        donation_request = DonationRequest.objects.create(requester=other.user, recipient=self.user, blood_type_needed="A+", location="Lyon, ARA, France")
+        donation_request.donors.add(self.donor)
+        self.client.force_login(self.user)
+
+        # the first read of the homepage numbers builds the rollup with a full recount, that one is allowed to scan
+        get_site_stats()
+
+    def full_scans(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertLess(response.status_code, 400, url)
+
+        scans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query["sql"].lstrip().upper().startswith("SELECT"):
+                    continue
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                scans.extend(
+                    f"{detail}: {query['sql']}" for *_, detail in cursor.fetchall()
+                    if detail.startswith("SCAN ") and "USING" not in detail
+                )
+        return scans
+
+
+    def test_list_views_use_indexes(self):
+
+        views = [
+            ("/api/donors/", {}),
+            ("/api/donors/", {"blood_type": "O-"}),
+            ("/api/donors/", {"country": "France"}),
+            ("/api/donors/", {"blood_type": "O-", "country": "fr", "cursor": encode_cursor(1)}),
+            ("/api/donors/nearby/", {"lat": 48.8, "lng": 2.3, "blood_type": "A+"}),
+            ("/api/donor-locations/", {"location": "paris"}),
+            ("/api/donor-locations/", {"location": "france", "blood_type": "O-"}),
+            ("/api/active-requests/", {}),
+            ("/api/active-requests/", {"blood_type": "A+", "country": "France"}),
+            ("/donors/", {"blood_type": "O-", "country": "France"}),
+            ("/donation_history/", {}),
+            ("/donation_history/", {"status": "Pending", "blood_type": "A+"}),
+            ("/donation_history/", {"city": "Lyon", "country": "France"}),
+            ("/api/match_donors/", {}),
+            ("/api/get_requests/", {}),
+            ("/api/get_outgoing_requests/", {}),
+            ("/api/profile_bootstrap/", {}),
+            (f"/user/{self.user.id}/profile/", {}),
+            ("/", {}),
+        ]
+        for url, params in views:
+            with self.subTest(url=url, params=params):
+                self.assertEqual(self.full_scans(url, params), [])
+
+
+# active_requests_api has to cost the same number of queries however many requests and accepted donors there are
+class ActiveRequestsQueryCountTestCase(TestCase):
+
+    def add_requests(self, count, donors_each):
+        for i in range(count):
+            donors = [
+                Donor.objects.create(user=User.objects.create(username=f"donor{i}-{j}-{Donor.objects.count()}", email=f"{i}{j}@example.com"), blood_type="O-")
+                for j in range(donors_each)
+            ]
+            donation_request = DonationRequest.objects.create(requester=donors[0].user, recipient=donors[-1].user, blood_type_needed="O-", location="Paris")
+            donation_request.accepted_donors.add(*donors)
+
+    def query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/active-requests/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()["active_requests"]
+
+
+    def test_query_count_is_constant(self):
+
+        self.add_requests(2, 1)
+        small, data = self.query_count()
+        self.assertEqual(len(data), 2)
+
+        self.add_requests(10, 3)
+        large, data = self.query_count()
+        self.assertEqual(len(data), 12)
+        self.assertEqual(len(data[-1]["donor_contact_info"]), 3)
+
+        # table versions (conditional GET), the requests with their requester, the accepted donors with their users
+        self.assertEqual(small, 3)
+        self.assertEqual(large, 3)
+
+
+
+# pending -> accepted / rejected / cancelled, each transition happens at most once
+class RequestStateMachineTestCase(TestCase):
+
+    def setUp(self):
+
+        self.requester = Donor.objects.create(user=User.objects.create(username="requester", email="requester@example.com"), blood_type="O-")
+        self.recipient = Donor.objects.create(user=User.objects.create(username="recipient"), blood_type="A+")
+
+    def send_request(self):
+        self.client.force_login(self.requester.user)
+        return self.client.post(f"/api/create_donor_request/{self.recipient.user.id}")
+
+    def manage(self, donation_request, action):
+        self.client.force_login(self.recipient.user)
+        return self.client.post(f"/api/manage_donor_request/{donation_request.id}", json.dumps({"action": action}), content_type="application/json")
+
+
+    def test_accept(self):
+
+        self.assertEqual(self.send_request().status_code, 200)
+        donation_request = DonationRequest.objects.get()
+
+        self.assertEqual(self.manage(donation_request, "accept").status_code, 200)
+        donation_request.refresh_from_db()
+        self.assertEqual((donation_request.status, donation_request.is_accepted), ("Accepted", True))
+        self.assertEqual(list(donation_request.accepted_donors.all()), [self.requester])
+
+        # already accepted, so it cant be accepted or rejected again
+        self.assertEqual(self.manage(donation_request, "accept").status_code, 409)
+        self.assertEqual(self.manage(donation_request, "reject").status_code, 409)
+        self.assertEqual(DonationRequest.objects.get().status, "Accepted")
+
+
+    def test_reject_and_cancel_keep_the_request(self):
+
+        self.send_request()
+        donation_request = DonationRequest.objects.get()
+        self.assertEqual(self.manage(donation_request, "reject").status_code, 200)
+        self.assertEqual(DonationRequest.objects.get().status, "Rejected")
+
+        # a new request can be sent after the old one was closed, and cancelled once
+        self.assertEqual(self.send_request().status_code, 200)
+        pending = DonationRequest.objects.get(status="Pending")
+        response = self.client.delete(f"/cancel_request/{pending.id}/")
+        self.assertTrue(response.json()["success"])
+        self.assertFalse(self.client.delete(f"/cancel_request/{pending.id}/").json()["success"])
+        self.assertEqual(sorted(DonationRequest.objects.values_list("status", flat=True)), ["Cancelled", "Rejected"])
+
+        with self.assertRaises(ValueError):
+            pending.transition("Pending")
+
+
+    def test_duplicate_pending_request(self):
+
+        self.assertEqual(self.send_request().status_code, 200)
+        self.assertEqual(self.send_request().status_code, 400)
+        self.assertEqual(DonationRequest.objects.count(), 1)
+
+
+# parallel clicks on real (separate) database connections: one transition wins, the rest see a request that isnt pending anymore
+class RequestConcurrencyTestCase(TransactionTestCase):
+
+    THREADS = 8
+
+    def setUp(self):
+
+        self.requester = Donor.objects.create(user=User.objects.create(username="requester"), blood_type="O-")
+        self.recipient = Donor.objects.create(user=User.objects.create(username="recipient"), blood_type="A+")
+
+    def run_in_parallel(self, func):
+        """ runs func(thread number) in THREADS threads released at the same moment, retrying while sqlite reports the table as locked """
+
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+        errors = []
+
+        def worker(number):
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        results.append(func(number))
+                        return
+                    except OperationalError as error:
+                        if "locked" not in str(error):
+                            raise
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.THREADS)
+        return results
+
+
+    # donors signing up in the same new city at the same moment all count in the homepage rollup
+    def test_parallel_site_stats_changes(self):
+
+        # no grid, so nothing runs after the commit and a retry on "database is locked" always retries the whole sign up
+        invalidate_donor_grid()
+        get_site_stats()
+
+        def sign_up(number):
+            with transaction.atomic():
+                user = User.objects.create(username=f"lyon{number}")
+                return Donor.objects.create(user=user, blood_type="B+", city="Lyon", country="France").pk
+
+        self.run_in_parallel(sign_up)
+        self.assertEqual(reconcile(fix=False), [])
+        self.assertEqual(get_site_stats()["total_donors"], 2 + self.THREADS)
+
+
+    def test_parallel_transitions(self):
+
+        donation_request = DonationRequest.objects.create(requester=self.requester.user, recipient=self.recipient.user, blood_type_needed="O-", location="Paris")
+        donation_request.donors.add(self.requester)
+
+        def click(number):
+            action = ("accept", "reject", "cancel")[number % 3]
+            request = DonationRequest.objects.get(pk=donation_request.pk)
+            return action, getattr(request, action)()
+
+        results = self.run_in_parallel(click)
+        winners = [action for action, won in results if won]
+        self.assertEqual(len(winners), 1)
+
+        donation_request.refresh_from_db()
+        self.assertEqual(donation_request.status, {"accept": "Accepted", "reject": "Rejected", "cancel": "Cancelled"}[winners[0]])
+        self.assertEqual(donation_request.accepted_donors.count(), 1 if winners == ["accept"] else 0)
+
+
+    def test_parallel_creates(self):
+
+        def create(number):
+            try:
+                DonationRequest.objects.create(requester=self.requester.user, recipient=self.recipient.user, blood_type_needed="O-", location="Paris")
+                return True
+            except IntegrityError:
+                return False
+
+        self.assertEqual(self.run_in_parallel(create).count(True), 1)
+        self.assertEqual(DonationRequest.objects.filter(status="Pending").count(), 1)
+
+
+
+# accepting a request costs the same whatever the number of donors, eligibility and membership are constant cost checks
+class AcceptRequestCostTestCase(TestCase):
+
+    def setUp(self):
+
+        self.requester = Donor.objects.create(user=User.objects.create(username="requester"), blood_type="A+")
+        self.donor = Donor.objects.create(user=User.objects.create(username="donor", email="donor@example.com"), blood_type="O-")
+
+    def add_donors(self, count):
+        users = User.objects.bulk_create([User(username=f"other{User.objects.count()}-{i}") for i in range(count)])
+        Donor.objects.bulk_create([Donor(user=user, blood_type="O-") for user in users])
+
+    def accept(self):
+        donation_request = DonationRequest.objects.create(requester=self.requester.user, recipient=User.objects.create(username=f"r{User.objects.count()}"), blood_type_needed="A+", location="Paris")
+        donation_request.donors.add(self.donor)
+        self.client.force_login(self.donor.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f"/accept_request/{donation_request.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["donor_email"], "donor@example.com")
+        return len(queries)
+
+
+    def test_cost_does_not_depend_on_donor_count(self):
+
+        few = self.accept()
+        self.add_donors(300)
+        self.assertEqual(self.accept(), few)
+
+
+    def test_checks(self):
+
+        donation_request = DonationRequest.objects.create(requester=self.requester.user, recipient=self.donor.user, blood_type_needed="O-", location="Paris")
+        donation_request.donors.add(self.requester)
+
+        self.assertFalse(donation_request.can_be_donated_by(self.requester))
+        self.assertTrue(donation_request.can_be_donated_by(self.donor))
+        self.assertTrue(donation_request.has_donor(self.requester))
+        self.assertFalse(donation_request.has_donor(self.donor))
+
+        self.assertEqual(donation_request.donor_contact_info(self.requester)["email"], "Hidden until accepted")
+        self.assertTrue(donation_request.accept_request(self.requester))
+        self.assertFalse(donation_request.accept_request(self.donor))
+        self.assertTrue(donation_request.has_accepted_donor(self.requester))
+        self.assertEqual(donation_request.donor_contact_info(self.requester)["location"], self.requester.location)
+
+        # an A+ donor cant give to an O- request, a compatible donor who isnt on the request cant accept it either
+        self.client.force_login(self.requester.user)
+        self.assertEqual(self.client.post(f"/accept_request/{donation_request.id}/").status_code, 403)
+        self.client.force_login(self.donor.user)
+        other = DonationRequest.objects.create(requester=self.requester.user, recipient=self.donor.user, blood_type_needed="A+", location="Paris", status="Cancelled")
+        self.assertEqual(self.client.post(f"/accept_request/{other.id}/").status_code, 403)
+
+
+
+class StubGeocoder(BaseHTTPRequestHandler):
+    """ stands in for the HERE geocode endpoint: "broken" answers 500, anything else one Paris item. Records every call and the client
+     address it came from (one address per tcp connection) """
+
+    protocol_version = "HTTP/1.1"
+    calls = []
+    delay = 0
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["q"][0]
+        StubGeocoder.calls.append((query, self.client_address))
+        time.sleep(StubGeocoder.delay)
+
+        if query == "broken":
+            body, status = b"{}", 500
+        elif query == "nowhere":
+            body, status = b'{"items": []}', 200
+        else:
+            body, status = json.dumps({"items": [{
+                "title": query,
+                "address": {"city": "Paris", "state": "Ile-de-France", "countryName": "France"},
+                "position": {"lat": 48.85, "lng": 2.35},
+            }]}).encode(), 200
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubGeocoderMixin:
+    """ runs a StubGeocoder for the test class and points the geocoding client at it """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGeocoder)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.geocoder_settings = override_settings(HERE_GEOCODE_URL=f"http://127.0.0.1:{cls.server.server_port}/v1/geocode", HERE_API_KEY="test")
+        cls.geocoder_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geocoder_settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        StubGeocoder.calls = []
+        StubGeocoder.delay = 0
+        memory_cache.clear()
+
+    def queries(self):
+        return [query for query, _ in StubGeocoder.calls]
+
+
+# the geocoding client against a local stub server, the threads (coalescing) need their own database connections so this isnt a TestCase
+class GeocodingTestCase(StubGeocoderMixin, TransactionTestCase):
+
+
+    def test_cache_tiers(self):
+
+        first = geocode("Paris")
+        self.assertEqual(first["items"][0]["address"]["city"], "Paris")
+
+        # same query with different case and spacing comes from the in-process tier, no query at all
+        with self.assertNumQueries(0):
+            self.assertEqual(geocode("  PARIS "), first)
+
+        # a fresh process (empty LRU) gets it from the database tier
+        memory_cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(geocode("paris"), first)
+        self.assertEqual(self.queries(), ["Paris"])
+
+        # expired entries are fetched again
+        memory_cache.clear()
+        GeocodeCacheEntry.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        geocode("Paris")
+        self.assertEqual(self.queries(), ["Paris", "Paris"])
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+
+
+    def test_address_fields_and_proxy(self):
+
+        self.assertEqual(address_fields(geocode("paris france", lang="en")["items"][0]), {
+            "city": "Paris", "state_or_county": "Ile-de-France", "country": "France", "location": "Paris, Ile-de-France, France",
+            "latitude": 48.85, "longitude": 2.35,
+        })
+
+        response = self.client.get("/api/geocode", {"q": "Paris"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"][0]["position"], {"lat": 48.85, "lng": 2.35})
+
+        # the worker asks for english results so it is a different cache entry than the proxy
+        self.client.get("/api/geocode", {"q": "paris france"})
+        self.assertEqual(self.queries(), ["paris france", "Paris", "paris france"])
+
+
+    def test_errors_are_not_cached(self):
+
+        with self.assertRaises(GeocodingError):
+            geocode("broken")
+        with self.assertRaises(GeocodingError):
+            geocode("broken", lang="en")
+        self.assertEqual(self.client.get("/api/geocode", {"q": "broken"}).status_code, 502)
+
+        self.assertEqual(self.queries(), ["broken"] * 3)
+        self.assertFalse(GeocodeCacheEntry.objects.exists())
+
+
+    def test_connection_reuse(self):
+
+        for city in ("Paris", "Lyon", "Nice", "Lille", "Nantes"):
+            geocode(city)
+
+        self.assertEqual(len(StubGeocoder.calls), 5)
+        self.assertEqual(len({address for _, address in StubGeocoder.calls}), 1)
+
+
+    def test_concurrent_lookups_are_coalesced(self):
+
+        StubGeocoder.delay = 0.3
+        barrier = threading.Barrier(8)
+        results = []
+
+        def worker():
+            barrier.wait()
+            try:
+                results.append(geocode("Lyon"))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.queries(), ["Lyon"])
+        self.assertTrue(all(result == results[0] for result in results))
+
+
+
+# register and edit_profile only queue the geocode, the worker command fills the donor in
+class GeocodeJobTestCase(StubGeocoderMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.donor = Donor.objects.create(user=User.objects.create(username="donor"), blood_type="O-", city="Lyon", country="France")
+
+    def work(self):
+        call_command("geocode_worker", "--once", stdout=io.StringIO())
+        self.donor.refresh_from_db()
+
+
+    def test_edit_profile_doesnt_wait_for_geocoding(self):
+
+        self.client.force_login(self.donor.user)
+        response = self.client.post("/api/edit_profile/", {"username": "donor", "location": "paris france"}, content_type="application/json")
+
+        self.assertEqual(response.json()["geocode_status"], "Pending")
+        self.assertEqual(self.queries(), [])
+        self.donor.refresh_from_db()
+        self.assertEqual((self.donor.location, self.donor.city, self.donor.latitude), ("paris france", "Lyon", None))
+
+        self.work()
+        self.assertEqual(self.queries(), ["paris france"])
+        self.assertEqual(
+            (self.donor.city, self.donor.state_or_county, self.donor.country, self.donor.latitude, self.donor.longitude),
+            ("Paris", "Ile-de-France", "France", 48.85, 2.35),
+        )
+        # the raw text is replaced by the formatted location, which is what the donors requests copy and split up again
+        self.assertEqual(self.donor.location, "Paris, Ile-de-France, France")
+        recipient = User.objects.create(username="recipient")
+        Donor.objects.create(user=recipient, blood_type="O-")
+        self.client.post(f"/api/create_donor_request/{recipient.pk}")
+        donation_request = DonationRequest.objects.get(requester=self.donor.user)
+        self.assertEqual(
+            (donation_request.location, donation_request.city, donation_request.state, donation_request.country),
+            ("Paris, Ile-de-France, France", "Paris", "Ile-de-France", "France"),
+        )
+        self.assertEqual(donation_request.place_id, self.donor.place_id)
+        self.assertEqual(self.donor.place.city_key, "paris")
+
+        data = self.client.get("/api/edit_profile/").json()
+        self.assertEqual((data["geocode_status"], data["city"]), ("Done", "Paris"))
+
+
+    def test_register_queues_coordinates(self):
+
+        self.client.post("/register/", {
+            "username": "new", "email": "new@example.com", "password1": "a-Long-pass-123", "password2": "a-Long-pass-123",
+            "blood_type": "A+", "city": "Paris", "country": "France", "availability": "on",
+        })
+        job = GeocodeJob.objects.get(donor__user__username="new")
+        self.assertEqual((job.query, job.status), ("Paris, France", "Pending"))
+
+
+    def test_batch_geocodes_each_query_once(self):
+
+        for i in range(3):
+            donor = Donor.objects.create(user=User.objects.create(username=f"paris{i}"), blood_type="A+")
+            enqueue_geocode(donor, "Paris " if i else "paris")
+        enqueue_geocode(self.donor, "nowhere")
+
+        self.work()
+        self.assertEqual(sorted(self.queries()), ["nowhere", "paris"])
+        self.assertEqual(Donor.objects.filter(city="Paris", latitude=48.85).count(), 3)
+
+        # a location HERE doesnt know fails straight away, retrying wont change the answer
+        job = GeocodeJob.objects.get(donor=self.donor)
+        self.assertEqual((job.status, job.attempts, job.last_error), ("Failed", 0, "No match for this location."))
+
+
+    def test_retries_with_backoff(self):
+
+        enqueue_geocode(self.donor, "broken")
+
+        for attempt in range(1, GEOCODE_MAX_ATTEMPTS + 1):
+            before = timezone.now()
+            self.work()
+            job = GeocodeJob.objects.get(donor=self.donor)
+            self.assertEqual(job.attempts, attempt)
+            if attempt == GEOCODE_MAX_ATTEMPTS:
+                break
+
+            self.assertEqual(job.status, "Pending")
+            self.assertGreaterEqual(job.run_after, before + timedelta(seconds=GEOCODE_RETRY_DELAY * 2 ** (attempt - 1)))
+
+            # not due yet, the next round leaves it alone
+            self.assertEqual(claim_jobs(), [])
+            GeocodeJob.objects.update(run_after=timezone.now())
+
+        self.assertEqual(job.status, "Failed")
+        self.assertEqual(self.queries(), ["broken"] * GEOCODE_MAX_ATTEMPTS)
+        self.assertIsNone(self.donor.latitude)
+
+
+    def test_newer_edit_wins(self):
+
+        enqueue_geocode(self.donor, "paris")
+        jobs = claim_jobs()
+        self.assertEqual(claim_jobs(), [])
+
+        # the user changes their location again while the worker is still geocoding the old one
+        enqueue_geocode(self.donor, "nowhere")
+        self.assertEqual(run_jobs(jobs)["dropped"], 1)
+
+        self.donor.refresh_from_db()
+        self.assertEqual(self.donor.city, "Lyon")
+        job = GeocodeJob.objects.get(donor=self.donor)
+        self.assertEqual((job.query, job.status), ("nowhere", "Pending"))
+
+
+    def test_jobs_of_dead_workers_are_taken_again(self):
+
+        enqueue_geocode(self.donor, "paris")
+        self.assertEqual(len(claim_jobs()), 1)
+        self.assertEqual(claim_jobs(), [])
+
+        GeocodeJob.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.work()
+        self.assertEqual(self.donor.city, "Paris")
+
+
+
+# geocode_backfill against the stub server, the pool threads read and write the geocode cache on their own connections
+class GeocodeBackfillTestCase(StubGeocoderMixin, TransactionTestCase):
+
+    def donor(self, name, city="", country="", **fields):
+        return Donor.objects.create(user=User.objects.create(username=name), blood_type="A+", city=city, country=country, **fields)
+
+    def backfill(self, *args):
+        out = io.StringIO()
+        call_command("geocode_backfill", "--chunk-size", "4", "--workers", "3", "--rate", "100", *args, stdout=out)
+        return out.getvalue()
+
+
+    def test_backfill(self):
+
+        for i in range(5):
+            self.donor(f"paris{i}", "Paris", "France")
+        lyon = [self.donor(f"lyon{i}", " lyon ", "france") for i in range(4)]
+        self.donor("nowhere", "nowhere")
+        broken = self.donor("broken", "broken")
+        placed = self.donor("placed", "Nice", "France", latitude=43.7, longitude=7.26)
+        self.donor("no location")
+        enqueue_geocode(self.donor("queued", "Lille", "France"), "Lille, France")
+        invalidate_donor_grid()
+        self.assertEqual(len(get_donor_grid()), 1)
+
+        output = self.backfill()
+
+        # every distinct place is looked up once, even across chunks
+        self.assertEqual(sorted(self.queries()), sorted(["Paris, France", " lyon , france", "nowhere", "broken"]))
+        self.assertEqual(Donor.objects.filter(latitude=48.85, longitude=2.35).count(), 9)
+        self.assertIn("11/11 donors", output)
+        self.assertIn("9 updated, 1 not found, 1 failed", output)
+        self.assertIn(f"resume with --start-after {broken.pk}", output)
+
+        # the version bump is what tells the grids of the web processes (here the test's own) to read the new coordinates
+        self.assertEqual(len(get_donor_grid().nearest(48.85, 2.35, 20, max_km=1)), 9)
+
+        # bulk_update only writes the coordinates, everything else about the donors stays as it was
+        self.assertEqual(Donor.objects.get(pk=lyon[0].pk).city, " lyon ")
+        self.assertEqual(Donor.objects.get(pk=placed.pk).latitude, 43.7)
+        self.assertIsNone(Donor.objects.get(user__username="queued").latitude)
+
+        # a rerun only has the two that didnt work left, and the place HERE doesnt know is answered from the cache
+        StubGeocoder.calls = []
+        output = self.backfill()
+        self.assertIn("2/2 donors", output)
+        self.assertEqual(self.queries(), ["broken"])
+
+        # resuming after the last donor leaves nothing to do
+        self.assertIn("Nothing to backfill.", self.backfill("--start-after", str(broken.pk)))
+
+
+    def test_rate_limiter(self):
+
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+
+        threads = [threading.Thread(target=limiter.acquire) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the first call goes straight away, the other five are spaced 20ms apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+
+
+class RecordingCache(LocMemCache):
+    """ local memory cache that records which of its methods are called, the async ones dont go through the sync ones """
+
+    calls = []
+
+    def get(self, *args, **kwargs):
+        self.calls.append("get")
+        return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self.calls.append("set")
+        return super().set(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        self.calls.append("incr")
+        return super().incr(*args, **kwargs)
+
+    async def aget(self, *args, **kwargs):
+        self.calls.append("aget")
+        return super().get(*args, **kwargs)
+
+    async def aset(self, *args, **kwargs):
+        self.calls.append("aset")
+        return super().set(*args, **kwargs)
+
+    async def aincr(self, *args, **kwargs):
+        self.calls.append("aincr")
+        return super().incr(*args, **kwargs)
+
+    async def aadd(self, *args, **kwargs):
+        self.calls.append("aadd")
+        return super().add(*args, **kwargs)
+
+
+
+class AsyncUrls:
+    """ url conf with the async views behind the same urls, like urls.py routes them with ASYNC_VIEWS on """
+
+    urlpatterns = [
+        path("api/geocode", async_views.geocode_proxy),
+        path("api/donor-locations/", async_views.donor_locations_api),
+        path("api/donors/", async_views.donor_list_api),
+        path("api/active-requests/", async_views.active_requests_api),
+        path("api/get_requests/", async_views.get_requests),
+        path("api/notifications/", async_views.notifications),
+    ]
+
+
+# the async views answer exactly like the sync ones, only without holding a thread while they wait
+class AsyncViewsTestCase(StubGeocoderMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+        self.paris = Donor.objects.create(user=User.objects.create(username="paris", email="paris@example.com"), blood_type="O-", city="Paris", country="France")
+        self.lyon = Donor.objects.create(user=User.objects.create(username="lyon", email="lyon@example.com"), blood_type="A+", city="Lyon", country="France")
+        self.berlin = Donor.objects.create(user=User.objects.create(username="berlin"), blood_type="O-", city="Berlin", country="Germany")
+
+        accepted = DonationRequest.objects.create(requester=self.lyon.user, recipient=self.paris.user, blood_type_needed="A+", location="Lyon, France")
+        accepted.donors.add(self.paris)
+        accepted.accept([self.paris])
+        DonationRequest.objects.create(requester=self.berlin.user, recipient=self.paris.user, blood_type_needed="O-", location="Berlin, Germany")
+
+    async def both(self, url):
+        """ (sync view response, async view response) for the url """
+
+        sync = await sync_to_async(self.client.get)(url)
+        cache.clear()
+        with self.settings(ROOT_URLCONF=AsyncUrls):
+            response = await self.async_client.get(url)
+        return sync, response
+
+
+    async def test_same_json_as_sync_views(self):
+
+        await self.async_client.aforce_login(self.paris.user)
+        await sync_to_async(self.client.force_login)(self.paris.user)
+
+        for url in (
+            "/api/donors/", "/api/donors/?page_size=1", f"/api/donors/?page_size=1&cursor={encode_cursor(self.paris.id)}", "/api/donors/?country=de",
+            "/api/active-requests/", "/api/active-requests/?blood_type=O-", "/api/active-requests/?country=France",
+            "/api/donor-locations/", "/api/donor-locations/?location=france&blood_type=O-",
+            "/api/get_requests/",
+        ):
+            sync, response = await self.both(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response["Content-Type"], sync["Content-Type"], url)
+            self.assertEqual(response.content, sync.content, url)
+
+        with self.settings(ROOT_URLCONF=AsyncUrls):
+            self.assertEqual((await self.async_client.get("/api/donors/?cursor=nope")).status_code, 400)
+
+            await self.async_client.alogout()
+            self.assertEqual((await self.async_client.get("/api/get_requests/")).status_code, 302)
+            await self.async_client.aforce_login(await User.objects.acreate(username="not a donor"))
+            self.assertEqual((await self.async_client.get("/api/get_requests/")).status_code, 400)
+
+
+    # the region cache is read and written with the async cache api, a shared backend is never waited on from the event loop
+    async def test_region_cache_is_async(self):
+
+        RecordingCache.calls = []
+        with self.settings(ROOT_URLCONF=AsyncUrls, CACHES={"default": {"BACKEND": "compatibility.tests.RecordingCache"}}):
+            first = await self.async_client.get("/api/donor-locations/", {"location": "france"})
+            second = await self.async_client.get("/api/donor-locations/", {"location": "france"})
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(RecordingCache.calls, ["aget", "aincr", "aadd", "aincr", "aset", "aget", "aincr", "aadd", "aincr"])
+
+
+    # read only like the sync views, whichever server answers
+    async def test_only_get(self):
+
+        for urls in (AsyncUrls, settings.ROOT_URLCONF):
+            with self.settings(ROOT_URLCONF=urls):
+                for url in ("/api/geocode", "/api/donor-locations/", "/api/donors/", "/api/active-requests/"):
+                    self.assertEqual((await self.async_client.post(url, {"q": "Paris"})).status_code, 405, (urls, url))
+                    self.assertEqual((await self.async_client.delete(url)).status_code, 405, (urls, url))
+        self.assertEqual(self.queries(), [])
+
+
+    # sync test so the queries can be captured, the async ORM runs them on this thread
+    def test_not_modified(self):
+
+        get = async_to_sync(self.async_client.get)
+        with self.settings(ROOT_URLCONF=AsyncUrls):
+            for url in ("/api/donors/", "/api/active-requests/", "/api/donor-locations/"):
+                etag = get(url)["ETag"]
+
+                with CaptureQueriesContext(connection) as queries:
+                    response = get(url, headers={"If-None-Match": etag})
+                self.assertEqual(response.status_code, 304, url)
+                self.assertEqual(len(queries), 1, url)
+
+
+    async def test_geocode_proxy_doesnt_block(self):
+
+        # every call waits 0.3s on the stub, one after the other these would take 3s
+        StubGeocoder.delay = 0.3
+        start = time.monotonic()
+        with self.settings(ROOT_URLCONF=AsyncUrls):
+            responses = await asyncio.gather(*(self.async_client.get("/api/geocode", {"q": f"city {i}"}) for i in range(10)))
+            same = await asyncio.gather(*(self.async_client.get("/api/geocode", {"q": "Paris"}) for i in range(5)))
+        # one after the other this takes 4.5s, together it is two rounds of 0.3s plus the test client overhead
+        self.assertLess(time.monotonic() - start, 2.5)
+
+        self.assertEqual([response.status_code for response in responses + same], [200] * 15)
+        self.assertEqual(responses[3].json()["items"][0]["title"], "city 3")
+
+        # concurrent lookups of the same query are one call to HERE, the answers are cached like the sync proxy's
+        self.assertEqual(sorted(self.queries()), sorted([f"city {i}" for i in range(10)] + ["Paris"]))
+        self.assertTrue(await GeocodeCacheEntry.objects.filter(query="paris").aexists())
+
+        with self.settings(ROOT_URLCONF=AsyncUrls):
+            self.assertEqual((await self.async_client.get("/api/geocode", {"q": "broken"})).status_code, 502)
+
+
+
+class RecordingBroker:
+    """ events broker that keeps what was published, for EVENTS_BROKER. Stands in for one the web and worker processes share """
+
+    cross_process = True
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, user_ids, event):
+        self.published.append((sorted(user_ids), event))
+
+
+class LocalRecordingBroker(RecordingBroker):
+    """ RecordingBroker that, like InProcessBroker, only reaches its own process """
+
+    cross_process = False
+
+
+# request events reach the two users of the request, only once the change is committed, and the stream forwards them as server-sent events
+@override_settings(EVENTS_BROKER="compatibility.tests.RecordingBroker")
+class NotificationsTestCase(TestCase):
+
+    def setUp(self):
+        self.broker = get_broker()
+        self.broker.published.clear()
+
+        self.alice = Donor.objects.create(user=User.objects.create(username="alice"), blood_type="O-", city="Paris", country="France")
+        self.bob = Donor.objects.create(user=User.objects.create(username="bob"), blood_type="A+", city="Paris", country="France")
+
+    def new_request(self):
+        return DonationRequest.objects.create(requester=self.alice.user, recipient=self.bob.user, blood_type_needed="O-", location="Paris, France")
+
+    def events(self):
+        return [(user_ids, event["type"]) for user_ids, event in self.broker.published]
+
+
+    def test_events_after_commit(self):
+
+        users = sorted([self.alice.user.pk, self.bob.user.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            donation_request = self.new_request()
+            donation_request.donors.add(self.alice)
+            # nothing goes out before the transaction commits
+            self.assertEqual(self.broker.published, [])
+        self.assertEqual(self.events(), [(users, "request_created")])
+        self.assertEqual(self.broker.published[0][1], {"type": "request_created", "request_id": donation_request.pk, "status": "Pending"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(donation_request.accept())
+            # a transition that loses the race sends nothing
+            self.assertFalse(donation_request.reject())
+        self.assertEqual(self.events()[1:], [(users, "request_accepted")])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.new_request().reject()
+        self.assertEqual(self.events()[-1], (users, "request_rejected"))
+
+        # through the view too
+        cancelled = self.new_request()
+        self.client.force_login(self.alice.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.client.delete(f"/cancel_request/{cancelled.pk}/").json()["success"])
+        self.assertEqual(self.broker.published[-1], (users, {"type": "request_cancelled", "request_id": cancelled.pk, "status": "Cancelled"}))
+
+        # a rolled back change sends nothing either
+        count = len(self.broker.published)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                self.new_request()
+                self.new_request()
+        self.assertEqual(len(self.broker.published), count)
+
+
+    def test_wsgi_stand_in(self):
+
+        self.assertEqual(self.client.get("/api/notifications/").status_code, 302)
+        self.client.force_login(self.alice.user)
+        self.assertEqual(self.client.get("/api/notifications/").status_code, 204)
+
+
+    def test_slow_subscriber_gets_resync(self):
+
+        queue = asyncio.Queue(maxsize=2)
+        for i in range(3):
+            deliver(queue, {"type": "request_created", "request_id": i})
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), {"type": "resync"})
+
+
+    @override_settings(EVENTS_BROKER="compatibility.events.InProcessBroker", ROOT_URLCONF=AsyncUrls)
+    async def test_stream(self):
+
+        broker = get_broker()
+        await self.async_client.aforce_login(self.bob.user)
+
+        response = await self.async_client.get("/api/notifications/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b"retry: 5000\n\n")
+
+        # the stream subscribes when it is first waited on
+        received = asyncio.ensure_future(anext(stream))
+        while self.bob.user.pk not in broker.subscribers:
+            await asyncio.sleep(0.01)
+
+        @sync_to_async
+        def reject():
+            donation_request = self.new_request()
+            with self.captureOnCommitCallbacks(execute=True):
+                donation_request.reject()
+            return donation_request
+
+        # events of other users dont reach this stream
+        broker.publish([self.alice.user.pk + 1000], {"type": "request_created", "request_id": 0})
+        donation_request = await reject()
+
+        chunk = await asyncio.wait_for(received, 5)
+        self.assertEqual(chunk.decode(), (
+            "event: request_rejected\n"
+            f'data: {{"type":"request_rejected","request_id":{donation_request.pk},"status":"Rejected"}}\n\n'
+        ))
+
+        # the ASGI handler cancels the response when the client goes away, that drops the subscription
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertNotIn(self.bob.user.pk, broker.subscribers)
+
+
+    async def test_keepalive(self):
+
+        subscription = InProcessBroker().subscribe(self.bob.user.pk, heartbeat=0.01)
+        self.assertIsNone(await anext(subscription))
+        await subscription.aclose()
+
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """ locmem backend that counts how often a connection is opened """
+
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+
+# a new request reaches every available compatible donor in the requesters place, in batches, from the worker and not the request
+@override_settings(EMAIL_BACKEND="compatibility.tests.CountingEmailBackend", EVENTS_BROKER="compatibility.tests.RecordingBroker")
+class FanoutTestCase(TestCase):
+
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        get_broker().published.clear()
+
+        def donor(name, blood_type, city="Paris", country="France", **kwargs):
+            user = User.objects.create(username=name, email=f"{name}@example.com" if name != "no_email" else "")
+            return Donor.objects.create(user=user, blood_type=blood_type, city=city, country=country, **kwargs)
+
+        self.requester = donor("requester", "A+")
+        self.recipient = donor("recipient", "O-")
+        self.helpers = [donor(f"helper{i}", ("A+", "A-", "O+", "O-")[i % 4]) for i in range(7)] + [donor("no_email", "O+")]
+
+        donor("wrong_type", "B+")
+        donor("unavailable", "O-", availability=False)
+        donor("elsewhere", "O-", city="Lyon")
+        inactive = donor("inactive", "A+")
+        User.objects.filter(pk=inactive.user_id).update(is_active=False)
+
+    def send_request(self):
+        self.client.force_login(self.requester.user)
+        self.assertEqual(self.client.post(f"/api/create_donor_request/{self.recipient.user.id}").status_code, 200)
+        return DonationRequest.objects.get()
+
+    def work(self, **kwargs):
+        """ worker rounds until the queue is empty, like notify_worker --once """
+
+        rounds = []
+        while jobs := claim_fanouts():
+            with get_connection() as mail_connection:
+                rounds.append(run_fanouts(jobs, mail_connection, **kwargs))
+        return rounds
+
+
+    def test_fanout(self):
+
+        donation_request = self.send_request()
+
+        # the response only queued it
+        self.assertEqual(NotificationFanout.objects.get().status, "Pending")
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(mail.outbox, [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.work(batch_size=3), [{"done": 1, "paused": 0, "retried": 0, "failed": 0, "dropped": 0}])
+
+        helper_users = {helper.user_id for helper in self.helpers}
+        self.assertEqual(set(Notification.objects.values_list("user_id", flat=True)), helper_users)
+        self.assertEqual(set(Notification.objects.values_list("donation_request_id", flat=True)), {donation_request.pk})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(f"helper{i}@example.com" for i in range(7)))
+        self.assertIn("requester needs A+ blood in Paris, France", mail.outbox[0].body)
+
+        # one mail connection for the round, one insert per batch (A+ and A- have 2 helpers each, O+ 3, O- 1, batches of 3)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        inserts = [query for query in queries.captured_queries if query["sql"].startswith("INSERT") and '"compatibility_notification"' in query["sql"]]
+        self.assertEqual(len(inserts), 4)
+
+        fanout = NotificationFanout.objects.get()
+        self.assertEqual((fanout.status, fanout.notified, fanout.emailed), ("Done", 8, 7))
+
+        # the live events went to the helpers
+        self.assertEqual(
+            set().union(*(user_ids for user_ids, event in get_broker().published if event["type"] == "notification")), helper_users,
+        )
+
+        self.client.force_login(self.helpers[0].user)
+        notifications = self.client.get("/api/get_notifications/").json()["notifications"]
+        self.assertEqual([(n["request_id"], n["read"]) for n in notifications], [(donation_request.pk, False)])
+
+
+    # the default broker only reaches streams of the worker process itself, so the worker doesnt publish through it
+    @override_settings(EVENTS_BROKER="compatibility.tests.LocalRecordingBroker")
+    def test_no_live_events_without_a_shared_broker(self):
+
+        self.send_request()
+        self.work()
+        self.assertEqual(Notification.objects.count(), len(self.helpers))
+        self.assertNotIn("notification", [event["type"] for _, event in get_broker().published])
+
+
+    def test_bounded_rounds(self):
+
+        self.send_request()
+
+        # one batch of one donor per round, the job goes back in the queue in between and carries on from its cursor
+        rounds = self.work(batch_size=1, max_batches=1)
+        self.assertEqual(sum(counts["paused"] for counts in rounds), 8)
+        self.assertEqual(rounds[-1]["done"], 1)
+        self.assertEqual(Notification.objects.count(), 8)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(NotificationFanout.objects.get().notified, 8)
+
+
+    def test_cancelled_and_rolled_back(self):
+
+        donation_request = self.send_request()
+        donation_request.cancel()
+        self.assertEqual(self.work(), [{"done": 1, "paused": 0, "retried": 0, "failed": 0, "dropped": 0}])
+        self.assertFalse(Notification.objects.exists())
+
+        # a refused second request queues nothing
+        self.client.force_login(self.recipient.user)
+        self.client.post(f"/api/create_donor_request/{self.requester.user.id}")
+        self.assertEqual(self.client.post(f"/api/create_donor_request/{self.requester.user.id}").status_code, 400)
+        self.assertEqual(NotificationFanout.objects.count(), 2)
+
+
+
+# the own profile page and profile_bootstrap answer with the four payloads the page used to fetch one by one, from a fixed number of queries
+class ProfileBootstrapTestCase(TestCase):
+
+    def setUp(self):
+
+        self.me = Donor.objects.create(user=User.objects.create(username="me", email="me@example.com"), blood_type="A+", city="Paris", country="France")
+        enqueue_geocode(self.me, "Paris, France")
+        self.client.force_login(self.me.user)
+        self.donors = 0
+        self.add_data()
+
+    def add_data(self):
+        """ one more of everything the page shows: an incoming, an outgoing and an accepted request, and two potential matches """
+
+        def donor(blood_type):
+            self.donors += 1
+            user = User.objects.create(username=f"donor{self.donors}", email=f"donor{self.donors}@example.com")
+            return Donor.objects.create(user=user, blood_type=blood_type, city="Lyon", country="France")
+
+        incoming = DonationRequest.objects.create(requester=donor("B+").user, recipient=self.me.user, blood_type_needed="B+", location="Lyon, France")
+        incoming.donors.add(incoming.requester.donor_profile)
+
+        outgoing = DonationRequest.objects.create(requester=self.me.user, recipient=donor("O-").user, blood_type_needed="A+", location="Paris, France")
+        outgoing.donors.add(self.me)
+
+        helper = donor("O+")
+        accepted = DonationRequest.objects.create(requester=helper.user, recipient=self.me.user, blood_type_needed="O+", location="Lyon, France")
+        accepted.donors.add(helper)
+        accepted.accept()
+
+        donor("A-")
+
+    def page(self):
+        response = self.client.get(f"/user/{self.me.user.id}/profile/")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+    def test_same_json_as_the_endpoints(self):
+
+        bootstrap = self.client.get("/api/profile_bootstrap/").json()
+        self.assertEqual(bootstrap, {
+            "edit_profile": self.client.get("/api/edit_profile/").json(),
+            "get_requests": self.client.get("/api/get_requests/").json(),
+            "get_outgoing_requests": self.client.get("/api/get_outgoing_requests/").json(),
+            "match_donors": self.client.get("/api/match_donors/").json(),
+        })
+        self.assertEqual(bootstrap["edit_profile"]["geocode_status"], "Pending")
+        self.assertEqual([req["recipient_username"] for req in bootstrap["get_outgoing_requests"]["requests"]], ["donor2"])
+        self.assertEqual([req["requester_username"] for req in bootstrap["get_requests"]["requests"]], ["donor1"])
+        self.assertEqual([match["username"] for match in bootstrap["match_donors"]["matches"]], ["donor3", "donor2", "donor3", "donor4"])
+
+        # the page has the same json embedded
+        page = self.page()
+        self.assertEqual(json.loads(page.content.decode().split('<script id="profile-bootstrap" type="application/json">')[1].split("</script>")[0]), bootstrap)
+        self.assertEqual([donor["username"] for donor in page.context["accepted_donors"]], ["donor3"])
+
+
+    def test_query_budget(self):
+
+        # session and user, the donor profile with its geocode job, then received requests, outgoing requests, accepted and potential matches
+        for _ in range(2):
+            with self.assertNumQueries(7):
+                self.client.get("/api/profile_bootstrap/")
+            # the viewed user instead of the donor profile, the same four after it
+            with self.assertNumQueries(7):
+                self.page()
+            self.add_data()
+
+        # someone elses profile: their user, the viewers donor profile, and one query over the requests between the two
+        other = User.objects.get(username="donor1")
+        with self.assertNumQueries(5):
+            response = self.client.get(f"/user/{other.id}/profile/")
+        self.assertEqual((response.context["has_requested"], response.context["bootstrap"]), (False, None))
+
+
+    def test_not_a_donor(self):
+
+        self.client.force_login(User.objects.create(username="visitor"))
+        bootstrap = self.client.get("/api/profile_bootstrap/").json()
+        self.assertEqual(bootstrap["get_requests"], self.client.get("/api/get_requests/").json())
+        self.assertEqual(bootstrap["match_donors"], self.client.get("/api/match_donors/").json())
+        self.assertEqual(bootstrap["get_outgoing_requests"], {"requests": []})
+        self.assertEqual(bootstrap["edit_profile"]["blood_type"], None)
@@ -1,7 +1,13 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views # not needed yet, might be needed for standardising authentication views later
 
-from . import views
+from django.conf import settings
+
+from . import async_views, views
+
+
+# the read only json endpoints and the geocode proxy have async versions (async_views.py) that are used when the app is served over ASGI
+api = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
@@ -17,13 +23,22 @@ urlpatterns = [
 
     # fetch the map page and its details, also the the geocode using HERE api key
     path('map/', views.map_view, name='map'),
-    path("api/geocode", views.geocode_proxy, name="geocode_proxy"),
+    path("api/geocode", api.geocode_proxy, name="geocode_proxy"),
 
 
     # HERE Map API endpoint urls here
 
     # path for location of donors
-    path("api/donor-locations/", views.donor_locations_api, name="donor_location_api"),
+    path("api/donor-locations/", api.donor_locations_api, name="donor_location_api"),
+
+    # zoom aware, pre-clustered donor counts for the visible part of the map
+    path("api/donor-clusters/", views.donor_clusters_api, name="donor_clusters_api"),
+
+    # hit rate of the cache behind donor-locations (staff only)
+    path("api/donor-locations/cache-stats/", views.region_cache_stats, name="region_cache_stats"),
+
+    # streaming NDJSON/CSV dumps of donors, donation requests and match history (staff only)
+    path("api/export/<str:name>/", views.export_api, name="export_api"),
 
 
     # Django RESTFUL API endpoint urls here
@@ -44,11 +59,14 @@ urlpatterns = [
 
     # fetch a list of all donors (for the donor_list page)
     path("donors/", views.donor_list_page, name="donor_list"),
-    path("api/donors/", views.donor_list_api, name="donor_list_api"),  # For DRF API (within that page)
+    path("api/donors/", api.donor_list_api, name="donor_list_api"),  # For DRF API (within that page)
+
+    # radius search around a point, for emergencies (every available, compatible donor within X km)
+    path("api/donors/nearby/", views.donors_nearby_api, name="donors_nearby_api"),
 
     # paths for active requests and its api path
     path("active-requests/", views.active_requests_page, name="active_requests"),
-    path("api/active-requests/", views.active_requests_api, name="active_requests_api"), # For DRF API (within that page)
+    path("api/active-requests/", api.active_requests_api, name="active_requests_api"), # For DRF API (within that page)
 
     # fetches details about each donor (for the donor_list page)
     path("api/donor/<int:donor_id>/", views.donor_detail, name="donor_detail"),
@@ -69,6 +87,15 @@ urlpatterns = [
     path("cancel_request/<int:request_id>/", views.cancel_request, name="cancel_request"),
 
     # Fetch active donation requests for a user
-    path("api/get_requests/", views.get_requests, name="get_requests"),
+    path("api/get_requests/", api.get_requests, name="get_requests"),
+
+    # everything the own profile page loads (edit_profile, get_requests, get_outgoing_requests and match_donors) in one response
+    path("api/profile_bootstrap/", views.profile_bootstrap, name="profile_bootstrap"),
+
+    # the newest in-app notifications of the user (written by the request fan-out)
+    path("api/get_notifications/", views.get_notifications, name="get_notifications"),
+
+    # live request events for the profile page (server-sent events, only over ASGI)
+    path("api/notifications/", api.notifications, name="notifications"),
 
 ]
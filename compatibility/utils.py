@@ -13,7 +13,105 @@ COMPATIBILITY_CHART = {
     "O-": ["O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"],  # Can donate to everyone
 }
 
+
+# the chart above is compiled once at import into an 8x8 bit matrix, each blood type gets a fixed bit (same order as BLOOD_TYPES in models)
+# and DONOR_MASKS[donor] has the bit of every recipient that donor can give to. Checking a pair is then two dict lookups and an AND,
+# instead of scanning a list every time
+BLOOD_TYPE_ORDER = ("A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-")
+BLOOD_TYPE_BITS = {blood_type: 1 << index for index, blood_type in enumerate(BLOOD_TYPE_ORDER)}
+
+DONOR_MASKS = {
+    donor: sum(BLOOD_TYPE_BITS[recipient] for recipient in set(recipients))
+    for donor, recipients in COMPATIBILITY_CHART.items()
+}
+
+# flattened version of the matrix for the batch api, every compatible (donor, recipient) pair is stored so a whole batch can be checked
+# with a single set membership test per pair (unknown blood types are simply never in the set)
+COMPATIBLE_PAIRS = frozenset(
+    (donor, recipient)
+    for donor in BLOOD_TYPE_ORDER
+    for recipient in BLOOD_TYPE_ORDER
+    if DONOR_MASKS[donor] & BLOOD_TYPE_BITS[recipient]
+)
+
+
+# both directions of the chart, compiled from the same bit matrix so a recipient -> donors lookup can never disagree with a donor -> recipients
+# lookup (there used to be a second, hand written recipient chart in models.py that could drift). The frozensets are for membership checks
+# in python and the tuples are ready to be dropped straight into a blood_type__in filter, always in BLOOD_TYPE_ORDER so the generated SQL is stable
+CAN_DONATE_TO = {
+    donor: frozenset(recipient for recipient in BLOOD_TYPE_ORDER if DONOR_MASKS[donor] & BLOOD_TYPE_BITS[recipient])
+    for donor in BLOOD_TYPE_ORDER
+}
+CAN_RECEIVE_FROM = {
+    recipient: frozenset(donor for donor in BLOOD_TYPE_ORDER if DONOR_MASKS[donor] & BLOOD_TYPE_BITS[recipient])
+    for recipient in BLOOD_TYPE_ORDER
+}
+
+RECIPIENT_TYPES_SQL = {
+    donor: tuple(recipient for recipient in BLOOD_TYPE_ORDER if recipient in CAN_DONATE_TO[donor])
+    for donor in BLOOD_TYPE_ORDER
+}
+DONOR_TYPES_SQL = {
+    recipient: tuple(donor for donor in BLOOD_TYPE_ORDER if donor in CAN_RECEIVE_FROM[recipient])
+    for recipient in BLOOD_TYPE_ORDER
+}
+
+
 def is_compatible(donor_blood, recipient_blood):
     """ Returns True if donor blood is compatible with recipient blood """
 
-    return recipient_blood in COMPATIBILITY_CHART.get(donor_blood, [])
+    # unknown blood types fall back to 0 on either side so they are never compatible
+    return DONOR_MASKS.get(donor_blood, 0) & BLOOD_TYPE_BITS.get(recipient_blood, 0) != 0
+
+
+def are_compatible(donor_bloods, recipient_bloods):
+    """ batch version of is_compatible, takes two equal length sequences of donor and recipient blood types and
+     returns a list of booleans, one per pair """
+
+    if len(donor_bloods) != len(recipient_bloods):
+        raise ValueError("donor_bloods and recipient_bloods must be the same length")
+
+    return list(map(COMPATIBLE_PAIRS.__contains__, zip(donor_bloods, recipient_bloods)))
+
+
+def compatible_donor_types(recipient_blood):
+    """ returns the blood types that can donate to recipient_blood, as a tuple for blood_type__in filters """
+
+    return DONOR_TYPES_SQL.get(recipient_blood, ())
+
+
+def compatible_recipient_types(donor_blood):
+    """ returns the blood types that donor_blood can donate to, as a tuple for blood_type__in filters """
+
+    return RECIPIENT_TYPES_SQL.get(donor_blood, ())
+
+
+def validate_compatibility_index():
+    """ cross checks every structure compiled above against the source chart, returns a list of problems (empty if consistent).
+     Runs at startup through the system check in checks.py """
+
+    problems = []
+
+    if set(COMPATIBILITY_CHART) != set(BLOOD_TYPE_ORDER):
+        problems.append("COMPATIBILITY_CHART does not cover exactly the blood types in BLOOD_TYPE_ORDER")
+
+    for donor in BLOOD_TYPE_ORDER:
+
+        # every blood type can always receive its own type
+        if not is_compatible(donor, donor):
+            problems.append(f"{donor} is not compatible with itself")
+
+        for recipient in BLOOD_TYPE_ORDER:
+            answers = {
+                recipient in COMPATIBILITY_CHART.get(donor, []),
+                is_compatible(donor, recipient),
+                (donor, recipient) in COMPATIBLE_PAIRS,
+                recipient in CAN_DONATE_TO[donor],
+                donor in CAN_RECEIVE_FROM[recipient],
+                recipient in RECIPIENT_TYPES_SQL[donor],
+                donor in DONOR_TYPES_SQL[recipient],
+            }
+            if len(answers) != 1:
+                problems.append(f"compatibility index disagrees with itself for donor {donor} -> recipient {recipient}")
+
+    return problems
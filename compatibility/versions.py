@@ -0,0 +1,114 @@
+# per table change versions for conditional GETs. Every save/delete on a table bumps its TableVersion row (signals.py), so an endpoint can
+# build its ETag / Last-Modified from the versions of the tables it reads with one small query, and answer 304 Not Modified without running its
+# main query or serializer when nothing changed since the client last asked.
+# Queryset .update(), bulk_create and raw SQL dont send signals, code that changes these tables that way has to call bump_version itself.
+
+import hashlib
+
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import TableVersion
+
+
+DONOR = "donor"
+USER = "user"
+DONATION_REQUEST = "donation_request"
+
+
+def bump_version(*tables):
+    """ increments the change version of each table (creating the row the first time a table changes), returns {table: new version} """
+
+    now = timezone.now()
+    versions = {}
+    for table in tables:
+        with transaction.atomic():
+            # the F() increment happens in the database so two processes bumping at the same time both count
+            if not TableVersion.objects.filter(table=table).update(version=F("version") + 1, modified_at=now):
+                try:
+                    # savepoint, so losing the race to create the row doesnt break a surrounding transaction
+                    with transaction.atomic():
+                        TableVersion.objects.create(table=table, version=1, modified_at=now)
+                except IntegrityError:
+                    TableVersion.objects.filter(table=table).update(version=F("version") + 1, modified_at=now)
+
+            # the row stays locked by the increment until the transaction commits, so this reads exactly the version this bump made
+            versions[table] = TableVersion.objects.filter(table=table).values_list("version", flat=True).get()
+
+    return versions
+
+
+def get_versions(request, tables):
+    """ returns {table: (version, modified_at)} for the tables, one query per request (etag and last modified both need it so it is kept on
+     the request). Tables that never changed are (0, None) """
+
+    cached = getattr(request, "_table_versions", None)
+    if cached is None or set(tables) - set(cached):
+        found = {
+            table: (version, modified_at)
+            for table, version, modified_at in TableVersion.objects.filter(table__in=tables).values_list("table", "version", "modified_at")
+        }
+        cached = {table: found.get(table, (0, None)) for table in tables}
+        request._table_versions = cached
+
+    return cached
+
+
+async def aget_versions(request, tables):
+    """ get_versions with the async ORM, for async views. Fills the same per request cache so the etag/last modified functions dont query """
+
+    cached = getattr(request, "_table_versions", None)
+    if cached is None or set(tables) - set(cached):
+        found = {
+            table: (version, modified_at)
+            async for table, version, modified_at in TableVersion.objects.filter(table__in=tables).values_list("table", "version", "modified_at")
+        }
+        cached = {table: found.get(table, (0, None)) for table in tables}
+        request._table_versions = cached
+
+    return cached
+
+
+def versions_etag(request, tables):
+    """ the ETag changes whenever one of the tables does. The Accept header is hashed in too, the browsable api and plain json are different
+     bodies on the same url """
+
+    versions = get_versions(request, tables)
+    key = ";".join(f"{table}={versions[table][0]}" for table in tables)
+    accept = request.META.get("HTTP_ACCEPT", "")
+    return hashlib.md5(f"{key}|{accept}".encode()).hexdigest()
+
+
+def versions_last_modified(request, tables):
+    """ the newest change to any of the tables, HTTP dates only have second precision so clients that send If-None-Match get the exact answer """
+
+    dates = [modified_at for _, modified_at in get_versions(request, tables).values() if modified_at]
+    return max(dates) if dates else None
+
+
+def conditional_on(*tables):
+    """ view decorator, wraps django's condition() with the versions of the tables the view reads. Goes above @api_view so a 304 skips DRF too.
+     Works on async views as well, condition() calls the etag/last modified functions synchronously so the versions are loaded beforehand """
+
+    def decorator(view):
+        conditional = condition(
+            etag_func=lambda request, *args, **kwargs: versions_etag(request, tables),
+            last_modified_func=lambda request, *args, **kwargs: versions_last_modified(request, tables),
+        )(view)
+
+        if not iscoroutinefunction(view):
+            return conditional
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            await aget_versions(request, tables)
+            return await conditional(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
@@ -1,68 +1,56 @@
 import json
-import urllib.parse
-import requests
+import math
 
-from collections import Counter
 from django.core.paginator import Paginator
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db import IntegrityError
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import HttpResponse, HttpResponseRedirect, render, get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views.decorators.csrf import csrf_exempt
-from django.core.cache import cache
-from django.db.models import Q
+from django.views.decorators.http import require_GET
+from django.db.models import Case, Count, Exists, F, Min, OuterRef, Q, When
+from django.db.models.functions import Floor
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from .models import User, DonationRequest, BloodMatchHistory, Donor, COMPATIBILITY_CHART, BLOOD_TYPES
+from .models import User, DonationRequest, BloodMatchHistory, Donor, GeocodeJob, Notification, BLOOD_TYPES
 from .serializers import DonorSerializer, DonationRequestSerializer, UserSerializer, BloodMatchHistorySerializer
-from .utils import is_compatible
+from .serializers import fast_donation_request_data, fast_donor_data, render_json
+from .utils import is_compatible, compatible_donor_types, CAN_RECEIVE_FROM, DONOR_TYPES_SQL
+from .spatial import approx_distance_bound, bounding_box, cluster_cell_degrees, get_donor_grid, haversine_many_km
+from .region_cache import get_region_counts, set_region_counts, cache_stats
+from .versions import DONATION_REQUEST, DONOR, USER, conditional_on
+from .exports import EXPORT_FORMATS, stream_export
+from .locations import country_q, normalize_name, place_q
+from .site_stats import get_site_stats
+from .geocoding import GeocodingError, geocode
+from .geocode_jobs import enqueue_geocode, geocode_status
+from .fanout import enqueue_fanout
 from .forms import UserRegistrationForm, DonorForm
 from django.conf import settings
 
 # HERE API key at global level
 HERE_API_KEY = settings.HERE_API_KEY
 
+# upper bound on how many potential matches match_donors returns per call
+MATCH_DONORS_PAGE_SIZE = 50
 
-def parse_location(location):
-    """
-    Fetch city, state/county, and country from HERE Maps API.
-    Returns city, country, and a formatted location string.
-    """
-    try:
-        response = requests.get(
-            "https://geocode.search.hereapi.com/v1/geocode",
-            params={"q": location, "apiKey": HERE_API_KEY, "lang": "en"},
-        )
-        response.raise_for_status()
-        result = response.json().get("items", [])
-
-        if result:
-            address = result[0]["address"]
-
-            # extract city and country and boroughs for weird american things
-            city = address.get("city", address.get("district", ""))
-            country = address.get("countryName", "")
+# radius search defaults, and the hard caps on the radius and on how many donors donors_nearby_api returns
+NEARBY_DEFAULT_RADIUS_KM = 25
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_DONORS_LIMIT = 100
 
-            # prioritize state but fallback to county (for UK and other regions)
-            state_or_county = address.get("state", address.get("county", ""))
-
-            # formatted location (city, state/county, country)
-            formatted_location = ", ".join(filter(None, [city, state_or_county, country]))
-
-            return {
-                "city": city,
-                "country": country,
-                "location": formatted_location,
-            }
+# candidates per returned donor the radius search takes from the database first. Away from the poles the approximate ordering is off by a
+# few percent at most so the nearest limit donors are nearly always among them, when the error bound says they might not be the search reads
+# the wider window the bound gives (spatial.approx_distance_bound)
+NEARBY_CANDIDATE_FACTOR = 4
 
-    except requests.RequestException as e:
-        print(f"Error parsing location: {e}")
-
-    return {"city": "", "country": "", "location": "Unknown"}
+# recipient -> donors chart for the check_compatibility template, serialized once at import instead of on every page load
+COMPATIBILITY_CHART_JSON = json.dumps(DONOR_TYPES_SQL)
 
 
 def login_view(request):
@@ -86,12 +74,33 @@ def login_view(request):
 
 
 # TODO better donor location HERE Maps API endpoint
+# the aggregates are cached per (blood_type, location) filter in region_cache.py, keyed on the donor and user table versions,
+# and a client that already has the current aggregates gets a 304 (versions.py)
+@require_GET
+@conditional_on(DONOR, USER)
 def donor_locations_api(request):
 
     # getting the request params and stripping them
     blood_type = request.GET.get("blood_type", "").strip()
     location = request.GET.get("location", "").strip()
 
+    key, response_data = get_region_counts(request, blood_type, location)
+    if response_data is None:
+        response_data = count_donor_regions(blood_type, location)
+        set_region_counts(key, response_data)
+
+    return JsonResponse(response_data, safe=False)
+
+
+def count_donor_regions(blood_type, location):
+    """ counts available donors per region (and per blood type inside each region) for the map """
+
+    return merge_region_groups(donor_region_groups(blood_type, location))
+
+
+def donor_region_groups(blood_type, location):
+    """ the GROUP BY query behind count_donor_regions, one row per (region, blood type) """
+
     # using Q object to create complex queries with OR and AND conditions (allows to combine multiple conditions in a query,
     # and to filter results where either one condition or another is true)
     filters = Q(user__is_active=True, availability=True)
@@ -99,36 +108,40 @@ def donor_locations_api(request):
     if blood_type:
         filters &= Q(blood_type=blood_type)
 
+    # a city, region or country (name or ISO code), matched through the indexed Location keys
     if location:
-        filters &= (
-            Q(city__icontains=location) |
-            Q(state_or_county__icontains=location) |
-            Q(country__icontains=location)
-        )
+        filters &= place_q(location)
 
-    donors = Donor.objects.filter(filters).values(
+    # the counting is done by the database, one row per (region, blood type) group instead of one row per donor. first_id (the lowest donor id
+    # in the group) keeps the regions and the tied blood types in the same order as when the donors were counted one by one in python
+    return Donor.objects.filter(filters).values(
         'city', 'state_or_county', 'country', 'blood_type'
-    )
+    ).annotate(donor_count=Count('id'), first_id=Min('id')).order_by()
+
 
-    # from HERE Maps API we are getting the region data in a dict format so we use a dict here as well
+def merge_region_groups(groups):
+    """ the map response data from the donor_region_groups rows """
+
+    # from HERE Maps API we are getting the region data in a dict format so we use a dict here as well, different raw values can still end
+    # up as the same region string (None vs empty state for example) so groups are merged by that string
     region_data = {}
 
-    # iterating over donor objects to filter out city, state/county and country from the model feilds
-    for donor in donors:
-        region_key = ", ".join(filter(None, [donor['city'], donor['state_or_county'], donor['country']]))
+    for group in groups:
+        region_key = ", ".join(filter(None, [group['city'], group['state_or_county'], group['country']]))
 
-        if region_key not in region_data:
-            region_data[region_key] = {"count": 0, "blood_counts": Counter()}
+        region = region_data.setdefault(region_key, {"count": 0, "first_id": group["first_id"], "blood_counts": {}})
+        region["count"] += group["donor_count"]
+        region["first_id"] = min(region["first_id"], group["first_id"])
 
-        region_data[region_key]["count"] += 1
-        region_data[region_key]["blood_counts"][donor["blood_type"]] += 1
+        count, first_id = region["blood_counts"].get(group["blood_type"], (0, group["first_id"]))
+        region["blood_counts"][group["blood_type"]] = (count + group["donor_count"], min(first_id, group["first_id"]))
 
     # the response data is being returned as a list, and the lambda keyword is used to create a small anonymous function, which is a value to the key
-    # in how we sort the blood types
+    # in how we sort the blood types (most donors first, ties in the order they were first seen)
     response_data = []
-    for region, data in region_data.items():
-        sorted_blood_types = sorted(data["blood_counts"].items(), key=lambda x: -x[1])
-        blood_type_str = ", ".join([f"{bt} {count}" for bt, count in sorted_blood_types])
+    for region, data in sorted(region_data.items(), key=lambda item: item[1]["first_id"]):
+        sorted_blood_types = sorted(data["blood_counts"].items(), key=lambda x: (-x[1][0], x[1][1]))
+        blood_type_str = ", ".join([f"{bt} {count}" for bt, (count, _) in sorted_blood_types])
 
         response_data.append({
             "region": region,
@@ -136,7 +149,98 @@ def donor_locations_api(request):
             "blood_types": blood_type_str
         })
 
-    return JsonResponse(response_data, safe=False)
+    return response_data
+
+
+# Server side clustering for the map, /api/donor-clusters/?south=&west=&north=&east=&zoom=(&blood_type=)
+# Donors inside the viewport are grouped into a grid whose cells halve with every zoom level, the grouping runs in the database and only
+# one row per (cell, blood type) comes back, so the payload depends on what is on screen and not on how many donors there are in total.
+# Clusters are placed at the cell centre, never at the donors own coordinates
+def donor_clusters_api(request):
+    """ returns pre-clustered donor counts (with per blood type counts) for the visible part of the map """
+
+    try:
+        south, west = float(request.GET["south"]), float(request.GET["west"])
+        north, east = float(request.GET["north"]), float(request.GET["east"])
+        zoom = int(request.GET.get("zoom", 0))
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "south, west, north and east are required, zoom must be a whole number."}, status=400)
+
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        return JsonResponse({"error": "Invalid bounding box."}, status=400)
+
+    cell = cluster_cell_degrees(zoom, south, west, north, east)
+
+    donors = Donor.objects.filter(availability=True, user__is_active=True, latitude__range=(south, north))
+    if west <= east:
+        donors = donors.filter(longitude__range=(west, east))
+    else:
+        # viewport crosses the antimeridian
+        donors = donors.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+
+    blood_type = request.GET.get("blood_type", "").replace(" ", "+").strip()
+    if blood_type:
+        donors = donors.filter(blood_type=blood_type)
+
+    groups = donors.annotate(
+        cell_row=Floor((F("latitude") + 90) / cell),
+        cell_col=Floor((F("longitude") + 180) / cell),
+    ).values("cell_row", "cell_col", "blood_type").annotate(donor_count=Count("id")).order_by()
+
+    clusters = {}
+    for group in groups:
+        cell_row, cell_col = int(group["cell_row"]), int(group["cell_col"])
+
+        cluster = clusters.setdefault((cell_row, cell_col), {
+            "lat": round(min(-90 + (cell_row + 0.5) * cell, 90), 6),
+            "lng": round((-180 + (cell_col + 0.5) * cell + 180) % 360 - 180, 6),
+            "count": 0,
+            "blood_types": {},
+        })
+        cluster["count"] += group["donor_count"]
+        cluster["blood_types"][group["blood_type"]] = group["donor_count"]
+
+    return JsonResponse({
+        "cell_degrees": cell,
+        "clusters": sorted(clusters.values(), key=lambda cluster: -cluster["count"]),
+    })
+
+
+# hit/miss counters of the map region cache, staff only
+@login_required
+def region_cache_stats(request):
+    """ returns the hit and miss counters of the donor_locations_api cache """
+
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can view cache statistics."}, status=403)
+
+    return JsonResponse(cache_stats())
+
+
+# full dumps for ops and the regional blood services, /api/export/<donors|donation_requests|match_history>/?format=ndjson|csv&blood_type=&status=&country=
+# streamed chunk by chunk (exports.py) so millions of rows never sit in memory, staff only since it has every donors email
+@login_required
+def export_api(request, name):
+    """ streams an export as NDJSON (default) or CSV """
+
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can export data."}, status=403)
+
+    file_format = request.GET.get("format", "ndjson")
+
+    try:
+        chunks = stream_export(
+            name, file_format,
+            blood_type=request.GET.get("blood_type", "").replace(" ", "+").strip() or None,
+            status=request.GET.get("status", "").strip() or None,
+            country=request.GET.get("country", "").strip() or None,
+        )
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[file_format])
+    response["Content-Disposition"] = f'attachment; filename="{name}.{file_format}"'
+    return response
 
 
 def logout_view(request):
@@ -177,6 +281,10 @@ def register(request):
                 donor.update_location(state_or_county)
                 donor.save()
 
+                # the form has no coordinates, the geocode worker fills them in (and tidies the names) from the city/state/country
+                if donor.city or donor.country:
+                    enqueue_geocode(donor, ", ".join(filter(None, [donor.city, donor.state_or_county, donor.country])))
+
             login(request, user)
             return redirect("index")
 
@@ -211,16 +319,7 @@ def edit_profile(request):
 
     # pass json data if GET request for the edit profile page
     if request.method == "GET":
-        return JsonResponse({
-            "username": user.username,
-            "email": user.email,
-            "blood_type": donor_profile.blood_type if donor_profile else None,
-            "location": donor_profile.location if donor_profile else None,
-            "city": donor_profile.city if donor_profile else None,
-            "state_or_county": donor_profile.state_or_county if donor_profile else None,
-            "country": donor_profile.country if donor_profile else None,
-            "blood_types": BLOOD_TYPES,
-        })
+        return JsonResponse(edit_profile_data(user, donor_profile, geocode_status(donor_profile) if donor_profile else None))
 
     # if post, check if the changed data is valid, then return new response
     elif request.method == "POST":
@@ -241,34 +340,12 @@ def edit_profile(request):
         user.username = new_username
         user.save()
 
-        # handle new location
-        if new_location:
-            location_data = parse_location(new_location)
-
-            print("Before update - Location:", donor_profile.location)
-            print("Before update - City:", donor_profile.city)
-            print("Before update - Country:", donor_profile.country)
-
-            # assign new values
-            donor_profile.city = location_data["city"]
-            donor_profile.country = location_data["country"]
-            state_or_county = location_data.get("state_or_county", None)
-
-            # save the correctly formatted location
-            donor_profile.location = location_data["location"]
-
-            # explicitly assign state/county
-            if state_or_county:
-                donor_profile.state_or_county = state_or_county
-
-            print("After assignment - Location:", donor_profile.location)
-            print("After assignment - City:", donor_profile.city)
-            print("After assignment - Country:", donor_profile.country)
-
-            # save changes
+        # handle new location, the raw text is saved right away and the geocode (city, state/county, country, coordinates) runs in the
+        # background worker (geocode_jobs.py) so a slow HERE never holds up the request. The page polls geocode_status on GET
+        if new_location and donor_profile:
+            donor_profile.location = new_location
             donor_profile.save()
-
-            print("After save - Location:", donor_profile.location)
+            enqueue_geocode(donor_profile, new_location)
 
         # new data response
         return JsonResponse({
@@ -279,6 +356,7 @@ def edit_profile(request):
             "city": donor_profile.city,
             "state_or_county": donor_profile.state_or_county,
             "country": str(donor_profile.country),  # ensure country is a string
+            "geocode_status": geocode_status(donor_profile),
         })
 
     # letting the user delete the profile
@@ -290,17 +368,70 @@ def edit_profile(request):
 
 
 
+def edit_profile_data(user, donor_profile, location_status):
+    """ the edit_profile GET json, location_status is the status of the donors geocode job """
+
+    return {
+        "username": user.username,
+        "email": user.email,
+        "blood_type": donor_profile.blood_type if donor_profile else None,
+        "location": donor_profile.location if donor_profile else None,
+        "city": donor_profile.city if donor_profile else None,
+        "state_or_county": donor_profile.state_or_county if donor_profile else None,
+        "country": donor_profile.country if donor_profile else None,
+        "geocode_status": location_status,
+        "blood_types": BLOOD_TYPES,
+    }
+
+
+
 # Function for fetching donors for HERE map API (on the donor_list page)
+# Paginated with a keyset cursor on the donor id: every page is "the next page_size donors with an id above the cursor", which is one indexed
+# range scan, so page 1000 costs the same as page 1 (an offset would make the database walk past every earlier row first)
+@conditional_on(DONOR, USER)
 @api_view(["GET"])
 def donor_list_api(request):
-    """ Returns JSON response with all available donors (filtered by blood type & country) """
+    """ Returns JSON response with a page of available donors (filtered by blood type & country), plus the cursor of the next page """
+
+    try:
+        page, page_size = donor_list_page_query(request.GET)
+    except ValueError:
+        return Response({"error": "Invalid page_size, start/end or cursor."}, status=400)
+
+    if wants_fast_json(request):
+        donor_data = fast_donor_data(page)
+        next_cursor = encode_cursor(donor_data[page_size - 1]["id"]) if len(donor_data) > page_size else None
+        return HttpResponse(render_json({"donors": donor_data[:page_size], "next_cursor": next_cursor}), content_type="application/json")
+
+    page = list(page)
+    next_cursor = encode_cursor(page[page_size - 1].id) if len(page) > page_size else None
+
+    donor_serializer = DonorSerializer(page[:page_size], many=True)
+
+    return Response({"donors": donor_serializer.data, "next_cursor": next_cursor})
+
+
+def donor_list_page_query(params):
+    """ the query of one donor_list_api page, with one extra row to tell if there is a next page, and the page size. Raises ValueError for
+     a malformed page_size, start/end or cursor """
 
     # getting the data for the blood type and if the blood_type string contains spaces, they will be replaced with + this ie because spaces
     # tend to break the accuracy of the blood type
-    blood_type = request.GET.get("blood_type", "").replace(" ", "+")
+    blood_type = params.get("blood_type", "").replace(" ", "+")
     # removes any leading and trailing whitespace from the country string. If the country string is empty or only contains spaces,
     # strip will return an empty string
-    country = request.GET.get("country", "").strip()
+    country = params.get("country", "").strip()
+
+    # page size from page_size, or from the start/end range older clients send, always capped
+    if "page_size" in params:
+        page_size = int(params["page_size"])
+    elif "start" in params and "end" in params:
+        page_size = int(params["end"]) - int(params["start"]) + 1
+    else:
+        page_size = settings.DONOR_LIST_PAGE_SIZE
+    after_id = decode_cursor(params.get("cursor"))
+
+    page_size = min(max(page_size, 1), settings.DONOR_LIST_MAX_PAGE_SIZE)
 
     # select only donors that have checked the availability box ie, agreed to be a donor
     donors = Donor.objects.filter(availability=True).select_related("user")
@@ -308,35 +439,186 @@ def donor_list_api(request):
     if blood_type:
         donors = donors.filter(blood_type=blood_type)
     if country:
-        donors = donors.filter(country__iexact=country)
+        donors = donors.filter(country_q(country))
+    if after_id is not None:
+        donors = donors.filter(id__gt=after_id)
+
+    # one extra row tells us if there is a next page without a separate count query
+    page = donors.order_by("id")[:page_size + 1]
+
+    return page, page_size
+
+
+def wants_fast_json(request):
+    """ the fast serialization path (serializers.py) is opt-in with settings.FAST_JSON_SERIALIZATION, and only used when the client gets plain
+     compact JSON, the browsable api and ?format=json with an indent still go through DRF """
+
+    return (
+        settings.FAST_JSON_SERIALIZATION
+        and request.accepted_renderer.format == "json"
+        and "indent" not in (request.accepted_media_type or "")
+    )
+
+
+def encode_cursor(last_id):
+    """ opaque cursor token for the page after the donor with this id """
+
+    return urlsafe_base64_encode(str(last_id).encode())
+
+
+def decode_cursor(cursor):
+    """ returns the donor id a cursor points after (None for the first page), raises ValueError for a malformed cursor """
 
-    donor_serializer = DonorSerializer(donors, many=True)
+    if not cursor:
+        return None
+    return int(urlsafe_base64_decode(cursor).decode())
 
-    return Response({"donors": donor_serializer.data})
 
 
+def nearest_in_range(lat, lng, radius_km, candidates):
+    """ (exact distance, donor id) of the (id, lat, lng, approx distance) candidates that are within radius_km, nearest first """
 
+    distances = haversine_many_km(lat, lng, [row[1] for row in candidates], [row[2] for row in candidates])
+    return sorted((distance, row[0]) for distance, row in zip(distances, candidates) if distance <= radius_km)
+
+
+# Radius search for emergencies ("every available O- donor within 25 km"), /api/donors/nearby/?lat=&lng=&radius_km=&blood_type=&match=
+# First an indexed bounding box query narrows the candidates down, the database orders them by an approximate distance (squared degrees, the
+# longitude scaled to the latitude) and hands back only the nearest limit * NEARBY_CANDIDATE_FACTOR (id, lat, lng) rows. The exact distance
+# then runs over those in one pass. The approximation can order a nearer donor after the candidates (most of all near the poles, where the
+# longitude scale changes fast), so if the error bound of the limit-th exact distance reaches past the last candidate every donor inside that
+# bound is read instead. Only the nearest limit donors are loaded in full, so a dense city costs a bounded amount of python work and transfer
+# however many donors are inside the box
+@api_view(["GET"])
+def donors_nearby_api(request):
+    """ Returns JSON response with available donors within radius_km of a point, nearest first. match=compatible (default) returns every donor
+     that can give to blood_type, match=exact only donors of exactly that blood type """
+
+    try:
+        lat = float(request.GET["lat"])
+        lng = float(request.GET["lng"])
+        radius_km = float(request.GET.get("radius_km", NEARBY_DEFAULT_RADIUS_KM))
+        limit = min(max(int(request.GET.get("limit", NEARBY_DONORS_LIMIT)), 1), NEARBY_DONORS_LIMIT)
+    except (KeyError, ValueError):
+        return Response({"error": "lat and lng are required, and lat, lng, radius_km and limit must be numbers."}, status=400)
+
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+        return Response({"error": f"lat/lng out of range or radius_km not between 0 and {NEARBY_MAX_RADIUS_KM}."}, status=400)
+
+    # same blood type clean up as donor_list_api, spaces come from unencoded + signs
+    blood_type = request.GET.get("blood_type", "").replace(" ", "+").strip()
+    match = request.GET.get("match", "compatible")
+
+    donors = Donor.objects.filter(availability=True, user__is_active=True)
+    if blood_type:
+        if match == "exact":
+            donors = donors.filter(blood_type=blood_type)
+        elif match == "compatible":
+            donors = donors.filter(blood_type__in=compatible_donor_types(blood_type))
+        else:
+            return Response({"error": "match must be 'compatible' or 'exact'."}, status=400)
+
+    # step 1, bounding box prefilter on the (latitude, longitude) index
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    donors = donors.filter(latitude__range=(min_lat, max_lat))
+    if min_lng is not None and min_lng <= max_lng:
+        donors = donors.filter(longitude__range=(min_lng, max_lng))
+    elif min_lng is not None:
+        # the box wraps around the antimeridian
+        donors = donors.filter(Q(longitude__gte=min_lng) | Q(longitude__lte=max_lng))
+    else:
+        donors = donors.filter(longitude__isnull=False)
+
+    # step 2, the nearest candidates by approximate distance, the longitude difference taken the short way round the antimeridian
+    lng_delta = Case(
+        When(longitude__gt=lng + 180, then=F("longitude") - (lng + 360)),
+        When(longitude__lt=lng - 180, then=F("longitude") - (lng - 360)),
+        default=F("longitude") - lng,
+    )
+    lng_scale = math.cos(math.radians(lat)) ** 2
+    donors = donors.annotate(
+        approx_distance=(F("latitude") - lat) * (F("latitude") - lat) + lng_delta * lng_delta * lng_scale,
+    ).order_by("approx_distance", "id")
+
+    candidate_limit = limit * NEARBY_CANDIDATE_FACTOR
+    candidates = list(donors.values_list("id", "latitude", "longitude", "approx_distance")[:candidate_limit])
+
+    # step 3, exact distances over the candidates in one pass
+    in_range = nearest_in_range(lat, lng, radius_km, candidates)
+
+    # every donor in the box was read, or the approximate distance of any donor that could be nearer than the limit-th one is bounded,
+    # and the donors past the candidates are at least as far as the last one by it
+    radius_window = approx_distance_bound(lat, radius_km)
+    read_up_to = candidates[-1][3] if len(candidates) == candidate_limit else None
+    if read_up_to is not None:
+        window = approx_distance_bound(lat, in_range[limit - 1][0] if len(in_range) >= limit else radius_km)
+        if read_up_to <= window:
+            candidates = list(donors.filter(approx_distance__lte=window).values_list("id", "latitude", "longitude", "approx_distance"))
+            in_range = nearest_in_range(lat, lng, radius_km, candidates)
+            read_up_to = window if window < radius_window else None
+
+    # more donors in range than returned, or not every donor the radius allows was read so there may be more past them
+    truncated = len(in_range) > limit or (read_up_to is not None and read_up_to <= radius_window)
+    in_range = in_range[:limit]
+
+    # only the donors that are actually returned get loaded, with the user columns joined in (same shape as DonorSerializer)
+    rows = Donor.objects.filter(id__in=[donor_id for _, donor_id in in_range]).values(
+        "id", "blood_type", "availability", "location", "city", "country", "user_id", "user__username", "user__email",
+    )
+    rows_by_id = {row["id"]: row for row in rows}
+
+    results = []
+    for distance, donor_id in in_range:
+        row = rows_by_id[donor_id]
+        results.append({
+            "id": row["id"],
+            "blood_type": row["blood_type"],
+            "availability": row["availability"],
+            "user": {"id": row["user_id"], "username": row["user__username"], "email": row["user__email"]},
+            "location": row["location"],
+            "city": row["city"],
+            "country": row["country"],
+            "distance_km": round(distance),
+        })
+
+    return Response({"donors": results, "count": len(results), "truncated": truncated})
+
+
+
+# polled by the active requests page, unchanged requests/donors/users give a 304 without running the query (versions.py)
+@conditional_on(DONATION_REQUEST, DONOR, USER)
 @api_view(["GET"])
 def active_requests_api(request):
     """ Returns JSON response with active donation requests, filtered by blood type and country if provided """
 
+    active_requests = active_requests_query(request.GET)
+
+    if wants_fast_json(request):
+        return HttpResponse(render_json({"active_requests": fast_donation_request_data(active_requests)}), content_type="application/json")
+
+    # serialize results, with the accepted donors of every request prefetched in one query
+    request_serializer = DonationRequestSerializer(DonationRequestSerializer.setup_eager_loading(active_requests), many=True)
+
+    return Response({"active_requests": request_serializer.data})
+
+
+def active_requests_query(params):
+    """ the pending and accepted requests, filtered by the blood_type and country params """
+
     # get the filter values from request parameters by stripping any whitespace
-    blood_type = request.GET.get("blood_type", "").strip()
-    country = request.GET.get("country", "").strip()
+    blood_type = params.get("blood_type", "").strip()
+    country = params.get("country", "").strip()
 
-    # base queryset (only pending or matched requests)
-    active_requests = DonationRequest.objects.filter(status__in=["Pending", "Matched"]).select_related("requester")
+    # base queryset (only pending or accepted requests)
+    active_requests = DonationRequest.objects.filter(status__in=["Pending", "Accepted"]).select_related("requester")
 
-    # apply filters if provided, only using strip method on country as it is freely typed and not selected from a set value
+    # apply filters if provided, the country (name or ISO code) is matched through the indexed Location of the request
     if blood_type:
         active_requests = active_requests.filter(blood_type_needed=blood_type)
     if country:
-        active_requests = active_requests.filter(country__iexact=country.strip())
-
-    # serialize results
-    request_serializer = DonationRequestSerializer(active_requests, many=True)
+        active_requests = active_requests.filter(country_q(country))
 
-    return Response({"active_requests": request_serializer.data})
+    return active_requests
 
 
 
@@ -346,7 +628,7 @@ def active_requests_page(request):
     """ Renders the active requests page with filtering options """
 
     # fetch active donation requests
-    active_requests = DonationRequest.objects.filter(status__in=["Pending", "Matched"]).select_related("requester")
+    active_requests = DonationRequest.objects.filter(status__in=["Pending", "Accepted"]).select_related("requester")
 
     # ensure blood_types (list of tuples in models.py) is available in the template
     blood_types = BLOOD_TYPES
@@ -389,7 +671,7 @@ def donor_list_page(request):
     if blood_type_filter:
         donors = donors.filter(blood_type=blood_type_filter)
     if country_filter:
-        donors = donors.filter(country__iexact=country_filter)
+        donors = donors.filter(country_q(country_filter))
 
     return render(request, "compatibility/donor_list.html", {
         "donors": donors,
@@ -418,10 +700,11 @@ def donation_history(request):
         donation_requests = donation_requests.filter(blood_type_needed=blood_type_filter)
     if status_filter:
         donation_requests = donation_requests.filter(status=status_filter)
+    # city and country go through the indexed Location of the request (case insensitive, country by name or ISO code)
     if city_filter:
-        donation_requests = donation_requests.filter(city__icontains=city_filter)
+        donation_requests = donation_requests.filter(place__city_key=normalize_name(city_filter))
     if country_filter:
-        donation_requests = donation_requests.filter(country__icontains=country_filter)
+        donation_requests = donation_requests.filter(country_q(country_filter))
 
 
     # pagination (10 requests per page)
@@ -468,25 +751,24 @@ def create_donor_request(request, recipient_id):
         if current_user == recipient:
             return JsonResponse({"error": "Cannot request a donation from yourself"}, status=400)
 
-        # check if a request already exists
-        existing_request = DonationRequest.objects.filter(
-            recipient=recipient,
-            donors=request.user.donor_profile,
-            status='Pending').exists()
-
-        if existing_request:
+        # create the request for donation, select the relevant fields form the DonationRequest model. A second pending request to the same
+        # donor is refused by the unique_pending_request constraint, so two parallel clicks cant both create one (a check before the create could)
+        try:
+            with transaction.atomic():
+                donation_request = DonationRequest.objects.create(
+                    recipient=recipient,
+                    blood_type_needed=current_user.donor_profile.blood_type,
+                    location=current_user.donor_profile.location,
+                    status='Pending',
+                    requester=request.user
+                )
+                donation_request.donors.add(current_user.donor_profile)
+
+                # every other compatible donor nearby is told by the fan-out worker (fanout.py), the response doesnt wait for it
+                enqueue_fanout(donation_request)
+        except IntegrityError:
             return JsonResponse({"error": "You have already requested from this donor"}, status=400)
 
-        # create the request for donation, select the relevant fields form the DonationRequest model
-        donation_request = DonationRequest.objects.create(
-            recipient=recipient,
-            blood_type_needed=current_user.donor_profile.blood_type,
-            location=current_user.donor_profile.location,
-            status='Pending',
-            requester=request.user
-        )
-        donation_request.donors.add(current_user.donor_profile)
-
         return JsonResponse({"message": "Request Sent."})
 
     return JsonResponse({"error": "Invalid request method."}, status=405)
@@ -508,16 +790,15 @@ def manage_donor_request(request, request_id):
         data = json.loads(request.body)
         action = data.get("action")
 
-        # accept request
+        # accept or reject, both only work once on a pending request (the loser of two parallel clicks gets a 409)
         if action == "accept":
-            for donor in donation_request.donors.all():
-                donation_request.accept_request(donor)
-
+            if not donation_request.accept():
+                return JsonResponse({"error": "This request is no longer pending."}, status=409)
             return JsonResponse({"message": "Request accepted."})
 
-        # reject request
         if action == "reject":
-            donation_request.delete()
+            if not donation_request.reject():
+                return JsonResponse({"error": "This request is no longer pending."}, status=409)
             return JsonResponse({"message": "Request rejected."})
 
         return JsonResponse({"error": "Invalid action."}, status=400)
@@ -530,26 +811,16 @@ def manage_donor_request(request, request_id):
 def index(request):
     """ homepage function where the user can see what the web-app is about and passing the statistic data """
 
-    # get the donor count
-    total_donors = Donor.objects.count()
-
     # Fetch the latest donation requests (limit to last 5) by date of creation, and limit query to 6 using slicing
     recent_donations = DonationRequest.objects.order_by("-created_at")[:6]
 
-    # from the donor model use the country, city and state field to get the count of users registered therein to display on index.html
-    # use distinct() in django to get the required field data then we cna count all we need
-    total_countries = Donor.objects.values("country").distinct().count()
-    total_cities = Donor.objects.values("city").distinct().count()
-    total_states_or_counties = Donor.objects.values("state_or_county").distinct().count()
-    total_blood_types = Donor.objects.values("blood_type").distinct().count()
+    # total donors and the number of distinct countries, cities, states/counties and blood types, read from the rollup row that the donor signals
+    # keep up to date (site_stats.py) instead of counting the whole donor table on every homepage hit
+    stats = get_site_stats()
 
     return render(request, "compatibility/index.html", {
-        "total_donors": total_donors,
         "recent_donations": recent_donations,
-        "total_countries": total_countries,
-        "total_cities": total_cities,
-        "total_states_or_counties": total_states_or_counties,
-        "total_blood_types": total_blood_types,
+        **stats,
     })
 
 
@@ -563,6 +834,9 @@ def about(request):
 # Finds compatible donors for a recipient based on blood type and location, the system will fetch eligible donors using a compatibility algorithm
 # is designed to find compatible donors for a recipient, and it returns the data as JSON.
 # This is used for the match donors api endpoint on the user_profile.html template
+# The whole thing runs as two queries no matter how many donors there are, the compatibility filter is pushed into SQL with the precomputed
+# blood_type__in tuple and the user columns come from the same join, and potential matches are returned in bounded pages (?offset=&limit=)
+# With ?sort=distance potential matches come from the spatial grid instead, nearest first
 @login_required
 def match_donors(request):
     """ Find and return both accepted and potential matches for the logged-in user """
@@ -576,50 +850,121 @@ def match_donors(request):
     # get the current users blood type
     user_blood_type = user.donor_profile.blood_type
 
-    # get all donation requests where the user is the recipient
-    donation_requests = DonationRequest.objects.filter(recipient=user)
+    # page bounds for potential matches, limit is capped so one call can never pull the whole donor table
+    try:
+        offset = max(int(request.GET.get("offset", 0)), 0)
+        limit = min(max(int(request.GET.get("limit", MATCH_DONORS_PAGE_SIZE)), 1), MATCH_DONORS_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({"error": "offset and limit must be integers."}, status=400)
 
-    # collect accepted matches from existing donation requests
-    matches = [
+    # accepted matches are only sent with the first page so pages never repeat them
+    matches = accepted_match_data(accepted_match_rows(user)) if offset == 0 else []
+
+    # rank potential matches by distance (?sort=distance) from ?lat=&lng= or the users own coordinates, using the spatial grid in spatial.py
+    # which only holds available donors that have coordinates
+    if request.GET.get("sort") == "distance":
+        try:
+            lat = float(request.GET.get("lat", user.donor_profile.latitude))
+            lng = float(request.GET.get("lng", user.donor_profile.longitude))
+        except (TypeError, ValueError):
+            return JsonResponse({"error": "A location (lat and lng) is needed to sort matches by distance."}, status=400)
+
+        nearest = get_donor_grid().nearest(
+            lat, lng, offset + limit + 1,
+            blood_types=CAN_RECEIVE_FROM.get(user_blood_type, frozenset()),
+            exclude_user_id=user.id,
+        )[offset:]
+        has_more = len(nearest) > limit
+        nearest = nearest[:limit]
+
+        # one query for the user columns of the whole page
+        usernames = {
+            user_id: (username, email)
+            for user_id, username, email in User.objects.filter(id__in=[row[1] for _, row in nearest]).values_list("id", "username", "email")
+        }
+
+        matches.extend([
+            {
+                "username": usernames[row[1]][0],
+                "blood_type": row[2],
+                "email": usernames[row[1]][1],
+                "location": "Hidden until accepted",
+                "is_accepted": False,
+                "id": row[1],
+                "distance_km": round(distance),
+            }
+            for distance, row in nearest
+            if row[1] in usernames
+        ])
+
+        return JsonResponse({
+            "matches": matches,
+            "next_offset": offset + limit if has_more else None,
+        }, status=200)
+
+    potential, has_more = potential_match_data(user, user_blood_type, offset, limit)
+    matches.extend(potential)
+
+    return JsonResponse({
+        "matches": matches,
+        "next_offset": offset + limit if has_more else None,
+    }, status=200)
+
+
+def accepted_match_rows(user):
+    """ one row per (request, accepted donor) pair of the requests the user received, read straight from the through table with the donor,
+     user and request columns joined in """
+
+    return list(
+        DonationRequest.accepted_donors.through.objects.filter(
+            donationrequest__recipient=user
+        ).order_by("donationrequest_id", "donor_id").values_list(
+            "donor__user__username", "donor__blood_type", "donor__user__email", "donor__location",
+            "donationrequest__is_accepted", "donor__user_id",
+        )
+    )
+
+
+def accepted_match_data(accepted_rows):
+    """ the match_donors json of the accepted matches """
+
+    return [
         {
-            "username": donor.user.username,
-            "blood_type": donor.blood_type,
-            "email": donor.user.email,
-            "location": donor.location if donor.location and donation_request.is_accepted else "Hidden until accepted",
+            "username": username,
+            "blood_type": blood_type,
+            "email": email,
+            "location": location if location and request_is_accepted else "Hidden until accepted",
             "is_accepted": True,
-            "id": donor.user.id,
+            "id": user_id,
         }
-        for donation_request in donation_requests
-        for donor in donation_request.accepted_donors.all()
+        for username, blood_type, email, location, request_is_accepted, user_id in accepted_rows
     ]
 
-    # gather IDs of all donors already involved in requests (accepted or pending)
-    requested_donor_ids = {
-        donor.id
-        for donation_request in donation_requests
-        for donor in donation_request.donors.all()
-    }
 
-    # find new potential donors who are compatible but not in the request history
-    potential_donors = Donor.objects.exclude(user=user)
-    compatible_potential_donors = [
-        donor for donor in potential_donors if is_compatible(donor.blood_type, user_blood_type)
-    ]
+def potential_match_data(user, user_blood_type, offset, limit):
+    """ the match_donors json of a page of potential matches, plus whether there is a next page """
+
+    # find new potential donors who are compatible, filtering by blood type in the database (fetching one extra row to know if there is a next page)
+    potential_rows = list(
+        Donor.objects.exclude(user=user)
+        .filter(blood_type__in=compatible_donor_types(user_blood_type))
+        .order_by("id")
+        .values_list("user__username", "blood_type", "user__email", "user_id")[offset:offset + limit + 1]
+    )
 
-    # add potential matches to the list by extending the matches list (always hide location until accepted)
-    matches.extend([
+    # always hide location until accepted
+    matches = [
         {
-            "username": donor.user.username,
-            "blood_type": donor.blood_type,
-            "email": donor.user.email,
+            "username": username,
+            "blood_type": blood_type,
+            "email": email,
             "location": "Hidden until accepted",
             "is_accepted": False,
-            "id": donor.user.id,  # use user.id instead of donor.id to avoid referencing wrong IDs as Users and Donors have separate IDs
+            "id": user_id,  # use user.id instead of donor.id to avoid referencing wrong IDs as Users and Donors have separate IDs
         }
-        for donor in compatible_potential_donors
-    ])
-
-    return JsonResponse({"matches": matches}, status=200)
+        for username, blood_type, email, user_id in potential_rows[:limit]
+    ]
+    return matches, len(potential_rows) > limit
 
 
 
@@ -636,13 +981,18 @@ def accept_request(request, request_id):
         except Donor.DoesNotExist:
             return JsonResponse({"error": "Please register as a donor to accept this request"}, status=403)
 
-        # check if donor is eligible to accept ie, checking via the COMPATIBILITY_CHART in models, to verify compatibility bw request and donor
-        if donor not in donation_request.find_potential_donors():
+        # check if donor is eligible to accept ie, checking via the compatibility index in utils, to verify compatibility bw request and donor
+        # (just the two blood types, no need to load every compatible donor)
+        if not donation_request.can_be_donated_by(donor):
             return JsonResponse({
                 "error": "You are not eligible to accept this request as the blood types are not mutually compatible. "}, status=403)
 
+        if not donation_request.has_donor(donor):
+            return JsonResponse({"error": "You are not a donor on this request."}, status=403)
+
         # accept the request and update the status
-        donation_request.accept_request(donor)
+        if not donation_request.accept([donor]):
+            return JsonResponse({"error": "This request can no longer be accepted."}, status=409)
 
         return JsonResponse({
             "message": "request accepted",
@@ -662,14 +1012,22 @@ def get_requests(request):
     if not hasattr(current_user, "donor_profile"):
         return JsonResponse({"error": "You must be a registered donor to view requests."}, status=400)
 
-    # fetch pending requests where the current logged-in user is the recipient
-    pending_requests = DonationRequest.objects.filter(
-        recipient=current_user,
+    return JsonResponse({"requests": received_request_data(received_requests(current_user))})
+
+
+def received_requests(user):
+    """ pending requests where the user is the recipient """
+
+    return DonationRequest.objects.filter(
+        recipient=user,
         status="Pending",
     ).select_related("requester", "recipient")
 
-    # prepare JSON response
-    requests_data = [{
+
+def received_request_data(pending_requests):
+    """ the get_requests json for each request """
+
+    return [{
         "id": req.id,
         "requester_username": req.requester.username,
         "blood_type_needed": req.blood_type_needed,
@@ -677,24 +1035,55 @@ def get_requests(request):
         "recipient": req.recipient.id,
     } for req in pending_requests]
 
-    return JsonResponse({"requests": requests_data})
-
 
 @login_required
 def get_outgoing_requests(request):
     """ API endpoint view that fetches outgoing requests for the logged in user """
 
-    # get the request object from the donor where the status is pending
-    outgoing_requests = DonationRequest.objects.filter(donors=request.user.donor_profile, status="Pending")
-    data = [
+    return JsonResponse({"requests": outgoing_request_data(outgoing_requests(request.user.donor_profile))})
+
+
+def outgoing_requests(donor_profile):
+    """ pending requests the donor is on """
+
+    return DonationRequest.objects.filter(donors=donor_profile, status="Pending").select_related("recipient").order_by("id")
+
+
+def outgoing_request_data(pending_requests):
+    """ the get_outgoing_requests json for each request """
+
+    return [
         {
             "id": req.id,
             "recipient_username": req.recipient.username,
             "blood_type_needed": req.blood_type_needed,
         }
-        for req in outgoing_requests
+        for req in pending_requests
+    ]
+
+
+# page size of get_notifications
+NOTIFICATIONS_PAGE_SIZE = 20
+
+
+@login_required
+def get_notifications(request):
+    """ API endpoint view that fetches the newest in-app notifications of the logged in user """
+
+    rows = Notification.objects.filter(user=request.user).order_by("-created_at", "-id").values(
+        "id", "message", "donation_request_id", "created_at", "read_at",
+    )[:NOTIFICATIONS_PAGE_SIZE]
+    data = [
+        {
+            "id": row["id"],
+            "message": row["message"],
+            "request_id": row["donation_request_id"],
+            "created_at": row["created_at"],
+            "read": row["read_at"] is not None,
+        }
+        for row in rows
     ]
-    return JsonResponse({"requests": data})
+    return JsonResponse({"notifications": data})
 
 
 @login_required
@@ -706,9 +1095,8 @@ def cancel_request(request, request_id):
         try:
             donation_request = DonationRequest.objects.get(id=request_id, requester=request.user)
 
-            # ensure only "Pending" requests can be cancelled
-            if donation_request.status == "Pending":
-                donation_request.delete()
+            # ensure only "Pending" requests can be cancelled, checked by the conditional update itself
+            if donation_request.cancel():
                 return JsonResponse({"success": True, "message": "Request cancelled."})
             else:
                 return JsonResponse({"success": False, "error": "Request cannot be cancelled."})
@@ -723,6 +1111,7 @@ def cancel_request(request, request_id):
 # Displays user details, including blood type, donation history, and compatibility.
 # allow users to view their past blood donations and requests(probably just a static view for a user, in the user page)
 # IMP:- using the get_user_model for only the register and user_profile functions for scalability of different user types later on
+# The own profile page has the profile_bootstrap json embedded, so the page loads with this one request and no api calls after it
 @login_required
 def profile_page(request, user_id):
     """ view that renders the user's profile page and allows the functionality for
@@ -731,8 +1120,8 @@ def profile_page(request, user_id):
      3- seeing auto-matched donors,
      4- cancelling requests and accepting/rejecting incoming requests """
 
-    # fetch the profile being viewed
-    viewed_user = get_object_or_404(User.objects.select_related('donor_profile'), id=user_id)
+    # fetch the profile being viewed, with the donor profile and its geocode job (the location status) in the same query
+    viewed_user = get_object_or_404(User.objects.select_related('donor_profile__geocode_job'), id=user_id)
 
     # check if the current user is viewing their own profile
     current_user = request.user
@@ -740,36 +1129,36 @@ def profile_page(request, user_id):
 
     # get donor profiles (if they exist, use None if not)
     donor_profile = getattr(viewed_user, 'donor_profile', None)
-    current_donor_profile = getattr(current_user, 'donor_profile', None)
 
-    # fetch all donation requests for the viewed user (as a recipient)
-    received_requests = DonationRequest.objects.filter(
-        recipient=viewed_user
-    ).select_related('recipient').prefetch_related('donors', 'accepted_donors')
+    # all donation requests for the viewed user (as a recipient)
+    received_requests = DonationRequest.objects.filter(recipient=viewed_user)
 
-    # check if the logged-in donor has already made a request (for 'Request' button visibility)
     has_requested = False
-    if current_donor_profile and donor_profile:
-        has_requested = received_requests.filter(
-            donors=current_donor_profile, status='Pending'
-        ).exists()
-
-    # fetch donor contact info if a request is accepted (for displaying sensitive info)
     donor_contact_info = {"email": "Hidden until accepted", "location": "Hidden until accepted"}
-    if current_donor_profile and donor_profile:
-        accepted_request = received_requests.filter(
-            donors=current_donor_profile, is_accepted=True
-        ).first()
-        if accepted_request:
-            donor_contact_info = accepted_request.donor_contact_info(current_donor_profile)
-
-    # fetch pending outgoing requests (only if viewing your own profile)
-    pending_requests = DonationRequest.objects.filter(
-        requester=current_user, status='Pending'
-    ).select_related('recipient', 'requester') if is_own_profile else None
-
-    # log and pass context
-    print(donor_profile.location)
+    bootstrap = None
+    accepted_donors = []
+
+    if is_own_profile:
+        # the accepted donors section and the first page of matches come from the same rows
+        accepted_rows = accepted_match_rows(viewed_user) if donor_profile else []
+        bootstrap = profile_bootstrap_data(viewed_user, donor_profile, accepted_rows)
+        accepted_donors = [
+            {"username": username, "blood_type": blood_type, "email": email, "location": location, "is_accepted": request_is_accepted}
+            for username, blood_type, email, location, request_is_accepted, _ in accepted_rows
+        ]
+    else:
+        current_donor_profile = getattr(current_user, 'donor_profile', None)
+        if current_donor_profile and donor_profile:
+            # the requests the logged-in donor is on, for the 'Request' button and for showing their contact info once accepted, one query
+            mine = received_requests.filter(donors=current_donor_profile).annotate(accepted_me=Exists(
+                DonationRequest.accepted_donors.through.objects.filter(donationrequest_id=OuterRef("pk"), donor_id=current_donor_profile.pk)
+            )).values_list("status", "is_accepted", "accepted_me")
+
+            for status, is_accepted, accepted_me in mine:
+                has_requested = has_requested or status == "Pending"
+                if is_accepted and accepted_me:
+                    donor_contact_info = {"email": current_user.email, "location": current_donor_profile.location}
+
     return render(request, "compatibility/user_profile.html", {
         "viewed_user": viewed_user,
         "donor_profile": donor_profile,
@@ -778,11 +1167,53 @@ def profile_page(request, user_id):
         "has_requested": has_requested,
         "donor_contact_info": donor_contact_info,
         "blood_types": BLOOD_TYPES,
-        "pending_requests": pending_requests,
+        "accepted_donors": accepted_donors,
+        "bootstrap": bootstrap,
         "date_registered": donor_profile.date_registered if donor_profile else None,
     })
 
 
+def profile_bootstrap_data(user, donor_profile, accepted_rows=None):
+    """ the edit_profile, get_requests, get_outgoing_requests and match_donors (first page) json of the users own profile, each exactly what
+     the endpoint itself answers. Only the queries the four have to make, the user and their donor profile (with its geocode job) are
+     passed in instead of each endpoint loading them again: the received and the outgoing requests, the accepted and the potential matches """
+
+    if donor_profile is None:
+        return {
+            "edit_profile": edit_profile_data(user, None, None),
+            "get_requests": {"error": "You must be a registered donor to view requests."},
+            "get_outgoing_requests": {"requests": []},
+            "match_donors": {"error": "You must be a registered donor to find matches."},
+        }
+
+    try:
+        location_status = donor_profile.geocode_job.status
+    except GeocodeJob.DoesNotExist:
+        location_status = None
+
+    if accepted_rows is None:
+        accepted_rows = accepted_match_rows(user)
+    potential, has_more = potential_match_data(user, donor_profile.blood_type, 0, MATCH_DONORS_PAGE_SIZE)
+
+    return {
+        "edit_profile": edit_profile_data(user, donor_profile, location_status),
+        "get_requests": {"requests": received_request_data(received_requests(user))},
+        "get_outgoing_requests": {"requests": outgoing_request_data(outgoing_requests(donor_profile))},
+        "match_donors": {
+            "matches": accepted_match_data(accepted_rows) + potential,
+            "next_offset": MATCH_DONORS_PAGE_SIZE if has_more else None,
+        },
+    }
+
+
+@login_required
+def profile_bootstrap(request):
+    """ API endpoint view with everything the own profile page loads in one response, see profile_bootstrap_data """
+
+    donor_profile = Donor.objects.select_related("geocode_job").filter(user=request.user).first()
+    return JsonResponse(profile_bootstrap_data(request.user, donor_profile))
+
+
 
 # view for A form where users input donor/recipient blood types to check compatibility MANUALLY
 # Users can input donor and recipient blood types into a form (HTML EMBED) OR also pass in ajax requests to the server for instant compatibility check
@@ -844,10 +1275,11 @@ def check_compatibility(request, request_id=None):
     # then in script.js, use JSON.parse() to convert it back into a JS object, so we can work with same data in JS as well.
     return render(request, "compatibility/check_compatibility.html", {
         "blood_types": blood_types,
-        "compatibility_chart": json.dumps(COMPATIBILITY_CHART)
+        "compatibility_chart": COMPATIBILITY_CHART_JSON
     })
 
 
+@require_GET
 def geocode_proxy(request):
     """ api interactins in the backend only """
 
@@ -855,12 +1287,11 @@ def geocode_proxy(request):
     if not query:
         return JsonResponse({"error": "Missing query"}, status=400)
 
-    response = requests.get(
-        "https://geocode.search.hereapi.com/v1/geocode",
-        params={"q": query, "apiKey": HERE_API_KEY}
-    )
-
-    return JsonResponse(response.json())
+    # cached and coalesced in geocoding.py, a map search for a city someone already looked up never reaches HERE
+    try:
+        return JsonResponse(geocode(query))
+    except GeocodingError:
+        return JsonResponse({"error": "Geocoding service unavailable"}, status=502)
 
 
 # Map-based Donor Search, using Here Maps API
@@ -872,9 +1303,11 @@ def map_view(request):
     })
 
 
-# not possible yet- a notification system that alerts users when a match is found or when their request status changes
+# live request notifications. The event stream itself is async_views.notifications and needs the ASGI server (an open stream would hold one of
+# the WSGI servers threads for as long as the page is open), this is what the WSGI server answers instead: 204 tells the browsers EventSource
+# to stop reconnecting, and the profile page keeps refreshing its lists after its own actions like before
 @login_required
 def notifications(request):
-    """ view that notifies users when a match is found for their request """
-
+    """ view that notifies users when a request they are part of is created, accepted, rejected or cancelled (only over ASGI) """
 
+    return HttpResponse(status=204)